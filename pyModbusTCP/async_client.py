@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+# Python module: AsyncModbusClient class (asyncio Client ModBus/TCP)
+
+# this module need Python 3 (asyncio and async/await syntax)
+
+import asyncio
+import struct
+import constants as const
+import utils as mu
+from client import request_body, response_value
+
+# MBAP header: transaction ID, protocol ID, length, unit ID
+_MBAP = struct.Struct('>HHHB')
+
+
+class AsyncModbusClient(object):
+
+    """Modbus TCP client for asyncio applications
+
+    Functions are coroutines with the same params and results than the
+    ModbusClient ones: the result is None on error, see last_error() and
+    last_except(). Each request has its own timeout.
+    Requests of several tasks share the TCP link: they are sent at once and
+    a reader task match each response to its request by transaction ID, so
+    one event loop can poll many devices, with one client per device and no
+    thread.
+    """
+
+    def __init__(self, host='localhost', port=const.MODBUS_PORT, unit_id=1, timeout=30.0, auto_open=True):
+        """Constructor
+        :param host: hostname or IPv4/IPv6 address server address (optional)
+        :type host: str
+        :param port: TCP port number (optional)
+        :type port: int
+        :param unit_id: unit ID (optional)
+        :type unit_id: int
+        :param timeout: timeout of connect and of each request in seconds (optional)
+        :type timeout: float
+        :param auto_open: connect on first request and after a link error (optional)
+        :type auto_open: bool
+        :raises ValueError: if a param value is incorrect
+        """
+        if not (0 < int(port) < 65536):
+            raise ValueError('port value error')
+        if not (0 <= int(unit_id) <= 255):
+            raise ValueError('unit_id value error')
+        if not (0 < timeout < 3600):
+            raise ValueError('timeout value error')
+        self.host = host
+        self.port = int(port)
+        self.unit_id = int(unit_id)
+        self.timeout = timeout
+        self.auto_open = auto_open
+        self._reader = None
+        self._writer = None
+        self._rx_task = None
+        self._open_lock = None
+        # tr_id -> future of the response (unit ID, body)
+        self._pending = {}
+        self._tr_id = 0
+        self._last_error = const.MB_NO_ERR
+        self._last_except = 0
+
+    def last_error(self):
+        """Get last error code
+        :return: last error code
+        :rtype: int
+        """
+        return self._last_error
+
+    def last_except(self):
+        """Get last except code
+        :return: last except code
+        :rtype: int
+        """
+        return self._last_except
+
+    def is_open(self):
+        """Get status of TCP connection
+        :returns: status (True for open)
+        :rtype: bool
+        """
+        return self._writer is not None
+
+    async def open(self):
+        """Connect to modbus server (open TCP connection)
+        :returns: connect status (True if open)
+        :rtype: bool
+        """
+        if self.is_open():
+            self.close()
+        try:
+            (reader, writer) = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                      self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            self._last_error = const.MB_CONNECT_ERR
+            return False
+        self._reader = reader
+        self._writer = writer
+        self._rx_task = asyncio.ensure_future(self._rx_loop(reader, writer))
+        return True
+
+    def close(self):
+        """Close TCP connection, requests in progress return None
+        :returns: close status (True for close/None if already close)
+        :rtype: bool or None
+        """
+        if self._writer is None:
+            return None
+        self._writer.close()
+        self._rx_task.cancel()
+        self._reader = self._writer = self._rx_task = None
+        self._fail_pending()
+        return True
+
+    async def read_coils(self, bit_addr, bit_nb=1):
+        """Modbus function READ_COILS (0x01)
+        :param bit_addr: bit address (0 to 65535)
+        :type bit_addr: int
+        :param bit_nb: number of bits to read (1 to 2000)
+        :type bit_nb: int
+        :returns: bits list or None if error
+        :rtype: list of bool or None
+        """
+        return await self._request(const.READ_COILS, bit_addr, bit_nb)
+
+    async def read_discrete_inputs(self, bit_addr, bit_nb=1):
+        """Modbus function READ_DISCRETE_INPUTS (0x02)
+        :param bit_addr: bit address (0 to 65535)
+        :type bit_addr: int
+        :param bit_nb: number of bits to read (1 to 2000)
+        :type bit_nb: int
+        :returns: bits list or None if error
+        :rtype: list of bool or None
+        """
+        return await self._request(const.READ_DISCRETE_INPUTS, bit_addr, bit_nb)
+
+    async def read_holding_registers(self, reg_addr, reg_nb=1):
+        """Modbus function READ_HOLDING_REGISTERS (0x03)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param reg_nb: number of registers to read (1 to 125)
+        :type reg_nb: int
+        :returns: registers list or None if fail
+        :rtype: list of int or None
+        """
+        return await self._request(const.READ_HOLDING_REGISTERS, reg_addr, reg_nb)
+
+    async def read_input_registers(self, reg_addr, reg_nb=1):
+        """Modbus function READ_INPUT_REGISTERS (0x04)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param reg_nb: number of registers to read (1 to 125)
+        :type reg_nb: int
+        :returns: registers list or None if fail
+        :rtype: list of int or None
+        """
+        return await self._request(const.READ_INPUT_REGISTERS, reg_addr, reg_nb)
+
+    async def write_single_coil(self, bit_addr, bit_value):
+        """Modbus function WRITE_SINGLE_COIL (0x05)
+        :param bit_addr: bit address (0 to 65535)
+        :type bit_addr: int
+        :param bit_value: bit value to write
+        :type bit_value: bool
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        return await self._request(const.WRITE_SINGLE_COIL, bit_addr, bit_value)
+
+    async def write_single_register(self, reg_addr, reg_value):
+        """Modbus function WRITE_SINGLE_REGISTER (0x06)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param reg_value: register value to write
+        :type reg_value: int
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        return await self._request(const.WRITE_SINGLE_REGISTER, reg_addr, reg_value)
+
+    async def write_multiple_coils(self, bits_addr, bits_value):
+        """Modbus function WRITE_MULTIPLE_COILS (0x0F)
+        :param bits_addr: bits address (0 to 65535)
+        :type bits_addr: int
+        :param bits_value: bits values to write
+        :type bits_value: list
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        return await self._request(const.WRITE_MULTIPLE_COILS, bits_addr, bits_value)
+
+    async def write_multiple_registers(self, regs_addr, regs_value):
+        """Modbus function WRITE_MULTIPLE_REGISTERS (0x10)
+        :param regs_addr: registers address (0 to 65535)
+        :type regs_addr: int
+        :param regs_value: registers values to write
+        :type regs_value: list
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        return await self._request(const.WRITE_MULTIPLE_REGISTERS, regs_addr, regs_value)
+
+    async def mask_write_register(self, reg_addr, and_mask, or_mask):
+        """Modbus function MASK_WRITE_REGISTER (0x16)
+        Server set the register to (value AND and_mask) OR (or_mask AND NOT and_mask).
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param and_mask: AND mask (0 to 65535)
+        :type and_mask: int
+        :param or_mask: OR mask (0 to 65535)
+        :type or_mask: int
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        if not ((0 <= int(reg_addr) <= 65535) and (0 <= int(and_mask) <= 65535) and (0 <= int(or_mask) <= 65535)):
+            return None
+        body = struct.pack('>HHH', reg_addr, and_mask, or_mask)
+        f_body = await self._transact(const.MASK_WRITE_REGISTER, body)
+        if f_body is None:
+            return None
+        # check echo of the request
+        if f_body != body:
+            self._last_error = const.MB_RECV_ERR
+            return None
+        return True
+
+    async def read_write_multiple_registers(self, read_addr, read_nb, write_addr, write_values):
+        """Modbus function READ_WRITE_MULTIPLE_REGISTERS (0x17)
+        Server do the write before the read, in one round trip.
+        :param read_addr: address of registers to read (0 to 65535)
+        :type read_addr: int
+        :param read_nb: number of registers to read (1 to 125)
+        :type read_nb: int
+        :param write_addr: address of registers to write (0 to 65535)
+        :type write_addr: int
+        :param write_values: registers values to write (1 to 121 values)
+        :type write_values: list
+        :returns: read registers list or None if fail
+        :rtype: list of int or None
+        """
+        write_nb = len(write_values)
+        if not ((0 <= int(read_addr) <= 65535) and (1 <= int(read_nb) <= 125)
+                and (int(read_addr) + int(read_nb) <= 65536)):
+            return None
+        if not ((0 <= int(write_addr) <= 65535) and (1 <= write_nb <= 121)
+                and (int(write_addr) + write_nb <= 65536)):
+            return None
+        if not all(0 <= int(reg) <= 0xffff for reg in write_values):
+            return None
+        body = struct.pack('>HHHHB%dH' % write_nb, read_addr, read_nb, write_addr, write_nb, write_nb * 2,
+                           *write_values)
+        f_body = await self._transact(const.READ_WRITE_MULTIPLE_REGISTERS, body)
+        if f_body is None:
+            return None
+        # check byte count: must be the size of the requested registers
+        if not (len(f_body) >= 1 and f_body[0] == read_nb * 2 == len(f_body) - 1):
+            self._last_error = const.MB_RECV_ERR
+            return None
+        return list(struct.unpack('>%dH' % read_nb, f_body[1:]))
+
+    async def read_longs(self, reg_addr, long_nb=1, big_endian=True):
+        """Read 32 bits integers (2 holding registers each)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param long_nb: number of integers to read (1 to 62)
+        :type long_nb: int
+        :param big_endian: True if the first register is the msw (optional)
+        :type big_endian: bool
+        :returns: unsigned integers list or None if fail
+        :rtype: list of int or None
+        """
+        if not (1 <= int(long_nb) <= 62):
+            return None
+        registers = await self.read_holding_registers(reg_addr, long_nb * 2)
+        if registers is None:
+            return None
+        return mu.word_list_to_long(registers, big_endian)
+
+    async def read_floats(self, reg_addr, float_nb=1, big_endian=True):
+        """Read IEEE single precision floats (2 holding registers each)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param float_nb: number of floats to read (1 to 62)
+        :type float_nb: int
+        :param big_endian: True if the first register is the msw (optional)
+        :type big_endian: bool
+        :returns: floats list or None if fail
+        :rtype: list of float or None
+        """
+        longs = await self.read_longs(reg_addr, float_nb, big_endian)
+        if longs is None:
+            return None
+        return [mu.decode_ieee(val_int) for val_int in longs]
+
+    async def write_longs(self, reg_addr, longs_value, big_endian=True):
+        """Write 32 bits unsigned integers (2 holding registers each)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param longs_value: integers to write (1 to 61 values)
+        :type longs_value: list
+        :param big_endian: True if the first register is the msw (optional)
+        :type big_endian: bool
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        if not all(0 <= int(val_int) <= 0xffffffff for val_int in longs_value):
+            return None
+        return await self.write_multiple_registers(reg_addr, mu.long_list_to_word(longs_value, big_endian))
+
+    async def write_floats(self, reg_addr, floats_value, big_endian=True):
+        """Write IEEE single precision floats (2 holding registers each)
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param floats_value: floats to write (1 to 61 values)
+        :type floats_value: list
+        :param big_endian: True if the first register is the msw (optional)
+        :type big_endian: bool
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        return await self.write_longs(reg_addr, [mu.encode_ieee(val) for val in floats_value], big_endian)
+
+    async def _request(self, fc, address, arg):
+        # request of a request_body() function
+        body = request_body(fc, address, arg)
+        if body is None:
+            return None
+        f_body = await self._transact(fc, body)
+        if f_body is None:
+            return None
+        value = response_value((fc, address, arg), f_body)
+        if value is None:
+            self._last_error = const.MB_RECV_ERR
+        return value
+
+    async def _transact(self, fc, body):
+        """Send a request and wait its response
+        :returns: response body (after the function code) or None if error
+        :rtype: bytes or None
+        """
+        if not self.is_open():
+            if not self.auto_open:
+                self._last_error = const.MB_SEND_ERR
+                return None
+            # concurrent requests of a closed client open it once
+            if self._open_lock is None:
+                self._open_lock = asyncio.Lock()
+            async with self._open_lock:
+                if not (self.is_open() or await self.open()):
+                    return None
+        self._tr_id = (self._tr_id + 1) & 0xffff
+        tr_id = self._tr_id
+        future = asyncio.get_event_loop().create_future()
+        self._pending[tr_id] = future
+        # no drain(): in flight requests (and so the write buffer) are bounded by the callers
+        self._writer.write(_MBAP.pack(tr_id, 0, len(body) + 2, self.unit_id) + struct.pack('B', fc) + body)
+        try:
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # a late response is dropped by the reader task
+            self._last_error = const.MB_TIMEOUT_ERR
+            return None
+        finally:
+            self._pending.pop(tr_id, None)
+        if response is None:
+            self._last_error = const.MB_RECV_ERR
+            return None
+        (rx_unit_id, rx_body) = response
+        if rx_unit_id != self.unit_id:
+            self._last_error = const.MB_RECV_ERR
+            return None
+        if rx_body[0] == fc | 0x80:
+            self._last_error = const.MB_EXCEPT_ERR
+            self._last_except = rx_body[1]
+            return None
+        if rx_body[0] != fc:
+            self._last_error = const.MB_RECV_ERR
+            return None
+        return rx_body[1:]
+
+    async def _rx_loop(self, reader, writer):
+        # read responses and wake up their requests, until link error or close()
+        try:
+            while True:
+                (tr_id, pr_id, length, unit_id) = _MBAP.unpack(await reader.readexactly(7))
+                if not ((pr_id == 0) and (3 <= length < 256)):
+                    break
+                rx_body = await reader.readexactly(length - 1)
+                future = self._pending.get(tr_id)
+                if future is not None and not future.done():
+                    future.set_result((unit_id, rx_body))
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # link is down (not closed by close()): current requests fail now, not at their timeout
+            if self._writer is writer:
+                writer.close()
+                self._reader = self._writer = self._rx_task = None
+                self._fail_pending()
+
+    def _fail_pending(self):
+        for future in list(self._pending.values()):
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Python module: asyncio engine for ModbusServer (all clients on one event loop)
+
+# this module need Python 3 (asyncio and async/await syntax)
+
+import asyncio
+import time
+from socketserver import TCPServer
+from threading import Event
+
+
+class _Timeout(Exception):
+
+    """A connection timeout expired"""
+
+
+class AsyncioTCPServer(TCPServer):
+
+    """TCP server that serve every client connection from one asyncio event loop
+
+    It keep the socketserver API used by ModbusServer (server_bind(),
+    server_activate(), serve_forever(), shutdown() and server_close()), but
+    the request handler class is never instantiated: only its static
+    frame_body_size() and process_frame() are called, so the function codes
+    semantics are the same as the threading engine.
+    ModbusServer set the modbus_server attribute to itself before serving.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
+        TCPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate)
+        self._loop = None
+        self._writers = set()
+        self._is_shut_down = Event()
+        self._shutdown_request = False
+
+    def serve_forever(self, poll_interval=0.5):
+        """Run the event loop until shutdown() is called
+        :param poll_interval: unused, here for socketserver compatibility
+        :type poll_interval: float
+        """
+        self._is_shut_down.clear()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            self.socket.setblocking(False)
+            aio_server = loop.run_until_complete(asyncio.start_server(self._handle_client, sock=self.socket))
+            # a shutdown() call during start_server() stop the wrong loop run, so check the request here
+            if not self._shutdown_request:
+                loop.run_forever()
+            # stop accept and drop current clients: an aborted transport end the reads of its
+            # task on the usual close path, tasks left are cancelled (a quiet exit too)
+            aio_server.close()
+            for writer in list(self._writers):
+                writer.transport.abort()
+            all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+            tasks = all_tasks(loop)
+            if tasks:
+                (_, pending) = loop.run_until_complete(asyncio.wait(tasks, timeout=1.0))
+                for task in pending:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        finally:
+            self._shutdown_request = False
+            self._loop = None
+            loop.close()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stop the event loop and wait until serve_forever() return
+        Must be called from another thread than the serve_forever() one.
+        """
+        # record the request first: serve_forever() check it if the loop is not yet running
+        self._shutdown_request = True
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        self._is_shut_down.wait()
+
+    async def _read_timeout(self, reader, size, timeout, deadline, reason):
+        # read size bytes, each read wait at most timeout and all of them until deadline
+        # raise _Timeout (after count the reason) on timeout
+        data = b''
+        while len(data) < size:
+            wait, wait_reason = timeout, reason
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if wait is None or left < wait:
+                    wait, wait_reason = max(left, 0.0), 'frame_timeout'
+            try:
+                chunk = await asyncio.wait_for(reader.read(size - len(data)), wait)
+            except asyncio.TimeoutError:
+                self.modbus_server.connections.count(wait_reason)
+                raise _Timeout()
+            if not chunk:
+                raise asyncio.IncompleteReadError(data, size)
+            data += chunk
+        return data
+
+    async def _handle_client(self, reader, writer):
+        service = self.RequestHandlerClass
+        server = self.modbus_server
+        limiter = server.connections
+        # a call to close() from an other connection task: abort the transport to end its reads
+        if not limiter.open(writer, writer.transport.abort):
+            writer.close()
+            return
+        self._writers.add(writer)
+        client = writer.get_extra_info('peername')
+        metrics = server.metrics
+        if metrics is not None:
+            metrics.connection_opened()
+        # without timeouts keep the readexactly() path
+        timed = not (server.idle_timeout is None and server.read_timeout is None
+                     and server.frame_timeout is None)
+        try:
+            while True:
+                if not timed:
+                    rx_head = await reader.readexactly(7)
+                    limiter.busy(writer)
+                else:
+                    # wait the frame begin up to idle_timeout, then the whole frame up to frame_timeout
+                    rx_head = await self._read_timeout(reader, 1, server.idle_timeout, None, 'idle_timeout')
+                    limiter.busy(writer)
+                    deadline = None
+                    if server.frame_timeout is not None:
+                        deadline = time.monotonic() + server.frame_timeout
+                    rx_head += await self._read_timeout(reader, 6, server.read_timeout, deadline, 'read_timeout')
+                # close connection if frame header content inconsistency
+                body_size = service.frame_body_size(rx_head)
+                if body_size is None:
+                    break
+                if not timed:
+                    rx_body = await reader.readexactly(body_size)
+                else:
+                    rx_body = await self._read_timeout(reader, body_size, server.read_timeout, deadline,
+                                                       'read_timeout')
+                # close connection if the frame can't be processed
+                tx_frame = service.process_frame(server, rx_head, rx_body, client)
+                if tx_frame is None:
+                    break
+                writer.write(tx_frame)
+                await writer.drain()
+                limiter.idle(writer)
+        except (asyncio.IncompleteReadError, ConnectionError, _Timeout):
+            # client close the connection (or lack of bytes in frame or timeout)
+            pass
+        except asyncio.CancelledError:
+            # server shutdown: end the task normally, as the stream callback log a cancelled one
+            pass
+        finally:
+            limiter.close(writer)
+            self._writers.discard(writer)
+            writer.close()
+            if metrics is not None:
+                metrics.connection_closed()
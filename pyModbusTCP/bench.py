@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Python module: loopback benchmark of ModbusServer engines with ModbusClient workers
+#
+# run it with: python -m pyModbusTCP.bench --help
+# results are printed (or saved) as JSON, to compare releases
+
+import argparse
+import json
+import platform
+import socket
+import sys
+import time
+from multiprocessing import Process, Queue
+import constants as const
+from client import ModbusClient
+from server import ModbusServer
+
+# high resolution timer (Python 3.3+)
+_timer = getattr(time, 'perf_counter', time.time)
+
+# function code -> max size (bits or registers) of one request
+MAX_SIZES = {
+    const.READ_COILS: 2000,
+    const.READ_HOLDING_REGISTERS: 125,
+    const.WRITE_SINGLE_REGISTER: 1,
+    const.WRITE_MULTIPLE_REGISTERS: 123,
+    const.READ_WRITE_MULTIPLE_REGISTERS: 121,
+}
+
+
+def _request(client, fc, size):
+    # do one request, return True if ok
+    if fc == const.READ_COILS:
+        return client.read_coils(0, size) is not None
+    elif fc == const.READ_HOLDING_REGISTERS:
+        return client.read_holding_registers(0, size) is not None
+    elif fc == const.WRITE_SINGLE_REGISTER:
+        return client.write_single_register(0, 0) is not None
+    elif fc == const.WRITE_MULTIPLE_REGISTERS:
+        return client.write_multiple_registers(0, [0] * size) is not None
+    elif fc == const.READ_WRITE_MULTIPLE_REGISTERS:
+        return client.read_write_multiple_registers(0, size, 0, [0] * size) is not None
+    raise ValueError('fc value error')
+
+
+def _serve(engine, port, no_delay):
+    # server process
+    ModbusServer(port=port, engine=engine, no_delay=no_delay).start()
+
+
+def _worker(port, fc, size, start, duration, results):
+    # client process: requests in a loop from start to start + duration
+    client = ModbusClient(port=port, auto_open=True)
+    latencies = []
+    errors = 0
+    while time.time() < start:
+        time.sleep(0.001)
+    end = _timer() + duration
+    while True:
+        t_req = _timer()
+        if t_req >= end:
+            break
+        if _request(client, fc, size):
+            latencies.append(_timer() - t_req)
+        else:
+            errors += 1
+    client.close()
+    results.put((latencies, errors))
+
+
+def _wait_port(port, timeout=10.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.5).close()
+            return True
+        except socket.error:
+            time.sleep(0.05)
+    return False
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(engine, no_delay, fc, size, clients, duration, port):
+    """Run one benchmark case: a server and clients worker processes
+    :returns: case result (requests, errors, req/s and latencies in ms)
+    :rtype: dict
+    """
+    server = Process(target=_serve, args=(engine, port, no_delay))
+    server.daemon = True
+    server.start()
+    try:
+        if not _wait_port(port):
+            raise RuntimeError('benchmark server not started on port %d' % port)
+        results = Queue()
+        # all workers start at the same time, after all processes are up
+        start = time.time() + 0.2 + 0.01 * clients
+        workers = [Process(target=_worker, args=(port, fc, size, start, duration, results))
+                   for _ in range(clients)]
+        for worker in workers:
+            worker.start()
+        latencies = []
+        errors = 0
+        for _ in workers:
+            (w_latencies, w_errors) = results.get()
+            latencies.extend(w_latencies)
+            errors += w_errors
+        for worker in workers:
+            worker.join()
+    finally:
+        server.terminate()
+        server.join()
+    latencies.sort()
+
+    def ms(value):
+        return None if value is None else round(value * 1000.0, 4)
+
+    return {'engine': engine, 'no_delay': no_delay, 'fc': fc, 'size': size, 'clients': clients,
+            'duration': duration, 'requests': len(latencies), 'errors': errors,
+            'req_per_s': round(len(latencies) / duration, 1),
+            'p50_ms': ms(_percentile(latencies, 50)), 'p99_ms': ms(_percentile(latencies, 99)),
+            'mean_ms': ms(sum(latencies) / len(latencies) if latencies else None)}
+
+
+def run_benchmark(engines=('thread', 'asyncio', 'selectors'), no_delays=(True,), functions=(3,),
+                  sizes=(1, 125), clients=4, duration=2.0, port=5502):
+    """Run every combination of engines, no_delay options, function codes and sizes
+    Sizes over the max of a function code are skipped.
+    :returns: JSON ready dict with the environment, the params and a list of cases results
+    :rtype: dict
+    """
+    results = []
+    for engine in engines:
+        for no_delay in no_delays:
+            for fc in functions:
+                for size in sizes:
+                    if size > MAX_SIZES[fc]:
+                        continue
+                    results.append(run_case(engine, no_delay, fc, size, clients, duration, port))
+                    # a new port for each case: no wait on TIME_WAIT sockets
+                    port += 1
+    return {'version': const.VERSION, 'python': sys.version.split()[0], 'platform': platform.platform(),
+            'params': {'clients': clients, 'duration': duration},
+            'results': results}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m pyModbusTCP.bench',
+                                     description='loopback benchmark of ModbusServer engines')
+    parser.add_argument('--engines', default='thread,asyncio,selectors',
+                        help='comma separated server engines (default: %(default)s)')
+    parser.add_argument('--no-delay', default='on', choices=('on', 'off', 'both'),
+                        help='server TCP_NODELAY option (default: %(default)s)')
+    parser.add_argument('--functions', default='3,16',
+                        help='comma separated function codes, among %s (default: %%(default)s)'
+                             % ','.join(str(fc) for fc in sorted(MAX_SIZES)))
+    parser.add_argument('--sizes', default='1,125', help='comma separated bits or registers '
+                                                        'numbers per request (default: %(default)s)')
+    parser.add_argument('--clients', type=int, default=4, help='client processes (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds per case (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=5502, help='first TCP port (default: %(default)s)')
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args(args)
+    functions = [int(fc) for fc in args.functions.split(',')]
+    for fc in functions:
+        if fc not in MAX_SIZES:
+            parser.error('function code %d not supported' % fc)
+    no_delays = {'on': (True,), 'off': (False,), 'both': (True, False)}[args.no_delay]
+    report = run_benchmark(engines=args.engines.split(','), no_delays=no_delays, functions=functions,
+                           sizes=[int(size) for size in args.sizes.split(',')], clients=args.clients,
+                           duration=args.duration, port=args.port)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,6 @@ import re
 import socket
 import select
 import struct
-import random
 import binascii
 
 
@@ -279,6 +278,26 @@ class ModbusClient:
         """
         return self.__sock is not None
 
+    def is_alive(self):
+        """Check the TCP link with no request (for idle links)
+        An idle link must have nothing to read: data is the end of a link
+        closed by the server or a response to a timed out request. In both
+        cases the link is closed.
+        :returns: status (True if open and usable)
+        :rtype: bool
+        """
+        if self.__sock is None:
+            return False
+        try:
+            readable = select.select([self.__sock], [], [], 0)[0]
+        except (socket.error, ValueError):
+            readable = True
+        if readable:
+            self.__debug_msg('is_alive(): link closed or unexpected data')
+            self.close()
+            return False
+        return True
+
     def close(self):
         """Close TCP connection
         :returns: close status (True for close/None if already close)
@@ -823,6 +842,185 @@ class ModbusClient:
         is_ok = (rx_reg_addr == regs_addr)
         return True if is_ok else None
 
+    def mask_write_register(self, reg_addr, and_mask, or_mask):
+        """Modbus function MASK_WRITE_REGISTER (0x16)
+        Server set the register to (value AND and_mask) OR (or_mask AND NOT and_mask).
+        :param reg_addr: register address (0 to 65535)
+        :type reg_addr: int
+        :param and_mask: AND mask (0 to 65535)
+        :type and_mask: int
+        :param or_mask: OR mask (0 to 65535)
+        :type or_mask: int
+        :returns: True if write ok or None if fail
+        :rtype: bool or None
+        """
+        # check params
+        if not (0 <= int(reg_addr) <= 65535):
+            self.__debug_msg('mask_write_register(): reg_addr out of range')
+            return None
+        if not ((0 <= int(and_mask) <= 65535) and (0 <= int(or_mask) <= 65535)):
+            self.__debug_msg('mask_write_register(): mask out of range')
+            return None
+        # build frame
+        tx_buffer = self._mbus_frame(const.MASK_WRITE_REGISTER,
+                                     struct.pack('>HHH', reg_addr, and_mask, or_mask))
+        # send request
+        s_send = self._send_mbus(tx_buffer)
+        # check error
+        if not s_send:
+            return None
+        # receive
+        f_body = self._recv_mbus()
+        # check error
+        if not f_body:
+            return None
+        # check fix frame size
+        if len(f_body) != 6:
+            self.__last_error = const.MB_RECV_ERR
+            self.__debug_msg('mask_write_register(): rx frame size error')
+            self.close()
+            return None
+        # check echo of the request
+        is_ok = struct.unpack('>HHH', f_body) == (reg_addr, and_mask, or_mask)
+        return True if is_ok else None
+
+    def read_write_multiple_registers(self, read_addr, read_nb, write_addr, write_values):
+        """Modbus function READ_WRITE_MULTIPLE_REGISTERS (0x17)
+        Server do the write before the read, in one round trip.
+        :param read_addr: address of registers to read (0 to 65535)
+        :type read_addr: int
+        :param read_nb: number of registers to read (1 to 125)
+        :type read_nb: int
+        :param write_addr: address of registers to write (0 to 65535)
+        :type write_addr: int
+        :param write_values: registers values to write (1 to 121 values)
+        :type write_values: list
+        :returns: read registers list or None if fail
+        :rtype: list of int or None
+        """
+        write_nb = len(write_values)
+        # check params
+        if not ((0 <= int(read_addr) <= 65535) and (1 <= int(read_nb) <= 125)
+                and (int(read_addr) + int(read_nb) <= 65536)):
+            self.__debug_msg('read_write_multiple_registers(): read range error')
+            return None
+        if not ((0 <= int(write_addr) <= 65535) and (1 <= write_nb <= 121)
+                and (int(write_addr) + write_nb <= 65536)):
+            self.__debug_msg('read_write_multiple_registers(): write range error')
+            return None
+        for reg in write_values:
+            if not (0 <= int(reg) <= 0xffff):
+                self.__debug_msg('read_write_multiple_registers(): write_values out of range')
+                return None
+        # build frame
+        body = struct.pack('>HHHHB%dH' % write_nb, read_addr, read_nb, write_addr, write_nb, write_nb * 2,
+                           *write_values)
+        tx_buffer = self._mbus_frame(const.READ_WRITE_MULTIPLE_REGISTERS, body)
+        # send request
+        s_send = self._send_mbus(tx_buffer)
+        # check error
+        if not s_send:
+            return None
+        # receive
+        f_body = self._recv_mbus()
+        # check error
+        if not f_body:
+            return None
+        # check byte count: must be the size of the requested registers
+        if not (len(f_body) >= 1 and struct.unpack('B', f_body[0:1])[0] == read_nb * 2 == len(f_body) - 1):
+            self.__last_error = const.MB_RECV_ERR
+            self.__debug_msg('read_write_multiple_registers(): rx byte count mismatch')
+            self.close()
+            return None
+        return list(struct.unpack('>%dH' % read_nb, f_body[1:]))
+
+    def pipeline(self, requests, window=16):
+        """Do a list of requests with up to window requests in flight on the TCP link
+        Requests are sent without waiting for the previous responses, each
+        response is matched with its request by transaction ID (the server
+        can answer out of order). A read of 50 blocks cost about one round
+        trip instead of 50. Modbus/TCP mode only.
+        Requests items are (function code, address, arg) tuples, arg is the
+        number of bits/registers to read, the value to write (functions 0x05,
+        0x06) or the list of values to write (functions 0x0F, 0x10).
+        :param requests: requests list, for functions 0x01 to 0x06, 0x0F and 0x10
+        :type requests: list
+        :param window: max number of requests in flight (1 to 256)
+        :type window: int
+        :returns: one result per request (as the matching function: bits list,
+                  registers list or True), None for each failed request, or None
+                  if params are incorrect
+        :rtype: list or None
+        """
+        if self.__mode != const.MODBUS_TCP:
+            self.__debug_msg('pipeline(): Modbus/TCP mode only')
+            return None
+        if not (1 <= int(window) <= 256):
+            self.__debug_msg('pipeline(): window out of range')
+            return None
+        # build all frames first: a bad request fail the call, before any send
+        frames = []
+        for request in requests:
+            body = request_body(*request)
+            if body is None:
+                self.__debug_msg('pipeline(): bad request %r' % (request,))
+                return None
+            frames.append((self._mbus_frame(request[0], body), self.__hd_tr_id))
+        results = [None] * len(frames)
+        if not frames:
+            return results
+        # for auto_open mode, check TCP and open if need
+        if self.__auto_open and not self.is_open():
+            self.open()
+        # tr_id -> request index
+        in_flight = {}
+        next_i = 0
+        while next_i < len(frames) or in_flight:
+            # fill the window, with one send for all new frames
+            if next_i < len(frames) and len(in_flight) < window:
+                end_i = min(len(frames), next_i + window - len(in_flight))
+                for i in range(next_i, end_i):
+                    in_flight[frames[i][1]] = i
+                tx_buffer = b''.join(frame for (frame, tr_id) in frames[next_i:end_i])
+                next_i = end_i
+                if not self._send_mbus(tx_buffer):
+                    break
+            # wait one response
+            rx_head = self._recv_all(7)
+            if not rx_head:
+                break
+            (rx_hd_tr_id, rx_hd_pr_id, rx_hd_length, rx_hd_unit_id) = struct.unpack('>HHHB', rx_head)
+            if not ((rx_hd_tr_id in in_flight) and (rx_hd_pr_id == 0) and
+                    (2 < rx_hd_length < 256) and (rx_hd_unit_id == self.__unit_id)):
+                self.__last_error = const.MB_RECV_ERR
+                self.__debug_msg('MBAP format error')
+                self.close()
+                break
+            rx_buffer = self._recv_all(rx_hd_length - 1)
+            if not rx_buffer:
+                break
+            if self.__debug:
+                self._pretty_dump('Rx', rx_head + rx_buffer)
+            i = in_flight.pop(rx_hd_tr_id)
+            rx_bd_fc = struct.unpack('B', rx_buffer[0:1])[0]
+            if rx_bd_fc > 0x80:
+                # except code
+                self.__last_error = const.MB_EXCEPT_ERR
+                self.__last_except = struct.unpack('B', rx_buffer[1:2])[0]
+                self.__debug_msg('except (code ' + str(self.__last_except) + ')')
+            elif rx_bd_fc != requests[i][0]:
+                self.__last_error = const.MB_RECV_ERR
+                self.__debug_msg('pipeline(): rx function code mismatch')
+            else:
+                results[i] = response_value(requests[i], rx_buffer[1:])
+                if results[i] is None:
+                    self.__last_error = const.MB_RECV_ERR
+                    self.__debug_msg('pipeline(): rx frame error')
+        # for auto_close mode, close socket after the requests
+        if self.__auto_close:
+            self.close()
+        return results
+
     def _can_read(self):
         """Wait data available for socket read
         :returns: True if data available or None if timeout or socket error
@@ -1032,7 +1230,8 @@ class ModbusClient:
         # modbus/TCP
         if self.__mode == const.MODBUS_TCP:
             # build frame ModBus Application Protocol header (mbap)
-            self.__hd_tr_id = random.randint(0, 65535)
+            # sequential transaction ID: pipeline() match responses with it
+            self.__hd_tr_id = (self.__hd_tr_id + 1) & 0xffff
             tx_hd_pr_id = 0
             tx_hd_length = len(f_body) + 1
             f_mbap = struct.pack('>HHHB', self.__hd_tr_id, tx_hd_pr_id,
@@ -1097,4 +1296,75 @@ class ModbusClient:
         :type msg: str
         """
         if self.__debug:
-            print(msg)
\ No newline at end of file
+            print(msg)
+
+
+def request_body(fc, address, arg):
+    """Build the body (after the function code) of a request
+    Used by ModbusClient.pipeline() and AsyncModbusClient.
+    :param fc: function code (0x01 to 0x06, 0x0F or 0x10)
+    :type fc: int
+    :param address: first bit or register address
+    :type address: int
+    :param arg: number of bits/registers to read, value to write (0x05, 0x06)
+                or list of values to write (0x0F, 0x10)
+    :type arg: int, bool or list
+    :returns: frame body or None if a param is incorrect
+    :rtype: bytes or None
+    """
+    if not (0 <= int(address) <= 0xffff):
+        return None
+    if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS,
+              const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
+        max_nb = 2000 if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS) else 125
+        if not ((1 <= int(arg) <= max_nb) and (int(address) + int(arg) <= 0x10000)):
+            return None
+        return struct.pack('>HH', address, arg)
+    elif fc == const.WRITE_SINGLE_COIL:
+        return struct.pack('>HBB', address, 0xFF if arg else 0x00, 0)
+    elif fc == const.WRITE_SINGLE_REGISTER:
+        if not (0 <= int(arg) <= 0xffff):
+            return None
+        return struct.pack('>HH', address, arg)
+    elif fc == const.WRITE_MULTIPLE_COILS:
+        if not ((1 <= len(arg) <= 0x07b0) and (int(address) + len(arg) <= 0x10000)):
+            return None
+        bytes_l = bytearray((len(arg) + 7) // 8)
+        for i, item in enumerate(arg):
+            if item:
+                bytes_l[i // 8] = set_bit(bytes_l[i // 8], i % 8)
+        return struct.pack('>HHB', address, len(arg), len(bytes_l)) + bytes(bytes_l)
+    elif fc == const.WRITE_MULTIPLE_REGISTERS:
+        if not ((1 <= len(arg) <= 0x007b) and (int(address) + len(arg) <= 0x10000)):
+            return None
+        for reg in arg:
+            if not (0 <= int(reg) <= 0xffff):
+                return None
+        return struct.pack('>HHB%dH' % len(arg), address, len(arg), len(arg) * 2, *arg)
+    return None
+
+
+def response_value(request, f_body):
+    """Decode the response body (after the function code) of a request_body() request
+    :param request: (function code, address, arg) of the request
+    :type request: tuple
+    :param f_body: response body
+    :type f_body: bytes
+    :returns: bits list, registers list, True (writes) or None if the body is incorrect
+    :rtype: list, bool or None
+    """
+    (fc, address, arg) = request
+    if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS):
+        f_bits = bytearray(f_body[1:])
+        if not (len(f_body) >= 2 and f_body[0:1] == struct.pack('B', len(f_bits))
+                and len(f_bits) >= (arg + 7) // 8):
+            return None
+        return [bool(f_bits[i // 8] >> (i % 8) & 0x01) for i in range(arg)]
+    elif fc in (const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
+        if not (len(f_body) == 1 + 2 * arg and f_body[0:1] == struct.pack('B', 2 * arg)):
+            return None
+        return list(struct.unpack('>%dH' % arg, f_body[1:]))
+    # writes: check the echo of the address
+    if not (len(f_body) == 4 and struct.unpack('>H', f_body[:2])[0] == address):
+        return None
+    return True
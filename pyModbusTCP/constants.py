@@ -14,6 +14,8 @@ WRITE_SINGLE_COIL = 0x05
 WRITE_SINGLE_REGISTER = 0x06
 WRITE_MULTIPLE_COILS = 0x0F
 WRITE_MULTIPLE_REGISTERS = 0x10
+MASK_WRITE_REGISTER = 0x16
+READ_WRITE_MULTIPLE_REGISTERS = 0x17
 MODBUS_ENCAPSULATED_INTERFACE = 0x2B
 ## Modbus except code
 EXP_NONE = 0x00
@@ -35,4 +37,13 @@ MB_RECV_ERR = 4
 MB_TIMEOUT_ERR = 5
 MB_FRAME_ERR = 6
 MB_EXCEPT_ERR = 7
-MB_CRC_ERR = 8
\ No newline at end of file
+MB_CRC_ERR = 8
+## Words value types (export and read plan)
+# struct format and registers per value (big endian, first register is the msw)
+WORDS_TYPES = {
+    'raw': ('>H', 1),
+    'int16': ('>h', 1),
+    'int32': ('>i', 2),
+    'float32': ('>f', 2),
+    'float64': ('>d', 4),
+}
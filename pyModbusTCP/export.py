@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Python module: CSV export of DataBank ranges and Historian changes
+
+import binascii
+import constants as const
+import csv
+import os
+import settings
+import struct
+import sys
+import time
+from itertools import islice
+import utils as mu
+
+
+def _open_csv(path):
+    # csv module want a binary file on Python 2, a text file without newline translation on Python 3
+    if sys.version_info < (3,):
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def _default_path(name):
+    return os.path.join(settings.CSV_DUMP_Path, '%s_%s.csv' % (name, time.strftime('%Y%m%d_%H%M%S')))
+
+
+def _range_rows(bits, words, v_type, address, number):
+    # rows (type, address, raw, value) of a range, values are decoded on the fly
+    if v_type == 'bits':
+        first = address >> 3
+        shift = address & 0x07
+        values = mu.bytes_to_bits(bits[first:first + (shift + number + 7) // 8], shift + number)[shift:]
+        for i, value in enumerate(values):
+            yield ('bits', address + i, int(value), int(value))
+    elif v_type == 'ascii':
+        raw = words[address * 2:(address + number) * 2]
+        yield ('ascii', address, binascii.hexlify(raw).decode(), raw.rstrip(b'\x00').decode('ascii', 'replace'))
+    else:
+        (fmt, size) = const.WORDS_TYPES[v_type]
+        for i in range(number):
+            offset = (address + i * size) * 2
+            raw = words[offset:offset + size * 2]
+            yield (v_type, address + i * size, binascii.hexlify(raw).decode(), struct.unpack(fmt, raw)[0])
+
+
+def export_ranges(data_bank, ranges, path=None):
+    """Write ranges of a data bank to a CSV file
+    The spaces are copied at one point in time (see DataBank.get_spaces()),
+    then rows are decoded and written one at a time: Modbus clients are
+    only held off during the copy and memory use do not grow with ranges.
+    CSV columns are type, address, raw (hex) and value.
+    :param data_bank: the data bank to export
+    :type data_bank: DataBank
+    :param ranges: (type, address, number of values) tuples, type is 'bits',
+                   'ascii' (number of registers, one row) or a constants.WORDS_TYPES key
+    :type ranges: list
+    :param path: CSV file, a timestamped file in settings CSV_DUMP_Path by default (optional)
+    :type path: str
+    :returns: the CSV file path
+    :rtype: str
+    :raises ValueError: if a range is incorrect
+    """
+    for (v_type, address, number) in ranges:
+        if not (v_type in const.WORDS_TYPES or v_type in ('bits', 'ascii')):
+            raise ValueError('range type error')
+        size = const.WORDS_TYPES[v_type][1] if v_type in const.WORDS_TYPES else 1
+        if not ((address >= 0) and (number >= 1) and (address + number * size <= 0x10000)):
+            raise ValueError('range address error')
+    if path is None:
+        path = _default_path('registers')
+    (bits, words) = data_bank.get_spaces()
+    with _open_csv(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(('type', 'address', 'raw', 'value'))
+        for (v_type, address, number) in ranges:
+            writer.writerows(_range_rows(bits, words, v_type, address, number))
+    return path
+
+
+def export_history(historian, path=None, kind=None, start=None, end=None, chunk_size=1000):
+    """Write the changes recorded by a historian to a CSV file
+    Changes are read and written by chunks of chunk_size rows (bounded
+    memory), each chunk is a short read of the database.
+    CSV columns are timestamp, kind, address, old value, new value and client.
+    :param historian: the historian
+    :type historian: Historian
+    :param path: CSV file, a timestamped file in settings CSV_DUMP_Path by default (optional)
+    :type path: str
+    :param kind: 'bits', 'words' or None for both (optional)
+    :type kind: str
+    :param start: first timestamp (optional)
+    :type start: float
+    :param end: last timestamp, excluded (optional)
+    :type end: float
+    :param chunk_size: rows read and written at once (optional)
+    :type chunk_size: int
+    :returns: the CSV file path
+    :rtype: str
+    """
+    if path is None:
+        path = _default_path('history')
+    rows = historian.history(kind=kind, start=start, end=end, chunk_size=chunk_size)
+    with _open_csv(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(('timestamp', 'kind', 'address', 'old_value', 'new_value', 'client'))
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+    return path
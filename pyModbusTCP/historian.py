@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Python module: SQLite historian of DataBank writes
+
+import logging
+import os
+import settings
+import shutil
+import sqlite3
+import struct
+import time
+from threading import Event, Lock, Thread
+import utils as mu
+
+# for python2 compatibility
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
+
+logger = logging.getLogger('pyModbusTCP.historian')
+
+
+class Historian(object):
+
+    """Record the writes of data banks to a SQLite database
+
+    Set it as the historian attribute of a DataBank. Each write is queued
+    as is by the write path, with no database access: a background thread
+    expand it to one row per address (old value, new value, timestamp and
+    client) and commit the rows in batched transactions. When the queue is
+    full, writes are dropped and counted instead of blocking the Modbus
+    write path (see get_stats()).
+    """
+
+    def __init__(self, path=None, max_queue=10000, batch_size=1000, flush_interval=1.0):
+        """Constructor
+        :param path: database file, settings DATABASE_PATH and DATABASE_NAME by default (optional)
+        :type path: str
+        :param max_queue: max number of queued writes (optional)
+        :type max_queue: int
+        :param batch_size: max number of writes committed in one transaction (optional)
+        :type batch_size: int
+        :param flush_interval: max seconds a write wait in the queue (optional)
+        :type flush_interval: float
+        :raises ValueError: if a param is incorrect
+        """
+        if not (int(max_queue) >= 1 and int(batch_size) >= 1 and flush_interval > 0):
+            raise ValueError('historian param value error')
+        if path is None:
+            path = os.path.join(settings.DATABASE_PATH, settings.DATABASE_NAME)
+        self.path = path
+        self.batch_size = int(batch_size)
+        self.flush_interval = flush_interval
+        # stats
+        self.recorded = 0
+        self.dropped = 0
+        self.committed = 0
+        self._stats_lock = Lock()
+        self._queue = Queue(int(max_queue))
+        self._closed = Event()
+        # create the table now: errors are raised here, not in the writer thread
+        con = sqlite3.connect(self.path)
+        try:
+            con.execute('CREATE TABLE IF NOT EXISTS changes ('
+                        'id INTEGER PRIMARY KEY, timestamp REAL, kind TEXT, address INTEGER, '
+                        'old_value INTEGER, new_value INTEGER, client TEXT)')
+            con.execute('CREATE INDEX IF NOT EXISTS changes_timestamp ON changes (timestamp)')
+            con.commit()
+        finally:
+            con.close()
+        self._writer_th = Thread(target=self._writer)
+        self._writer_th.daemon = True
+        self._writer_th.start()
+
+    def record(self, kind, address, number, old_bytes, new_bytes, client=None):
+        """Queue a write, never block (called by DataBank under its write lock)
+        :param kind: 'bits' or 'words'
+        :type kind: str
+        :param address: first written address
+        :type address: int
+        :param number: number of written addresses
+        :type number: int
+        :param old_bytes: space before the write (words, or bytes of the bits with the write)
+        :type old_bytes: bytes
+        :param new_bytes: space after the write (same layout than old_bytes)
+        :type new_bytes: bytes
+        :param client: address of the client (optional)
+        :type client: tuple
+        :returns: True if queued, False if dropped
+        :rtype: bool
+        """
+        try:
+            self._queue.put_nowait((time.time(), kind, address, number, old_bytes, new_bytes, client))
+        except Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.recorded += 1
+        return True
+
+    def flush(self):
+        """Wait until every queued write is committed"""
+        self._queue.join()
+
+    def close(self):
+        """Commit the queued writes and stop the writer thread"""
+        if not self._closed.is_set():
+            self.flush()
+            self._closed.set()
+            self._writer_th.join()
+
+    def backup(self, path=None):
+        """Copy the database, after a flush
+        :param path: backup file, settings DATABASE_BACKUP_PATH and DATABASE_NAME by default (optional)
+        :type path: str
+        :returns: the backup file path
+        :rtype: str
+        """
+        if path is None:
+            path = os.path.join(settings.DATABASE_BACKUP_PATH, settings.DATABASE_NAME)
+        self.flush()
+        con = sqlite3.connect(self.path)
+        try:
+            # a reserved lock keep the writer thread out during the copy
+            con.execute('BEGIN IMMEDIATE')
+            shutil.copyfile(self.path, path)
+            con.rollback()
+        finally:
+            con.close()
+        return path
+
+    def history(self, kind=None, start=None, end=None, chunk_size=1000):
+        """Iterate over recorded changes, read by chunks (bounded memory)
+        :param kind: 'bits', 'words' or None for both (optional)
+        :type kind: str
+        :param start: first timestamp (optional)
+        :type start: float
+        :param end: last timestamp, excluded (optional)
+        :type end: float
+        :param chunk_size: rows read at once (optional)
+        :type chunk_size: int
+        :returns: (timestamp, kind, address, old value, new value, client) tuples in record order
+        :rtype: generator
+        """
+        where = ['id > ?']
+        params = []
+        if kind is not None:
+            where.append('kind = ?')
+            params.append(kind)
+        if start is not None:
+            where.append('timestamp >= ?')
+            params.append(start)
+        if end is not None:
+            where.append('timestamp < ?')
+            params.append(end)
+        query = ('SELECT id, timestamp, kind, address, old_value, new_value, client FROM changes '
+                 'WHERE %s ORDER BY id LIMIT %d' % (' AND '.join(where), int(chunk_size)))
+        con = sqlite3.connect(self.path)
+        try:
+            last_id = 0
+            while True:
+                # keyset pagination: each chunk is a short read, the writer is never held off
+                rows = con.execute(query, [last_id] + params).fetchall()
+                for row in rows:
+                    yield row[1:]
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1][0]
+        finally:
+            con.close()
+
+    def get_stats(self):
+        """Return recorded, dropped, committed writes and current queue size"""
+        with self._stats_lock:
+            return {'recorded': self.recorded, 'dropped': self.dropped,
+                    'committed': self.committed, 'queued': self._queue.qsize()}
+
+    @staticmethod
+    def _rows(change):
+        # expand a queued write to one row per address
+        (timestamp, kind, address, number, old_bytes, new_bytes, client) = change
+        if client is not None:
+            client = '%s:%s' % tuple(client[:2])
+        if kind == 'words':
+            old_values = struct.unpack('>%dH' % number, old_bytes)
+            new_values = struct.unpack('>%dH' % number, new_bytes)
+        else:
+            # bits bytes start at the byte of the first written bit
+            shift = address & 0x07
+            old_values = mu.bytes_to_bits(old_bytes, shift + number)[shift:]
+            new_values = mu.bytes_to_bits(new_bytes, shift + number)[shift:]
+        return [(timestamp, kind, address + i, int(old_values[i]), int(new_values[i]), client)
+                for i in range(number)]
+
+    def _writer(self):
+        con = sqlite3.connect(self.path)
+        try:
+            while not (self._closed.is_set() and self._queue.empty()):
+                try:
+                    batch = [self._queue.get(timeout=self.flush_interval)]
+                except Empty:
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Empty:
+                        break
+                try:
+                    rows = []
+                    for change in batch:
+                        rows.extend(self._rows(change))
+                    # one transaction for the whole batch
+                    with con:
+                        con.executemany('INSERT INTO changes (timestamp, kind, address, old_value, new_value, '
+                                        'client) VALUES (?, ?, ?, ?, ?, ?)', rows)
+                    with self._stats_lock:
+                        self.committed += len(batch)
+                except Exception:
+                    # a database error lose this batch, not the next ones
+                    logger.exception('%d writes not recorded', len(batch))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            con.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Python module: ModbusServer metrics (counters, latency histograms and Prometheus text export)
+
+import bisect
+from threading import Lock, Thread
+
+# for python2 compatibility
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# latency histogram buckets upper bounds (seconds), the last bucket is +Inf
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+
+class _Stats(object):
+
+    """Counters of the requests of one function code or one unit ID"""
+
+    def __init__(self):
+        self.requests = 0
+        self.exceptions = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency_sum = 0.0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, exp_status, bytes_in, bytes_out, latency):
+        self.requests += 1
+        if exp_status:
+            self.exceptions[exp_status] = self.exceptions.get(exp_status, 0) + 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.latency_sum += latency
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def as_dict(self):
+        return {'requests': self.requests, 'exceptions': dict(self.exceptions),
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'latency_sum': self.latency_sum, 'latency_counts': list(self.latency_counts)}
+
+
+class ServerMetrics(object):
+
+    """Metrics of a ModbusServer
+
+    Every processed request update a few counters of its function code and
+    of its unit ID under one lock, nothing else is done until someone read
+    the metrics, with get_stats(), to_prometheus() or the HTTP endpoint (see
+    start_http()).
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.connections_total = 0
+        self._lock = Lock()
+        self._functions = {}
+        self._units = {}
+        self._http = None
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections -= 1
+
+    def record(self, fc, unit_id, exp_status, bytes_in, bytes_out, latency):
+        """Add a processed request
+        :param fc: function code
+        :type fc: int
+        :param unit_id: unit ID
+        :type unit_id: int
+        :param exp_status: exception status (const.EXP_NONE if none)
+        :type exp_status: int
+        :param bytes_in: request frame size
+        :type bytes_in: int
+        :param bytes_out: response frame size
+        :type bytes_out: int
+        :param latency: processing time in seconds
+        :type latency: float
+        """
+        with self._lock:
+            fc_stats = self._functions.get(fc)
+            if fc_stats is None:
+                fc_stats = self._functions[fc] = _Stats()
+            fc_stats.add(exp_status, bytes_in, bytes_out, latency)
+            unit_stats = self._units.get(unit_id)
+            if unit_stats is None:
+                unit_stats = self._units[unit_id] = _Stats()
+            unit_stats.add(exp_status, bytes_in, bytes_out, latency)
+
+    def get_stats(self):
+        """Return a copy of the metrics
+        Per function code and per unit ID dicts hold requests, exceptions (status -> count),
+        bytes_in, bytes_out, latency_sum and latency_counts (one count per LATENCY_BUCKETS
+        bucket, then the +Inf one).
+        :returns: dict with connections, connections_total, functions and units keys
+        :rtype: dict
+        """
+        with self._lock:
+            return {'connections': self.connections,
+                    'connections_total': self.connections_total,
+                    'functions': dict((fc, s.as_dict()) for fc, s in self._functions.items()),
+                    'units': dict((unit_id, s.as_dict()) for unit_id, s in self._units.items())}
+
+    def to_prometheus(self):
+        """Return the metrics in Prometheus text exposition format
+        :rtype: str
+        """
+        stats = self.get_stats()
+        lines = ['# TYPE modbus_connections gauge',
+                 'modbus_connections %d' % stats['connections'],
+                 '# TYPE modbus_connections_total counter',
+                 'modbus_connections_total %d' % stats['connections_total']]
+        for (label, group) in (('fc', 'functions'), ('unit', 'units')):
+            prefix = 'modbus_%s' % group
+            items = sorted(stats[group].items())
+            lines.append('# TYPE %s_requests_total counter' % prefix)
+            lines.extend('%s_requests_total{%s="%d"} %d' % (prefix, label, key, s['requests'])
+                         for key, s in items)
+            lines.append('# TYPE %s_exceptions_total counter' % prefix)
+            for key, s in items:
+                lines.extend('%s_exceptions_total{%s="%d",code="%d"} %d' % (prefix, label, key, code, n)
+                             for code, n in sorted(s['exceptions'].items()))
+            for way in ('in', 'out'):
+                lines.append('# TYPE %s_bytes_%s_total counter' % (prefix, way))
+                lines.extend('%s_bytes_%s_total{%s="%d"} %d' % (prefix, way, label, key, s['bytes_' + way])
+                             for key, s in items)
+            lines.append('# TYPE %s_latency_seconds histogram' % prefix)
+            for key, s in items:
+                cumulative = 0
+                for (bound, count) in zip(LATENCY_BUCKETS + ('+Inf',), s['latency_counts']):
+                    cumulative += count
+                    lines.append('%s_latency_seconds_bucket{%s="%d",le="%s"} %d'
+                                 % (prefix, label, key, bound, cumulative))
+                lines.append('%s_latency_seconds_sum{%s="%d"} %r' % (prefix, label, key, s['latency_sum']))
+                lines.append('%s_latency_seconds_count{%s="%d"} %d' % (prefix, label, key, s['requests']))
+        return '\n'.join(lines) + '\n'
+
+    def start_http(self, host='localhost', port=9502):
+        """Serve to_prometheus() on http://host:port/metrics from a background thread
+        Do nothing if already started.
+        :param host: listen address (optional)
+        :type host: str
+        :param port: TCP port (optional)
+        :type port: int
+        """
+        if self._http is not None:
+            return
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # no log on each scrape
+                pass
+
+        self._http = HTTPServer((host, port), MetricsHandler)
+        http_th = Thread(target=self._http.serve_forever)
+        http_th.daemon = True
+        http_th.start()
+
+    def stop_http(self):
+        """Stop the HTTP endpoint, if started"""
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
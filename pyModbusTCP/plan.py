@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Python module: ReadPlan class (merge scattered tags reads in a few requests)
+
+import struct
+import constants as const
+
+# max size of one read request (bits or registers)
+_MAX_BITS = 2000
+_MAX_REGISTERS = 125
+
+
+class ReadPlan(object):
+
+    """Read plan of a tags list, compiled once and run at each poll cycle
+
+    Tags are (name, function code, address, type, length) tuples:
+    - function code 0x01 or 0x02 with type 'bits': length bits
+    - function code 0x03 or 0x04 with a constants.WORDS_TYPES type ('raw', 'int16',
+      'int32', 'float32' or 'float64', big endian, first register is the
+      msw): length values, or type 'ascii': a string of length registers
+    For each function code, tags are sorted by address and merged in the
+    fewest requests of at most 2000 bits or 125 registers, a gap between two
+    tags is read if it is at most max_gap bits/registers long and cross no
+    forbidden range (addresses a server refuse to read).
+    """
+
+    def __init__(self, tags, max_gap=16, forbidden=None):
+        """Constructor
+        :param tags: (name, function code, address, type, length) tuples
+        :type tags: list
+        :param max_gap: max unused bits/registers read between two tags (optional)
+        :type max_gap: int
+        :param forbidden: (function code, address, number) ranges never read (optional)
+        :type forbidden: list
+        :raises ValueError: if a tag or a param is incorrect
+        """
+        if not int(max_gap) >= 0:
+            raise ValueError('max_gap value error')
+        self.max_gap = int(max_gap)
+        self.forbidden = [(fc, address, address + number) for (fc, address, number) in (forbidden or [])]
+        self.tags = []
+        names = set()
+        for tag in tags:
+            (name, fc, address, v_type, length) = tag
+            if name in names:
+                raise ValueError('tag %r name error (duplicate)' % (name,))
+            names.add(name)
+            end = address + self._tag_size(fc, v_type, length)
+            if not ((address >= 0) and (length >= 1) and (end <= 0x10000)
+                    and (end - address <= self._max_size(fc))):
+                raise ValueError('tag %r address error' % (name,))
+            if self._is_forbidden(fc, address, end):
+                raise ValueError('tag %r is in a forbidden range' % (name,))
+            self.tags.append((name, fc, address, v_type, length, end))
+        # requests: (function code, address, number), with (tag, offset in request) of each
+        self.requests = []
+        self._requests_tags = []
+        self._compile()
+
+    @staticmethod
+    def _max_size(fc):
+        return _MAX_BITS if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS) else _MAX_REGISTERS
+
+    @staticmethod
+    def _tag_size(fc, v_type, length):
+        # number of bits or registers of a tag
+        if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS):
+            if v_type != 'bits':
+                raise ValueError('type %r error for function 0x%02X' % (v_type, fc))
+            return length
+        elif fc in (const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
+            if v_type == 'ascii':
+                return length
+            if v_type not in const.WORDS_TYPES:
+                raise ValueError('type %r error for function 0x%02X' % (v_type, fc))
+            return length * const.WORDS_TYPES[v_type][1]
+        raise ValueError('function code 0x%02X error (read functions only)' % fc)
+
+    def _is_forbidden(self, fc, start, end):
+        for (f_fc, f_start, f_end) in self.forbidden:
+            if f_fc == fc and f_start < end and start < f_end:
+                return True
+        return False
+
+    def _compile(self):
+        # greedy merge of tags sorted by address: the fewest requests for max size and gap limits
+        for fc in sorted(set(tag[1] for tag in self.tags)):
+            max_size = self._max_size(fc)
+            block = None
+            for tag in sorted((t for t in self.tags if t[1] == fc), key=lambda t: (t[2], t[5])):
+                (address, end) = (tag[2], tag[5])
+                if block is not None:
+                    new_end = max(block[1], end)
+                    if (address - block[1] <= self.max_gap and new_end - block[0] <= max_size
+                            and not self._is_forbidden(fc, block[1], address)):
+                        block[1] = new_end
+                        block[2].append(tag)
+                        continue
+                    self._add_request(fc, block)
+                block = [address, end, [tag]]
+            self._add_request(fc, block)
+
+    def _add_request(self, fc, block):
+        (start, end, tags) = block
+        self.requests.append((fc, start, end - start))
+        self._requests_tags.append([(tag, tag[2] - start) for tag in tags])
+
+    def decode(self, results):
+        """Decode the results of the requests
+        For a client without pipeline(), do the requests of the requests
+        attribute (with the matching read functions) and decode their results.
+        :param results: one bits/registers list (or None if failed) per request
+        :type results: list
+        :returns: tag name -> value (list of length values or str for 'ascii',
+                  None if its request failed)
+        :rtype: dict
+        """
+        values = {}
+        for ((fc, address, number), result, tags) in zip(self.requests, results, self._requests_tags):
+            if result is not None and len(result) != number:
+                result = None
+            # registers as bytes: each tag is unpacked at its offset
+            if result is not None and fc in (const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
+                data = struct.pack('>%dH' % number, *result)
+            for ((name, _, _, v_type, length, _), offset) in tags:
+                if result is None:
+                    values[name] = None
+                elif v_type == 'bits':
+                    values[name] = result[offset:offset + length]
+                elif v_type == 'ascii':
+                    raw = data[offset * 2:(offset + length) * 2]
+                    values[name] = raw.rstrip(b'\x00').decode('ascii', 'replace')
+                else:
+                    values[name] = list(struct.unpack_from('>%d%s' % (length, const.WORDS_TYPES[v_type][0][1]),
+                                                           data, offset * 2))
+        return values
+
+    def run(self, client, window=16):
+        """Do the requests with a ModbusClient, at once (see ModbusClient.pipeline())
+        :param client: the client
+        :type client: ModbusClient
+        :param window: max number of requests in flight (optional)
+        :type window: int
+        :returns: tag name -> value, see decode()
+        :rtype: dict
+        """
+        results = client.pipeline(self.requests, window)
+        if results is None:
+            results = [None] * len(self.requests)
+        return self.decode(results)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Python module: ModbusClientPool class (shared persistent ModbusClient connections)
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Condition
+import constants as const
+from client import ModbusClient
+
+
+class ModbusClientPool(object):
+
+    """Pool of persistent ModbusClient connections, shared by threads
+
+    Threads checkout() a connected client for a (host, port, unit_id) key
+    and checkin() it after their requests, so a TCP connection serve many
+    requests instead of one handshake per request.
+    An idle client is checked (see ModbusClient.is_alive()) before its
+    reuse. There are at most max_per_host connections (idle or checked
+    out) for a (host, port): when the limit is reach, an idle client of
+    another unit ID of this host is closed to make room, or the caller wait
+    for a checkin. Clients idle for more than idle_timeout are closed on
+    next pool call or by evict_idle().
+    """
+
+    def __init__(self, max_per_host=4, idle_timeout=60.0, timeout=30.0):
+        """Constructor
+        :param max_per_host: max number of connections for a (host, port) (optional)
+        :type max_per_host: int
+        :param idle_timeout: seconds before an idle client is closed, None for never (optional)
+        :type idle_timeout: float
+        :param timeout: socket timeout of the clients in seconds (optional)
+        :type timeout: float
+        :raises ValueError: if a param is incorrect
+        """
+        if not int(max_per_host) >= 1:
+            raise ValueError('max_per_host value error')
+        if not (idle_timeout is None or idle_timeout > 0):
+            raise ValueError('idle_timeout value error')
+        self.max_per_host = int(max_per_host)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._cond = Condition()
+        # idle clients, least recently used first: client -> (key, checkin time)
+        self._idle = OrderedDict()
+        # key of each client, idle or checked out
+        self._keys = {}
+        # connections of each (host, port), idle or checked out
+        self._hosts = {}
+        self._stats = {'created': 0, 'reused': 0, 'connect_error': 0, 'health_failed': 0,
+                       'evicted': 0, 'idle_timeout': 0, 'wait_timeout': 0}
+
+    def checkout(self, host, port=const.MODBUS_PORT, unit_id=1, wait=None):
+        """Get a connected client, for this thread only until checkin()
+        :param host: hostname or IPv4/IPv6 address server address
+        :type host: str
+        :param port: TCP port number (optional)
+        :type port: int
+        :param unit_id: unit ID (optional)
+        :type unit_id: int
+        :param wait: max seconds to wait a free connection, None for no limit (optional)
+        :type wait: float
+        :returns: a connected client or None if wait expire or connect fail
+        :rtype: ModbusClient or None
+        """
+        key = (host, int(port), int(unit_id))
+        deadline = None if wait is None else time.time() + wait
+        with self._cond:
+            self._evict_expired()
+            while True:
+                # most recently used idle client first
+                for client in reversed(self._idle):
+                    if self._keys[client] == key:
+                        del self._idle[client]
+                        if client.is_alive():
+                            self._stats['reused'] += 1
+                            return client
+                        self._stats['health_failed'] += 1
+                        self._discard(client)
+                        break
+                else:
+                    if self._hosts.get(key[:2], 0) < self.max_per_host:
+                        break
+                    # host full: close the least recently used idle client of another unit ID
+                    victim = next((c for c in self._idle if self._keys[c][:2] == key[:2]), None)
+                    if victim is not None:
+                        del self._idle[victim]
+                        self._stats['evicted'] += 1
+                        self._discard(victim)
+                        break
+                    left = None if deadline is None else deadline - time.time()
+                    if left is not None and left <= 0:
+                        self._stats['wait_timeout'] += 1
+                        return None
+                    self._cond.wait(left)
+            # reserve the slot, then connect out of lock
+            self._hosts[key[:2]] = self._hosts.get(key[:2], 0) + 1
+        client = ModbusClient(host=host, port=port, unit_id=unit_id, timeout=self.timeout, auto_open=True)
+        if not client.open():
+            with self._cond:
+                self._stats['connect_error'] += 1
+                self._release_slot(key)
+            return None
+        with self._cond:
+            self._keys[client] = key
+            self._stats['created'] += 1
+        return client
+
+    def checkin(self, client):
+        """Give back a checked out client
+        A closed client (after an error) is discarded, an open one wait idle
+        for the next checkout() of its key.
+        :param client: client of checkout()
+        :type client: ModbusClient
+        :raises ValueError: if client is not a checked out client of this pool
+        """
+        with self._cond:
+            if client not in self._keys or client in self._idle:
+                raise ValueError('client is not checked out from this pool')
+            if client.is_open():
+                self._idle[client] = (self._keys[client], time.time())
+            else:
+                self._discard(client)
+            # waiters of other keys share the condition: wake them all, each one check its own key
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self, host, port=const.MODBUS_PORT, unit_id=1, wait=None):
+        """checkout() a client for a with block, checkin() it at the end
+        The client is None if checkout() fail.
+        """
+        client = self.checkout(host, port, unit_id, wait)
+        try:
+            yield client
+        finally:
+            if client is not None:
+                self.checkin(client)
+
+    def evict_idle(self):
+        """Close the clients idle for more than idle_timeout
+        :returns: number of closed clients
+        :rtype: int
+        """
+        with self._cond:
+            return self._evict_expired()
+
+    def close(self):
+        """Close all idle clients (checked out clients are closed at checkin)"""
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.popitem(last=False)[0])
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """Return current connections and idle clients, counts of created, reused,
+        connect_error, health_failed, evicted, idle_timeout and wait_timeout"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['connections'] = len(self._keys)
+            stats['idle'] = len(self._idle)
+            return stats
+
+    def _evict_expired(self):
+        # caller own the lock, the LRU order stop the scan at the first recent client
+        if self.idle_timeout is None:
+            return 0
+        limit = time.time() - self.idle_timeout
+        evicted = 0
+        while self._idle:
+            (client, (key, checkin_time)) = next(iter(self._idle.items()))
+            if checkin_time > limit:
+                break
+            del self._idle[client]
+            self._discard(client)
+            evicted += 1
+        if evicted:
+            self._stats['idle_timeout'] += evicted
+            self._cond.notify_all()
+        return evicted
+
+    def _discard(self, client):
+        # caller own the lock
+        client.close()
+        self._release_slot(self._keys.pop(client))
+
+    def _release_slot(self, key):
+        # caller own the lock
+        count = self._hosts[key[:2]] - 1
+        if count:
+            self._hosts[key[:2]] = count
+        else:
+            del self._hosts[key[:2]]
+        self._cond.notify_all()
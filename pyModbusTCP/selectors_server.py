@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# Python module: selectors engine for ModbusServer (single thread, non-blocking sockets)
+
+# this module need Python 3.4+ (selectors)
+
+import logging
+import selectors
+import socket
+import time
+from socketserver import TCPServer
+from threading import Event
+
+logger = logging.getLogger('pyModbusTCP.server')
+
+
+class _Connection(object):
+
+    """Buffers of a client connection"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.rx_buf = bytearray()
+        self.tx_buf = bytearray()
+        # timeouts: time of the last received bytes and of the first bytes of the current frame
+        self.last_rx = time.monotonic()
+        self.frame_start = None
+
+
+class SelectorsTCPServer(TCPServer):
+
+    """TCP server that serve every client connection from one selectors loop
+
+    Each read put all the available bytes in the connection buffer, every
+    complete MBAP frame in it is processed and all the responses are sent
+    with one send() call, so pipelined or bursty clients need far fewer
+    syscalls than with the threading engine.
+    Like AsyncioTCPServer only the static frame_body_size() and
+    process_frame() of the request handler class are used.
+    """
+
+    # listen() backlog, a single thread can't accept as fast as ThreadingTCPServer
+    request_queue_size = 128
+    # max bytes read from a socket at once
+    recv_size = 0x10000
+    # max time between two checks of the connections timeouts (in seconds)
+    timeouts_interval = 0.1
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
+        TCPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate)
+        self._selector = None
+        self._is_shut_down = Event()
+        self._shutdown_request = False
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve clients until shutdown() is called
+        :param poll_interval: max time between two checks of shutdown request (in seconds)
+        :type poll_interval: float
+        """
+        self._is_shut_down.clear()
+        self._selector = selectors.DefaultSelector()
+        try:
+            self.socket.setblocking(False)
+            self._selector.register(self.socket, selectors.EVENT_READ, None)
+            server = self.modbus_server
+            timed = not (server.idle_timeout is None and server.read_timeout is None
+                         and server.frame_timeout is None)
+            if timed:
+                poll_interval = min(poll_interval, self.timeouts_interval)
+            while not self._shutdown_request:
+                if timed:
+                    self._check_timeouts()
+                for key, events in self._selector.select(poll_interval):
+                    if key.data is None:
+                        self._accept()
+                        continue
+                    conn = key.data
+                    if conn.sock.fileno() == -1:
+                        continue
+                    if events & selectors.EVENT_READ:
+                        self._read(conn)
+                    elif events & selectors.EVENT_WRITE:
+                        self._write(conn)
+        finally:
+            for key in list(self._selector.get_map().values()):
+                if key.data is not None:
+                    self._close(key.data)
+            self._selector.close()
+            self._selector = None
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stop the serve_forever() loop and wait until it return
+        Must be called from another thread than the serve_forever() one.
+        """
+        self._shutdown_request = True
+        self._is_shut_down.wait()
+
+    def _accept(self):
+        # accept all the pending connections
+        while True:
+            try:
+                sock, addr = self.socket.accept()
+            except socket.error:
+                # no more pending connection (or accept error, like out of file descriptors)
+                return
+            conn = _Connection(sock, addr)
+            # a close() call by the limiter (in this thread) evict an idle connection
+            if not self.modbus_server.connections.open(conn, lambda victim=conn: self._close(victim)):
+                sock.close()
+                continue
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, conn)
+            if self.modbus_server.metrics is not None:
+                self.modbus_server.metrics.connection_opened()
+
+    def _close(self, conn):
+        # already closed (evicted while its events wait in the current select() result)
+        if conn.sock.fileno() == -1:
+            return
+        self.modbus_server.connections.close(conn)
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+        if self.modbus_server.metrics is not None:
+            self.modbus_server.metrics.connection_closed()
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(self.recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            data = b''
+        # client close the connection
+        if not data:
+            self._close(conn)
+            return
+        conn.rx_buf += data
+        conn.last_rx = time.monotonic()
+        if conn.frame_start is None:
+            conn.frame_start = conn.last_rx
+            self.modbus_server.connections.busy(conn)
+        # process every complete frame of the buffer
+        service = self.RequestHandlerClass
+        rx_buf = conn.rx_buf
+        responses = []
+        pos = 0
+        while len(rx_buf) - pos >= 7:
+            rx_head = bytes(rx_buf[pos:pos + 7])
+            # close connection if frame header content inconsistency
+            body_size = service.frame_body_size(rx_head)
+            if body_size is None:
+                self._close(conn)
+                return
+            # wait for the end of the frame
+            if len(rx_buf) - pos - 7 < body_size:
+                break
+            rx_body = bytes(rx_buf[pos + 7:pos + 7 + body_size])
+            # close connection if the frame can't be processed
+            try:
+                tx_frame = service.process_frame(self.modbus_server, rx_head, rx_body, conn.addr)
+            except Exception:
+                # a handler error (like a register_function() one) drop this connection only
+                logger.exception('frame processing error, close connection from %s', conn.addr)
+                self._close(conn)
+                return
+            if tx_frame is None:
+                self._close(conn)
+                return
+            responses.append(tx_frame)
+            pos += 7 + body_size
+        del rx_buf[:pos]
+        # a frame begin at the start of the buffer
+        if pos:
+            conn.frame_start = conn.last_rx if rx_buf else None
+            if not rx_buf:
+                self.modbus_server.connections.idle(conn)
+        # send all the responses at once
+        if responses:
+            conn.tx_buf += b''.join(responses)
+            self._write(conn)
+
+    def _check_timeouts(self):
+        server = self.modbus_server
+        now = time.monotonic()
+        for key in list(self._selector.get_map().values()):
+            conn = key.data
+            if conn is None:
+                continue
+            if conn.frame_start is None:
+                reason = 'idle_timeout' if server.idle_timeout is not None and \
+                    now - conn.last_rx > server.idle_timeout else None
+            elif server.frame_timeout is not None and now - conn.frame_start > server.frame_timeout:
+                reason = 'frame_timeout'
+            elif server.read_timeout is not None and now - conn.last_rx > server.read_timeout:
+                reason = 'read_timeout'
+            else:
+                reason = None
+            if reason is not None:
+                server.connections.count(reason)
+                self._close(conn)
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.tx_buf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except socket.error:
+            self._close(conn)
+            return
+        del conn.tx_buf[:sent]
+        # stop read from a client that don't read its responses
+        events = selectors.EVENT_WRITE if conn.tx_buf else selectors.EVENT_READ
+        if self._selector.get_key(conn.sock).events != events:
+            self._selector.modify(conn.sock, events, conn)
@@ -1,9 +1,24 @@
 import constants as const
 import utils as mu
+import logging
+import mmap
+import os
 import socket
+import sys
 import struct
 import settings
-from threading import Lock, Thread
+import signal
+import tempfile
+import time
+import types
+from collections import OrderedDict, deque, namedtuple
+from threading import Condition, Event, Lock, Thread
+
+# record locks for SharedDataBank (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # for python2 compatibility
 try:
@@ -12,7 +27,216 @@ except ImportError:
     from SocketServer import BaseRequestHandler, ThreadingTCPServer
 
 
-class DataBank:
+# server events: register changes are DEBUG records, errors of background threads are ERROR records
+# (see utils.start_log_queue() for a non-blocking output)
+logger = logging.getLogger('pyModbusTCP.server')
+
+# high resolution timer for latency metrics (Python 3.3+)
+_timer = getattr(time, 'perf_counter', time.time)
+
+# zero filled bits and words spaces, shared by data banks until their first write
+_ZERO_BITS = bytes(bytearray(0x2000))
+_ZERO_WORDS = bytes(bytearray(0x20000))
+
+
+class _Values(object):
+
+    """Written values of a register changes record, decoded only if the
+    record is formatted (by the log handler, not by the writer)"""
+
+    __slots__ = ('kind', 'data', 'number', 'shift')
+
+    def __init__(self, kind, data, number, shift=0):
+        self.kind = kind
+        self.data = data
+        self.number = number
+        self.shift = shift
+
+    def __str__(self):
+        if self.kind == 'bits':
+            bits = mu.bytes_to_bits(self.data, self.shift + self.number)[self.shift:]
+            return ', '.join(str(bit) for bit in bits)
+        return ', '.join(str(word) for word in struct.unpack('>%dH' % self.number, self.data))
+
+# data bank image (SharedDataBank file and snapshots): header, then bits space, then words space
+# header: magic, version, bits generation, words generation (padded to 64 bytes)
+_IMAGE_HEAD = struct.Struct('>4sHxxQQ')
+_IMAGE_MAGIC = b'MBDB'
+_IMAGE_VERSION = 1
+_IMAGE_BITS_OFFSET = 64
+_IMAGE_WORDS_OFFSET = _IMAGE_BITS_OFFSET + len(_ZERO_BITS)
+_IMAGE_SIZE = _IMAGE_WORDS_OFFSET + len(_ZERO_WORDS)
+
+
+# word orders of multi registers values: A is the msb of the value, registers bytes in
+# address order, 64 bits values extend the same rule to 4 registers
+WORD_ORDERS = ('ABCD', 'CDAB', 'BADC', 'DCBA')
+
+
+def _swap_words(data, size):
+    # reverse the order of the size registers of each value, bytes stay in place in registers
+    step = size * 2
+    swapped = bytearray(len(data))
+    for word in range(size):
+        for byte in range(2):
+            swapped[word * 2 + byte::step] = data[(size - 1 - word) * 2 + byte::step]
+    return swapped
+
+
+def _swap_bytes(data):
+    # swap the 2 bytes of each register
+    swapped = bytearray(len(data))
+    swapped[0::2] = data[1::2]
+    swapped[1::2] = data[0::2]
+    return swapped
+
+
+def _check_image(image):
+    # True if image (bytes like or mmap) is a valid data bank image
+    return len(image) == _IMAGE_SIZE and _IMAGE_HEAD.unpack_from(image, 0)[:2] == (_IMAGE_MAGIC, _IMAGE_VERSION)
+
+
+class RWLock(object):
+
+    """Readers-writer lock
+
+    Any number of readers hold the lock at the same time, a writer hold it
+    alone. Waiting writers go first, so a flow of readers can't starve them.
+    contentions count the acquisitions that had to wait.
+    """
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self.contentions = 0
+
+    def acquire_read(self):
+        with self._cond:
+            if self._writer or self._writers_waiting:
+                self.contentions += 1
+                while self._writer or self._writers_waiting:
+                    self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            # only waiting writers care about the last reader (readers wait only behind writers)
+            if not self._readers and self._writers_waiting:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            if self._writer or self._readers:
+                self.contentions += 1
+                self._writers_waiting += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class RangeLock(object):
+
+    """Readers-writer locks striped over the 65536 addresses of a space
+
+    reading()/writing() return a context manager that lock only the stripes
+    of an address range (in address order, so no deadlock), so reads never
+    block each other and non-overlapping writes don't block anyone.
+    """
+
+    def __init__(self, size=0x10000, stripe_size=0x1000, new_lock=None):
+        """Constructor
+        :param size: number of addresses (optional)
+        :type size: int
+        :param stripe_size: number of addresses per stripe (optional)
+        :type stripe_size: int
+        :param new_lock: build the lock of a stripe as new_lock(index, stripe_size), RWLock by default (optional)
+        :type new_lock: callable
+        """
+        self.stripe_size = stripe_size
+        nb_stripes = (size + stripe_size - 1) // stripe_size
+        if new_lock is None:
+            self.stripes = [RWLock() for _ in range(nb_stripes)]
+        else:
+            self.stripes = [new_lock(i, stripe_size) for i in range(nb_stripes)]
+
+    @property
+    def contentions(self):
+        return sum(stripe.contentions for stripe in self.stripes)
+
+    def reading(self, address, number):
+        return _RangeGuard(self._stripes(address, number), False)
+
+    def writing(self, address, number):
+        return _RangeGuard(self._stripes(address, number), True)
+
+    def _stripes(self, address, number):
+        return self.stripes[address // self.stripe_size:(address + max(number, 1) - 1) // self.stripe_size + 1]
+
+
+class _RangeGuard(object):
+
+    """Hold read or write locks on a list of stripes"""
+
+    def __init__(self, stripes, write):
+        self.stripes = stripes
+        self.write = write
+
+    def __enter__(self):
+        for stripe in self.stripes:
+            if self.write:
+                stripe.acquire_write()
+            else:
+                stripe.acquire_read()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for stripe in reversed(self.stripes):
+            if self.write:
+                stripe.release_write()
+            else:
+                stripe.release_read()
+
+
+class Subscription(object):
+
+    """A DataBank change subscription (see DataBank.subscribe())"""
+
+    def __init__(self, kind, address, number, callback):
+        self.kind = kind
+        self.address = address
+        self.number = number
+        self.callback = callback
+
+
+class _bank_method(object):
+
+    """DataBank method decorator
+
+    The method work on the instance it's called from, or on the default data
+    bank when called from the class, so DataBank.set_words() and co keep
+    working as before data bank instances.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            obj = DataBank._default_bank
+        return types.MethodType(self.func, obj)
+
+
+class DataBank(object):
     """ Data class for thread safe access to bits and words space 
     words space is always kept in bytes  the reason for this every 
     vendor of PLC or other hardware store the data inconsistently 
@@ -26,171 +250,952 @@ class DataBank:
     a respective python data type  but you need to know the data type
     being stored in the register. 
     Need to write several more access and write methods to deal with
-    signed integer, float and double types""" 
+    signed integer, float and double types
 
-    bits_lock = Lock()
-    bits = [False] * 0x10000
-    words_lock = Lock()
-    words = [struct.pack('>H', 0)] * 0x10000
+    DataBank() build a new data bank (for example one per unit ID of a
+    ModbusServer), methods called from the class itself, like
+    DataBank.set_words(), work on the default data bank.
+    The bits and words spaces are allocated on first write, until then
+    reads return 0.""" 
 
-    @classmethod
-    def clear_registers(cls):
-        with cls.words_lock:
-            cls.word = [struct.pack('>H', 0)] * 0x10000
-        with cls.bits_lock:
-            cls.bits = [False] * 0x10000
-        return True
+    def __init__(self):
+        # readers share the locks, writers own only the stripes of their address range
+        self.bits_lock = RangeLock()
+        # 65536 packed bits with the modbus layout (bit n is bit n % 8 of byte n // 8)
+        self.bits = _ZERO_BITS
+        self.words_lock = RangeLock()
+        # 65536 big endian registers in one contiguous buffer (register n at offset 2*n)
+        self.words = _ZERO_WORDS
+        self._alloc_lock = Lock()
+        # write generations: change after each write (see ResponseCache)
+        self.bits_generation = 0
+        self.words_generation = 0
+        # writers of different stripes bump a generation at the same time
+        self._generation_lock = Lock()
+        # change notifications (see subscribe())
+        self.coalesce_delay = 0.05
+        self._subscriptions = []
+        self._changes = deque()
+        self._changes_event = Event()
+        self._dispatch_th = None
+        # periodic snapshots (see start_snapshots())
+        self._snapshots_stop = None
+        # Historian that record the writes or None
+        self.historian = None
 
     @classmethod
-    def get_ascii(cls, pstart, pend):
-        with cls.words_lock:
-            if (pstart>=0 and pend<=65535) and (pend >=pstart):
-                _ascii = b''.join(cls.words[pstart:pend]).decode('ascii')
-                ##print(_ascii)
-                return _ascii 
-            else:
-                return None
+    def default(cls):
+        """Return the default data bank (the one used by class level calls)"""
+        return DataBank._default_bank
 
-    @classmethod
-    def get_bits(cls, address, number=1):
-        with cls.bits_lock:
-            if (address >= 0) and (address + number <= len(cls.bits)):
-                return cls.bits[address: number + address]
-            else:
-                return None
+    def _writable_bits(self):
+        # allocate bits space on first write (call with a bits write lock held)
+        if self.bits is _ZERO_BITS:
+            with self._alloc_lock:
+                if self.bits is _ZERO_BITS:
+                    self.bits = bytearray(_ZERO_BITS)
+        return self.bits
 
-    @classmethod
-    def get_double(cls, pstart, pend):
-        with cls.words_lock:
-            if (pstart>=0 and pend<=65535) and (pstart+3 == pend):
-                return struct.unpack('>d',cls.words[pstart:pend])[0]
+    def _writable_words(self):
+        # allocate words space on first write (call with a words write lock held)
+        if self.words is _ZERO_WORDS:
+            with self._alloc_lock:
+                if self.words is _ZERO_WORDS:
+                    self.words = bytearray(_ZERO_WORDS)
+        return self.words
+
+    def _bump_generation(self, kind):
+        # call after the data write, never before: a read cached at the old generation is now a miss
+        with self._generation_lock:
+            if kind == 'bits':
+                self.bits_generation += 1
             else:
-                return None
+                self.words_generation += 1
 
-    @classmethod
-    def get_int2(cls, address):
-        with cls.words_lock:
-            if (address>=0 and address<=65535):
-                return struct.unpack('>H',cls.words[address])[0]
+    @_bank_method
+    def clear_registers(self):
+        with self.words_lock.writing(0, 0x10000):
+            self.words = _ZERO_WORDS
+            self._bump_generation('words')
+        with self.bits_lock.writing(0, 0x10000):
+            self.bits = _ZERO_BITS
+            self._bump_generation('bits')
+        if self._subscriptions:
+            self._notify('words', 0, 0x10000)
+            self._notify('bits', 0, 0x10000)
+        return True
+
+    @_bank_method
+    def snapshot(self, path):
+        """Save bits and words spaces to an image file
+        The image is written to a temporary file then renamed to path, so path
+        always hold a complete image. Spaces are copied one lock stripe at a
+        time: writers are only blocked on the stripe being copied, and each
+        stripe is consistent (not the whole image).
+        The image can be loaded with restore() or mapped with SharedDataBank.
+        :param path: image file path
+        :type path: str
+        :returns: True if saved
+        :rtype: bool
+        """
+        image = bytearray(_IMAGE_SIZE)
+        _IMAGE_HEAD.pack_into(image, 0, _IMAGE_MAGIC, _IMAGE_VERSION,
+                              self.bits_generation, self.words_generation)
+        for (name, lock, offset, size) in (('bits', self.bits_lock, _IMAGE_BITS_OFFSET, len(_ZERO_BITS)),
+                                           ('words', self.words_lock, _IMAGE_WORDS_OFFSET, len(_ZERO_WORDS))):
+            # bytes of the space per stripe (bits are packed 8 per byte)
+            stripe_bytes = size * lock.stripe_size // 0x10000
+            for address in range(0, 0x10000, lock.stripe_size):
+                start = address * size // 0x10000
+                with lock.reading(address, lock.stripe_size):
+                    # read the space under the lock: a write may swap the buffer
+                    space = memoryview(getattr(self, name))
+                    image[offset + start:offset + start + stripe_bytes] = space[start:start + stripe_bytes]
+        # a unique temporary file in the same directory (same filesystem for the rename): concurrent
+        # snapshots of path don't share it
+        (fd, tmp_path) = tempfile.mkstemp(prefix='%s.' % os.path.basename(path), suffix='.tmp',
+                                          dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image)
+                f.flush()
+                os.fsync(f.fileno())
+            # atomic on POSIX, os.replace() is Python 3 only
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, path)
             else:
-                return None
+                os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    @_bank_method
+    def restore(self, path):
+        """Load bits and words spaces from an image file (see snapshot())
+        :param path: image file path
+        :type path: str
+        :returns: True if loaded
+        :rtype: bool
+        :raises ValueError: if the file is not a data bank image
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size != _IMAGE_SIZE:
+                raise ValueError('data bank image format error')
+            image = mmap.mmap(f.fileno(), _IMAGE_SIZE, access=mmap.ACCESS_READ)
+        try:
+            if not _check_image(image):
+                raise ValueError('data bank image format error')
+            with self.words_lock.writing(0, 0x10000):
+                self._writable_words()[:] = image[_IMAGE_WORDS_OFFSET:_IMAGE_SIZE]
+                self._bump_generation('words')
+            with self.bits_lock.writing(0, 0x10000):
+                self._writable_bits()[:] = image[_IMAGE_BITS_OFFSET:_IMAGE_WORDS_OFFSET]
+                self._bump_generation('bits')
+        finally:
+            image.close()
+        if self._subscriptions:
+            self._notify('words', 0, 0x10000)
+            self._notify('bits', 0, 0x10000)
+        return True
+
+    @_bank_method
+    def start_snapshots(self, path, interval):
+        """Save a snapshot every interval seconds, from a background thread
+        A snapshot is skipped if there was no write since the previous one.
+        Replace the current periodic snapshots, if any.
+        :param path: image file path
+        :type path: str
+        :param interval: seconds between two snapshots
+        :type interval: float
+        :raises ValueError: if interval is not positive
+        """
+        if not interval > 0:
+            raise ValueError('interval value error')
+        self.stop_snapshots()
+        stop_event = Event()
+        self._snapshots_stop = stop_event
+        th = Thread(target=self._snapshots_loop, args=(path, interval, stop_event))
+        th.daemon = True
+        th.start()
+
+    @_bank_method
+    def stop_snapshots(self):
+        """Stop periodic snapshots (see start_snapshots())"""
+        if self._snapshots_stop is not None:
+            self._snapshots_stop.set()
+            self._snapshots_stop = None
+
+    def _snapshots_loop(self, path, interval, stop_event):
+        last_gens = None
+        while not stop_event.wait(interval):
+            gens = (self.bits_generation, self.words_generation)
+            if gens == last_gens:
+                continue
+            try:
+                self.snapshot(path)
+                last_gens = gens
+            except Exception:
+                # a full disk must not stop next snapshots
+                logger.exception('snapshot to %s failed', path)
+
+    @_bank_method
+    def subscribe(self, kind, address, number, callback):
+        """Call callback when an address range is written
+        Callbacks run on a background dispatcher thread, as callback(kind,
+        address, number) with the written part of the subscribed range. Writes
+        that happen within coalesce_delay seconds are merged in one call. The
+        dispatcher thread run from the first subscription to the last
+        unsubscribe().
+        :param kind: 'bits' or 'words'
+        :type kind: str
+        :param address: first address of the range
+        :type address: int
+        :param number: number of addresses in the range
+        :type number: int
+        :param callback: function to call
+        :type callback: callable
+        :returns: subscription to use with unsubscribe()
+        :rtype: Subscription
+        :raises ValueError: if a param is incorrect
+        """
+        if kind not in ('bits', 'words'):
+            raise ValueError('kind value error')
+        if not ((address >= 0) and (number >= 1) and (address + number <= 0x10000)):
+            raise ValueError('address range error')
+        if not callable(callback):
+            raise ValueError('callback value error')
+        subscription = Subscription(kind, address, number, callback)
+        with self._alloc_lock:
+            # copy on write: writers iterate the list without lock
+            self._subscriptions = self._subscriptions + [subscription]
+            if self._dispatch_th is None:
+                self._dispatch_th = Thread(target=self._dispatch)
+                self._dispatch_th.daemon = True
+                self._dispatch_th.start()
+        return subscription
+
+    @_bank_method
+    def unsubscribe(self, subscription):
+        """Remove a subscription
+        :param subscription: a subscription returned by subscribe()
+        :type subscription: Subscription
+        :returns: True if removed, False if unknown
+        :rtype: bool
+        """
+        with self._alloc_lock:
+            if subscription not in self._subscriptions:
+                return False
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+            # last one: the None sentinel tell the dispatcher to exit
+            if not self._subscriptions:
+                self._notify(None, 0, 0)
+            return True
+
+    def _notify(self, kind, address, number):
+        # write path side: just queue the change, the dispatcher do the rest
+        self._changes.append((kind, address, number))
+        if not self._changes_event.is_set():
+            self._changes_event.set()
+
+    def _dispatch(self):
+        while True:
+            self._changes_event.wait()
+            # let a burst of writes be coalesced
+            time.sleep(self.coalesce_delay)
+            self._changes_event.clear()
+            # merge changes for every subscription: subscription -> [start, end]
+            ranges = {}
+            subscriptions = self._subscriptions
+            stop = False
+            while self._changes:
+                kind, address, number = self._changes.popleft()
+                if kind is None:
+                    stop = True
+                    continue
+                for sub in subscriptions:
+                    start = max(address, sub.address)
+                    end = min(address + number, sub.address + sub.number)
+                    if sub.kind != kind or start >= end:
+                        continue
+                    s_range = ranges.get(sub)
+                    if s_range is None:
+                        ranges[sub] = [start, end]
+                    else:
+                        s_range[0] = min(s_range[0], start)
+                        s_range[1] = max(s_range[1], end)
+            for sub, (start, end) in ranges.items():
+                try:
+                    sub.callback(sub.kind, start, end - start)
+                except Exception:
+                    # a bad callback must not stop the dispatcher
+                    logger.exception('subscription callback error')
+            # exit unless a subscribe() came after the sentinel, next subscribe() start a new thread
+            if stop:
+                with self._alloc_lock:
+                    if not self._subscriptions:
+                        self._dispatch_th = None
+                        return
+
+    @_bank_method
+    def get_lock_contentions(self):
+        """Number of lock acquisitions that had to wait, for bits and words spaces"""
+        return {'bits': self.bits_lock.contentions, 'words': self.words_lock.contentions}
+
+    @_bank_method
+    def get_spaces(self):
+        """Return a copy of the bits and words spaces, both at the same point in time
+        Writers are held off only during the copy of the spaces.
+        :returns: (bits space, words space)
+        :rtype: tuple
+        """
+        with self.words_lock.reading(0, 0x10000):
+            with self.bits_lock.reading(0, 0x10000):
+                return bytes(self.bits), bytes(self.words)
+
+    @_bank_method
+    def get_ascii(self, pstart, pend):
+        if (pstart>=0 and pend<=65535) and (pend >=pstart):
+            return self.get_words_bytes(pstart, pend - pstart).decode('ascii')
+        else:
+            return None
+
+    @_bank_method
+    def get_bits(self, address, number=1):
+        """Read bits as a list of bool"""
+        packed = self.get_bits_bytes(address, number)
+        if packed is None:
+            return None
+        return mu.bytes_to_bits(packed, number)
+
+    @_bank_method
+    def get_bits_bytes(self, address, number=1):
+        """Read bits packed with the modbus layout (first bit is the lsb of
+        the first byte, last byte padded with 0)"""
+        if not ((address >= 0) and (number >= 1) and (address + number <= 0x10000)):
+            return None
+        first = address >> 3
+        end = ((address + number - 1) >> 3) + 1
+        shift = address & 0x07
+        with self.bits_lock.reading(address, number):
+            # aligned range: a plain copy
+            if not (shift or number & 0x07):
+                return memoryview(self.bits)[first:end].tobytes()
+            val_int = mu.bytes_le_to_int(self.bits[first:end])
+        val_int = (val_int >> shift) & ((1 << number) - 1)
+        return mu.int_to_bytes_le(val_int, (number + 7) // 8)
+
+    @_bank_method
+    def get_double(self, pstart, pend):
+        if (pstart>=0 and pend<=65535) and (pstart+3 == pend):
+            return struct.unpack('>d', self.get_words_bytes(pstart, 4))[0]
+        else:
+            return None
+
+    @_bank_method
+    def get_int2(self, address):
+        if (address>=0 and address<=65535):
+            return struct.unpack('>H', self.get_words_bytes(address, 1))[0]
+        else:
+            return None
     
-    @classmethod
-    def get_int4(cls, pstart ):
-        with cls.words_lock:
-            if (pstart>=0 and pstart+1<=65535):
-                return struct.unpack('>I',cls.words[pstart:pstart+1])[0]
-            else:
-                return None
+    @_bank_method
+    def get_int4(self, pstart ):
+        if (pstart>=0 and pstart+1<=65535):
+            return struct.unpack('>I', self.get_words_bytes(pstart, 2))[0]
+        else:
+            return None
 
-    @classmethod
-    def get_float4(cls, pstart):
-        with cls.words_lock:
-            if (pstart>=0 and pstart+1<=65535):
-                return struct.unpack('>f',cls.words[pstart:pstart+1])[0]
-            else:
-                return None
+    @_bank_method
+    def get_float4(self, pstart):
+        if (pstart>=0 and pstart+1<=65535):
+            return struct.unpack('>f', self.get_words_bytes(pstart, 2))[0]
+        else:
+            return None
     
-    @classmethod
-    def get_words(cls, address, number=1):
-        with cls.words_lock:
-            if (address >= 0) and (address + number <= len(cls.words)):
-                return cls.words[address: number + address]
-            else:
-                return None
+    def _get_values(self, address, number, fmt, size, word_order):
+        # read number values of size registers with one lock acquisition, decode them with one unpack
+        if word_order not in WORD_ORDERS:
+            raise ValueError('word_order value error')
+        if not ((address >= 0) and (number >= 0) and (address + number * size <= 0x10000)):
+            return None
+        data = self.get_words_bytes(address, number * size)
+        if word_order in ('CDAB', 'BADC'):
+            data = _swap_words(data, size)
+        order = '<' if word_order in ('DCBA', 'BADC') else '>'
+        return list(struct.unpack('%s%d%s' % (order, number, fmt), data))
+
+    def _set_values(self, address, values, fmt, size, word_order, client):
+        # encode values with one pack, write them with one lock acquisition
+        if word_order not in WORD_ORDERS:
+            raise ValueError('word_order value error')
+        if not ((address >= 0) and (address + len(values) * size <= 0x10000)):
+            return False
+        order = '<' if word_order in ('DCBA', 'BADC') else '>'
+        try:
+            data = struct.pack('%s%d%s' % (order, len(values), fmt), *values)
+        except struct.error:
+            return False
+        if word_order in ('CDAB', 'BADC'):
+            data = _swap_words(data, size)
+        return self.set_words(address, data, client=client)
 
-    @classmethod 
-    def set_ascii(cls, pstart, pend, pvalue):
+    @_bank_method
+    def get_int32s(self, address, number=1, word_order='ABCD', signed=True):
+        """Read number 32 bits integers (2 registers each)
+        :param word_order: registers layout, one of WORD_ORDERS (optional)
+        :type word_order: str
+        :param signed: signed or unsigned integers (optional)
+        :type signed: bool
+        :returns: list of int or None if out of words space
+        :rtype: list or None
+        :raises ValueError: if word_order is unknown
+        """
+        return self._get_values(address, number, 'i' if signed else 'I', 2, word_order)
+
+    @_bank_method
+    def get_floats(self, address, number=1, word_order='ABCD'):
+        """Read number IEEE 754 float32 (2 registers each), see get_int32s()"""
+        return self._get_values(address, number, 'f', 2, word_order)
+
+    @_bank_method
+    def get_doubles(self, address, number=1, word_order='ABCD'):
+        """Read number IEEE 754 float64 (4 registers each), see get_int32s()"""
+        return self._get_values(address, number, 'd', 4, word_order)
+
+    @_bank_method
+    def get_string(self, address, number, swap_bytes=False):
+        """Read a string of number registers (2 chars each), trailing NUL are removed
+        :param swap_bytes: first char in the lsb of each register (optional)
+        :type swap_bytes: bool
+        :returns: the string or None if out of words space
+        :rtype: str or None
+        """
+        data = self.get_words_bytes(address, number)
+        if data is None:
+            return None
+        if swap_bytes:
+            data = _swap_bytes(data)
+        return bytes(data).rstrip(b'\x00').decode('latin-1')
+
+    @_bank_method
+    def get_words(self, address, number=1):
+        """Read registers as a list of 2 bytes (big endian) items"""
+        words = self.get_words_bytes(address, number)
+        if words is None:
+            return None
+        return [words[i:i + 2] for i in range(0, len(words), 2)]
+
+    @_bank_method
+    def get_words_bytes(self, address, number=1):
+        """Read registers as one bytes object (2 bytes big endian per register)"""
+        if (address >= 0) and (number >= 0) and (address + number <= 0x10000):
+            with self.words_lock.reading(address, number):
+                return memoryview(self.words)[address * 2:(address + number) * 2].tobytes()
+        else:
+            return None
+
+    @_bank_method
+    def get_words_into(self, buffer, offset, address, number):
+        """Copy registers to a writable buffer (like a bytearray) at offset, with
+        no intermediate bytes object (2 bytes big endian per register)
+        :returns: True if copied, False if out of words space
+        :rtype: bool
+        """
+        if not ((address >= 0) and (number >= 0) and (address + number <= 0x10000)):
+            return False
+        with self.words_lock.reading(address, number):
+            memoryview(buffer)[offset:offset + number * 2] = memoryview(self.words)[address * 2:(address + number) * 2]
+        return True
+
+    @_bank_method
+    def set_ascii(self, pstart, pend, pvalue):
         if (pstart>=0 and pend<=65535) and ( (pend-pstart) >= (len(pvalue)/2) ):
-            _c_char = mu.ascii_to_char_bit(pvalue)
-            if len(_c_char)> (pend-pstart):
-                return False
-            _i = pstart
-            with cls.words_lock:
-                for _char in _c_char:
-                    cls.words[_i]= _char
-                    _i = _i+1
-                return True
+            # 2 chars per register, pad an odd string with a space
+            if len(pvalue) % 2:
+                pvalue = pvalue + ' '
+            return self.set_words(pstart, pvalue.encode('ascii'))
         return False
 
-    @classmethod
-    def set_bits(cls, address, bit_list):
-        with cls.bits_lock:
-            if (address >= 0) and (address + len(bit_list) <= len(cls.bits)):
-                cls.bits[address: address + len(bit_list)] = bit_list
-                if settings.SERVER_PRINT_REGISTER_CHANGES:
-                    print("Coil Address from %s to %s, boolean values: %s" 
-                            % (address, len(bit_list)-1, 
-                            ', '.join([str(i) for i in bit_list])
-                            )
-                    )
-                return True
-            else:
-                return False
+    @_bank_method
+    def set_bits(self, address, bit_list, client=None):
+        """Write bits from a list of bool"""
+        return self.set_bits_bytes(address, len(bit_list), mu.bits_to_bytes(bit_list), client=client)
 
-    @classmethod
-    def set_clear_words(cls, pstart, pend):
-        with cls.words_lock:
-            if (pstart>=0 and pend<=65535) and (pstart <= pend):
-                i = pstart
-                while i <= pend :
-                    cls.words[i] = 0
-                    i = i + 1
-                return True
+    @_bank_method
+    def set_bits_bytes(self, address, number, data, client=None):
+        """Write number bits packed with the modbus layout (first bit is the
+        lsb of the first byte), client is the writer address for the historian"""
+        if not ((address >= 0) and (number >= 1) and (address + number <= 0x10000)
+                and (len(data) >= (number + 7) // 8)):
+            return False
+        first = address >> 3
+        end = ((address + number - 1) >> 3) + 1
+        shift = address & 0x07
+        historian = self.historian
+        log = logger.isEnabledFor(logging.DEBUG)
+        with self.bits_lock.writing(address, number):
+            bits = self._writable_bits()
+            if historian is not None:
+                old_bytes = bytes(bits[first:end])
+            # aligned range: a plain copy
+            if not (shift or number & 0x07):
+                bits[first:end] = data[:end - first]
             else:
-                return False
+                mask = ((1 << number) - 1) << shift
+                val_int = (mu.bytes_le_to_int(data[:(number + 7) // 8]) << shift) & mask
+                val_int |= mu.bytes_le_to_int(bits[first:end]) & ~mask
+                bits[first:end] = mu.int_to_bytes_le(val_int, end - first)
+            # bump generation after the data write, never before
+            self._bump_generation('bits')
+            if self._subscriptions:
+                self._notify('bits', address, number)
+            if historian is not None or log:
+                new_bytes = bytes(bits[first:end])
+            if historian is not None:
+                historian.record('bits', address, number, old_bytes, new_bytes, client)
+        if log:
+            self._log_write('bits', address, number, new_bytes, client, shift)
+        return True
 
-    @classmethod
-    def set_int2(cls, address, pvalue):
-        with cls.words_lock:
-            if (address>=0 and address<=65535 and pvalue <= 65535):
-                cls.words[address] = struct.pack('>H', pvalue)
-                return True
-            else:
-                return False
+    @_bank_method
+    def set_clear_words(self, pstart, pend):
+        if (pstart>=0 and pend<=65535) and (pstart <= pend):
+            return self.set_words(pstart, bytes(bytearray((pend + 1 - pstart) * 2)))
+        else:
+            return False
+
+    @_bank_method
+    def set_int2(self, address, pvalue):
+        if (address>=0 and address<=65535 and 0 <= pvalue <= 65535):
+            return self.set_words(address, struct.pack('>H', pvalue))
+        else:
+            return False
     
-    @classmethod
-    def set_int4(cls, pstart, pvalue):
-        with cls.words_lock:
-            if (pstart>=0 and pstart+1<=65535)  and (pvalue <= 4294967295):
-                cls.words[pstart:pstart+1] = struct.pack('>I', pvalue )
-                return True
-            else:
-                return False
+    @_bank_method
+    def set_int4(self, pstart, pvalue):
+        if (pstart>=0 and pstart+1<=65535)  and (0 <= pvalue <= 4294967295):
+            return self.set_words(pstart, struct.pack('>I', pvalue))
+        else:
+            return False
 
-    @classmethod
-    def set_float4(cls, pstart,  pvalue):
-        with cls.words_lock:
-            if (pstart>=0 and pstart+1<=65535)  and isinstance(pvalue, float):
-                cls.words[pstart:pstart+1] = struct.pack('>f',pvalue)
-                return True
-            else:
-                return False
+    @_bank_method
+    def set_float4(self, pstart,  pvalue):
+        if (pstart>=0 and pstart+1<=65535)  and isinstance(pvalue, float):
+            return self.set_words(pstart, struct.pack('>f', pvalue))
+        else:
+            return False
    
-    @classmethod
-    def set_words(cls, address, word_list):
-        with cls.words_lock:
-            #if (address >= 0) and (address + len(word_list) <= len(cls.words)):
-            if (address>=0 and address<=65535):
-                #ddcls.words[address: address + len(word_list)] = word_list
-                cls.words[address]=word_list 
-                if settings.SERVER_PRINT_REGISTER_CHANGES:
-                    print(word_list)
-                    try:
-                        print("Address: %s value: %s" % (address, (b''.join(word_list)).decode('ascii')))
-                    except :
-                        print("Address: %s value: %s" % (address, struct.unpack('>H', word_list)))
-                return True
-            else:
-                return False
+    @_bank_method
+    def set_words(self, address, word_list, client=None):
+        """Write registers from bytes (2 bytes big endian per register) or
+        from a list of 2 bytes items or int values, client is the writer
+        address for the historian"""
+        if isinstance(word_list, (bytes, bytearray, memoryview)):
+            data = word_list
+        else:
+            data = b''.join([w if isinstance(w, bytes) else struct.pack('>H', w) for w in word_list])
+        number = len(data) // 2
+        if not ((address >= 0) and (len(data) % 2 == 0) and (address + number <= 0x10000)):
+            return False
+        with self.words_lock.writing(address, number):
+            self._store_words(address, data, client)
+        self._log_write('words', address, number, data, client)
+        return True
+
+    @_bank_method
+    def set_int32s(self, address, values, word_order='ABCD', signed=True, client=None):
+        """Write 32 bits integers (2 registers each)
+        :param values: values to write
+        :type values: list
+        :param word_order: registers layout, one of WORD_ORDERS (optional)
+        :type word_order: str
+        :param signed: signed or unsigned integers (optional)
+        :type signed: bool
+        :returns: True if written, False if a value or the range is out of bounds
+        :rtype: bool
+        :raises ValueError: if word_order is unknown
+        """
+        return self._set_values(address, values, 'i' if signed else 'I', 2, word_order, client)
+
+    @_bank_method
+    def set_floats(self, address, values, word_order='ABCD', client=None):
+        """Write IEEE 754 float32 (2 registers each), see set_int32s()"""
+        return self._set_values(address, values, 'f', 2, word_order, client)
+
+    @_bank_method
+    def set_doubles(self, address, values, word_order='ABCD', client=None):
+        """Write IEEE 754 float64 (4 registers each), see set_int32s()"""
+        return self._set_values(address, values, 'd', 4, word_order, client)
+
+    @_bank_method
+    def set_string(self, address, text, swap_bytes=False, client=None):
+        """Write a string, 2 chars per register, an odd string is padded with NUL
+        :param text: latin-1 string
+        :type text: str
+        :param swap_bytes: first char in the lsb of each register (optional)
+        :type swap_bytes: bool
+        :returns: True if written
+        :rtype: bool
+        """
+        try:
+            data = text.encode('latin-1')
+        except UnicodeError:
+            return False
+        if len(data) % 2:
+            data += b'\x00'
+        if swap_bytes:
+            data = _swap_bytes(data)
+        return self.set_words(address, data, client=client)
+
+    @_bank_method
+    def mask_word(self, address, and_mask, or_mask, client=None):
+        """Modify a register as (value AND and_mask) OR (or_mask AND NOT and_mask),
+        atomically (Mask Write Register semantics)
+        :returns: True if written
+        :rtype: bool
+        """
+        if not ((0 <= address <= 0xFFFF) and (0 <= and_mask <= 0xFFFF) and (0 <= or_mask <= 0xFFFF)):
+            return False
+        with self.words_lock.writing(address, 1):
+            (value,) = struct.unpack('>H', self.words[address * 2:address * 2 + 2])
+            value = (value & and_mask) | (or_mask & ~and_mask & 0xFFFF)
+            data = struct.pack('>H', value)
+            self._store_words(address, data, client)
+        self._log_write('words', address, 1, data, client)
+        return True
+
+    @_bank_method
+    def write_read_words(self, w_address, data, r_address, r_number, client=None):
+        """Write registers from bytes then read registers, atomically: one lock
+        acquisition cover both ranges (Read/Write Multiple Registers semantics)
+        :returns: read registers bytes or None if a range is out of words space
+        :rtype: bytes or None
+        """
+        w_number = len(data) // 2
+        if not ((w_address >= 0) and (len(data) % 2 == 0) and (w_address + w_number <= 0x10000)
+                and (r_address >= 0) and (r_number >= 0) and (r_address + r_number <= 0x10000)):
+            return None
+        first = min(w_address, r_address)
+        end = max(w_address + w_number, r_address + r_number)
+        with self.words_lock.writing(first, end - first):
+            self._store_words(w_address, data, client)
+            r_data = memoryview(self.words)[r_address * 2:(r_address + r_number) * 2].tobytes()
+        self._log_write('words', w_address, w_number, data, client)
+        return r_data
+
+    def _store_words(self, address, data, client):
+        # write words, caller own the write lock of the range and call _log_write() after release
+        number = len(data) // 2
+        historian = self.historian
+        words = self._writable_words()
+        if historian is not None:
+            old_bytes = bytes(words[address * 2:address * 2 + len(data)])
+        words[address * 2:address * 2 + len(data)] = data
+        # bump generation after the data write, never before
+        self._bump_generation('words')
+        if self._subscriptions:
+            self._notify('words', address, number)
+        if historian is not None:
+            historian.record('words', address, number, old_bytes, bytes(data), client)
+
+    @staticmethod
+    def _log_write(kind, address, number, data, client, shift=0):
+        # register changes record, emit out of the write lock: a slow handler never hold writers off
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s %d to %d write: %s', kind, address, address + number - 1,
+                         _Values(kind, bytes(data), number, shift),
+                         extra={'kind': kind, 'address': address, 'number': number, 'client': client})
+
+
+# default data bank
+DataBank._default_bank = DataBank()
+
+
+class FileRWLock(RWLock):
+
+    """RWLock that also hold a fcntl record lock for other processes
+
+    The record lock cover [start, start + length) of the file (this range
+    may be after the end of file). As POSIX record locks are owned by the
+    process, the first local reader take the shared lock and the last one
+    release it.
+    """
+
+    def __init__(self, fd, start, length):
+        RWLock.__init__(self)
+        self._fd = fd
+        self._start = start
+        self._length = length
+        self._file_lock = Lock()
+        self._file_readers = 0
+
+    def acquire_read(self):
+        RWLock.acquire_read(self)
+        with self._file_lock:
+            self._file_readers += 1
+            if self._file_readers == 1:
+                fcntl.lockf(self._fd, fcntl.LOCK_SH, self._length, self._start)
+
+    def release_read(self):
+        with self._file_lock:
+            self._file_readers -= 1
+            if not self._file_readers:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._length, self._start)
+        RWLock.release_read(self)
+
+    def acquire_write(self):
+        RWLock.acquire_write(self)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self._length, self._start)
+
+    def release_write(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, self._length, self._start)
+        RWLock.release_write(self)
+
+
+class SharedDataBank(DataBank):
+
+    """Data bank stored in a memory mapped file, shared between processes
+
+    Every process (or forked child) that open the same file see the same
+    bits and words spaces. Locks stripes are doubled by fcntl record locks,
+    so readers and writers of all the processes follow the same rules as
+    threads of one process. Write generations are stored in the file header,
+    so a ResponseCache in any process see the writes of the others.
+    Change notifications (subscribe()) are only sent for local writes.
+    Need a POSIX system (fcntl) and Python 3.
+    """
+
+    # header not mapped (during DataBank.__init__)
+    _mm = None
+
+    def __init__(self, path=None):
+        """Constructor
+        :param path: image file, created if need, or None for an anonymous
+                     image shared with forked children only (optional)
+        :type path: str
+        :raises ValueError: if the file is not a data bank image or the system is not supported
+        """
+        # the spaces are memoryview of a mmap: Python 3 only
+        if fcntl is None or sys.version_info < (3,):
+            raise ValueError('SharedDataBank need fcntl (POSIX system) and Python 3')
+        DataBank.__init__(self)
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            self._file = open(path, 'a+b')
+        fd = self._file.fileno()
+        # init a new image under an exclusive lock of the header
+        fcntl.lockf(fd, fcntl.LOCK_EX, _IMAGE_BITS_OFFSET, 0)
+        try:
+            is_new = os.fstat(fd).st_size == 0
+            if is_new:
+                os.ftruncate(fd, _IMAGE_SIZE)
+            if os.fstat(fd).st_size == _IMAGE_SIZE:
+                self._mm = mmap.mmap(fd, _IMAGE_SIZE)
+                if is_new:
+                    _IMAGE_HEAD.pack_into(self._mm, 0, _IMAGE_MAGIC, _IMAGE_VERSION, 0, 0)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, _IMAGE_BITS_OFFSET, 0)
+        if self._mm is None or not _check_image(self._mm):
+            self.close()
+            raise ValueError('data bank image format error')
+        view = memoryview(self._mm)
+        self.bits = view[_IMAGE_BITS_OFFSET:_IMAGE_WORDS_OFFSET]
+        self.words = view[_IMAGE_WORDS_OFFSET:_IMAGE_SIZE]
+        # record locks of each space live at its offset in the file
+        self.bits_lock = RangeLock(new_lock=lambda i, size: FileRWLock(fd, _IMAGE_BITS_OFFSET + i * size, size))
+        self.words_lock = RangeLock(new_lock=lambda i, size: FileRWLock(fd, _IMAGE_WORDS_OFFSET + i * size, size))
+
+    @property
+    def bits_generation(self):
+        return struct.unpack_from('>Q', self._mm, 8)[0] if self._mm is not None else 0
+
+    @bits_generation.setter
+    def bits_generation(self, value):
+        if self._mm is not None:
+            struct.pack_into('>Q', self._mm, 8, value & 0xFFFFFFFFFFFFFFFF)
+
+    @property
+    def words_generation(self):
+        return struct.unpack_from('>Q', self._mm, 16)[0] if self._mm is not None else 0
+
+    @words_generation.setter
+    def words_generation(self, value):
+        if self._mm is not None:
+            struct.pack_into('>Q', self._mm, 16, value & 0xFFFFFFFFFFFFFFFF)
+
+    def _bump_generation(self, kind):
+        # writers of other processes too: read-modify-write under a record lock of the generations
+        with self._generation_lock:
+            fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX, 16, 8)
+            try:
+                if kind == 'bits':
+                    self.bits_generation += 1
+                else:
+                    self.words_generation += 1
+            finally:
+                fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN, 16, 8)
+
+    def _writable_bits(self):
+        return self.bits
+
+    def _writable_words(self):
+        return self.words
+
+    def clear_registers(self):
+        # spaces are in the file: clear them in place
+        with self.words_lock.writing(0, 0x10000):
+            self.words[:] = _ZERO_WORDS
+            self._bump_generation('words')
+        with self.bits_lock.writing(0, 0x10000):
+            self.bits[:] = _ZERO_BITS
+            self._bump_generation('bits')
+        if self._subscriptions:
+            self._notify('words', 0, 0x10000)
+            self._notify('bits', 0, 0x10000)
+        return True
+
+    def close(self):
+        """Unmap the image and close the file"""
+        if self._mm is not None:
+            if isinstance(self.bits, memoryview):
+                self.bits.release()
+                self.words.release()
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+class ResponseCache(object):
+
+    """Cache of read responses data
+
+    Entries are keyed by (unit ID, function code, address, count) and stamped
+    with the data bank write generation at read time, so any write to the
+    data bank invalidate them. When max_size entries is reach, the cache is
+    flushed. hits and misses counters are not locked (approximate stats).
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, key, data_bank, generation):
+        """Return the cached response data or None"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is data_bank and entry[1] == generation:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, key, data_bank, generation, tx_data):
+        """Store a response data read at this generation"""
+        if len(self._entries) >= self.max_size:
+            self._entries.clear()
+        self._entries[key] = (data_bank, generation, tx_data)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        """Return hits, misses and current size of the cache"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class ConnectionLimiter(object):
+
+    """Track the clients connections of a server, enforce max_connections
+
+    Engines call open() on each new connection, busy() when a frame begin,
+    idle() when its response is sent and close() at the end. When
+    max_connections is reach, a new connection evict the connection that is
+    idle for the longest time, or is rejected if none is idle. Closes for
+    timeouts are counted here too (see get_stats()).
+    """
+
+    def __init__(self, max_connections=None):
+        self.max_connections = max_connections
+        self._lock = Lock()
+        # idle connections, least recently used first: key -> close callback
+        self._idle = OrderedDict()
+        # connections inside a frame: key -> close callback
+        self._busy = {}
+        self._stats = {'rejected': 0, 'evicted': 0, 'idle_timeout': 0, 'read_timeout': 0, 'frame_timeout': 0}
+
+    def open(self, key, close):
+        """Add a new connection
+        :param key: connection key (any hashable)
+        :param close: callback that close the connection, if evicted
+        :type close: callable
+        :returns: False if the connection is rejected (and must be closed)
+        :rtype: bool
+        """
+        victim = None
+        with self._lock:
+            if self.max_connections is not None and len(self._idle) + len(self._busy) >= self.max_connections:
+                if not self._idle:
+                    self._stats['rejected'] += 1
+                    return False
+                victim = self._idle.popitem(last=False)[1]
+                self._stats['evicted'] += 1
+            self._idle[key] = close
+        # close out of lock: the victim call close() too
+        if victim is not None:
+            victim()
+        return True
+
+    def busy(self, key):
+        with self._lock:
+            close = self._idle.pop(key, None)
+            if close is not None:
+                self._busy[key] = close
+
+    def idle(self, key):
+        with self._lock:
+            close = self._busy.pop(key, None)
+            if close is not None:
+                self._idle[key] = close
+
+    def close(self, key):
+        with self._lock:
+            self._idle.pop(key, None)
+            self._busy.pop(key, None)
+
+    def count(self, reason):
+        """Count a connection closed for reason ('idle_timeout', 'read_timeout' or 'frame_timeout')"""
+        with self._lock:
+            self._stats[reason] += 1
+
+    def get_stats(self):
+        """Return current connections and counts of rejected, evicted and timed out connections"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['connections'] = len(self._idle) + len(self._busy)
+            return stats
+
+
+# MBAP header (transaction ID, protocol ID, length, unit ID)
+_MBAP = struct.Struct('>HHHB')
+# MBAP header followed by the function code
+_MBAP_FC = struct.Struct('>HHHBB')
+# same for an exception response, with the exception code
+_MBAP_FC_EXP = struct.Struct('>HHHBBB')
+
+
+# a request as seen by the function code handlers (client is the peer address or None)
+ModbusRequest = namedtuple('ModbusRequest', 'server data_bank tr_id unit_id fc data client')
+
 
 class ModbusServer(object):
 
     """Modbus TCP server"""
 
     class ModbusService(BaseRequestHandler):
-        
-        bytes_to_read = 2 
+
         def recv_all(self, size):
             if hasattr(socket, "MSG_WAITALL"):
                 data = self.request.recv(size, socket.MSG_WAITALL)
@@ -201,146 +1206,316 @@ class ModbusServer(object):
                     data += self.request.recv(size - len(data))
             return data
 
+        def recv_timeout(self, size, timeout, deadline, reason):
+            # like recv_all(), but each recv() wait at most timeout and all of them until deadline
+            # return None (after count the reason) on timeout
+            data = b''
+            while len(data) < size:
+                wait, wait_reason = timeout, reason
+                if deadline is not None:
+                    left = deadline - _timer()
+                    if wait is None or left < wait:
+                        wait, wait_reason = max(left, 0.0), 'frame_timeout'
+                self.request.settimeout(wait)
+                try:
+                    chunk = self.request.recv(size - len(data))
+                except socket.timeout:
+                    self.server.modbus_server.connections.count(wait_reason)
+                    return None
+                if not chunk:
+                    break
+                data += chunk
+            return data
+
+        def recv_frame(self, timed):
+            # return (head, body) of the next frame or None if the connection must be closed
+            server = self.server.modbus_server
+            limiter = server.connections
+            if not timed:
+                rx_head = self.recv_all(7)
+                limiter.busy(self)
+            else:
+                # wait the frame begin up to idle_timeout, then the whole frame up to frame_timeout
+                rx_head = self.recv_timeout(1, server.idle_timeout, None, 'idle_timeout')
+                if not rx_head:
+                    return None
+                limiter.busy(self)
+                deadline = _timer() + server.frame_timeout if server.frame_timeout is not None else None
+                rx_head += self.recv_timeout(6, server.read_timeout, deadline, 'read_timeout') or b''
+            # close connection if no standard 7 bytes header
+            if not (rx_head and len(rx_head) == 7):
+                return None
+            # close connection if frame header content inconsistency
+            body_size = self.frame_body_size(rx_head)
+            if body_size is None:
+                return None
+            # receive body
+            if not timed:
+                rx_body = self.recv_all(body_size)
+            else:
+                rx_body = self.recv_timeout(body_size, server.read_timeout, deadline, 'read_timeout')
+            # close connection if lack of bytes in frame body
+            if not (rx_body and (len(rx_body) == body_size)):
+                return None
+            return rx_head, rx_body
+
+        def evict(self):
+            # called by ConnectionLimiter from another thread: wake up the recv() of this one
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
         def handle(self):
+            server = self.server.modbus_server
+            if not server.connections.open(self, self.evict):
+                self.request.close()
+                return
+            metrics = server.metrics
+            if metrics is not None:
+                metrics.connection_opened()
+            try:
+                self.handle_frames()
+            finally:
+                server.connections.close(self)
+                if metrics is not None:
+                    metrics.connection_closed()
+
+        def handle_frames(self):
+            server = self.server.modbus_server
+            # without timeouts keep the blocking recv_all() path
+            timed = not (server.idle_timeout is None and server.read_timeout is None
+                         and server.frame_timeout is None)
             while True:
-                rx_head = self.recv_all(7)
-                # close connection if no standard 7 bytes header
-                if not (rx_head and len(rx_head) == 7):
-                    break
-                # decode header
-                (rx_hd_tr_id, rx_hd_pr_id,
-                 rx_hd_length, rx_hd_unit_id) = struct.unpack('>HHHB', rx_head)
-                # close connection if frame header content inconsistency
-                if not ((rx_hd_pr_id == 0) and (2 < rx_hd_length < 256)):
+                frame = self.recv_frame(timed)
+                if frame is None:
                     break
-                # receive body
-                rx_body = self.recv_all(rx_hd_length - 1)
-                # close connection if lack of bytes in frame body
-                if not (rx_body and (len(rx_body) == rx_hd_length - 1)):
+                (rx_head, rx_body) = frame
+                # close connection if the frame can't be processed
+                tx_frame = self.process_frame(server, rx_head, rx_body, self.client_address)
+                if tx_frame is None:
                     break
-                # body decode: function code
-                rx_bd_fc = struct.unpack('B', rx_body[0:1])[0]
-                # close connection if function code is inconsistent
-                if rx_bd_fc > 0x7F:
+                # send frame (with timeouts, a client that don't read can't block it forever)
+                try:
+                    self.request.sendall(tx_frame)
+                except socket.error:
                     break
-                # default except status
-                exp_status = const.EXP_NONE
-                # functions Read Coils (0x01) or Read Discrete Inputs (0x02)
-                if rx_bd_fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS):
-                    (b_address, b_count) = struct.unpack('>HH', rx_body[1:])
-                    # check quantity of requested bits
-                    if 0x0001 <= b_count <= 0x07D0:
-                        bits_l = DataBank.get_bits(b_address, b_count)
-                        if bits_l:
-                            # allocate bytes list
-                            b_size = int(b_count / 8)
-                            b_size += 1 if (b_count % 8) else 0
-                            bytes_l = [0] * b_size
-                            # populate bytes list with data bank bits
-                            for i, item in enumerate(bits_l):
-                                if item:
-                                    byte_i = int(i/8)
-                                    bytes_l[byte_i] = mu.set_bit(bytes_l[byte_i], i % 8)
-                            # format body of frame with bits
-                            tx_body = struct.pack('BB', rx_bd_fc, len(bytes_l))
-                            # add bytes with bits
-                            for byte in bytes_l:
-                                tx_body += struct.pack('B', byte)
-                        else:
-                            exp_status = const.EXP_DATA_ADDRESS
-                    else:
-                        exp_status = const.EXP_DATA_VALUE
-                # functions Read Holding Registers (0x03) or Read Input Registers (0x04)
-                elif rx_bd_fc in (const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
-                    (w_address, w_count) = struct.unpack('>HH', rx_body[1:])
-                    # check quantity of requested words
-                    if 0x0001 <= w_count <= 0x007D:
-                        words_l = DataBank.get_words(w_address, w_count)
-                        if words_l:
-                            # format body of frame with words
-                            tx_body = struct.pack('BB', rx_bd_fc, w_count * 2)
-                            for word in words_l:
-                                tx_body += word
-                                #tx_body += struct.pack('>H', word)
-                        else:
-                            exp_status = const.EXP_DATA_ADDRESS
-                    else:
-                        exp_status = const.EXP_DATA_VALUE
-                # function Write Single Coil (0x05)
-                elif rx_bd_fc is const.WRITE_SINGLE_COIL:
-                    (b_address, b_value) = struct.unpack('>HH', rx_body[1:])
-                    f_b_value = bool(b_value == 0xFF00)
-                    if DataBank.set_bits(b_address, [f_b_value]):
-                        # send write ok frame
-                        tx_body = struct.pack('>BHH', rx_bd_fc, b_address, b_value)
-                    else:
-                        exp_status = const.EXP_DATA_ADDRESS
-                # function Write Single Register (0x06)
-                elif rx_bd_fc is const.WRITE_SINGLE_REGISTER:
-                    (w_address, w_value) = struct.unpack('>HH', rx_body[1:])
-                    #w_address = struct.unpack('>H', rx_body[1:3])
-                    #w_value = 
-                    print(rx_body[3:5])
-                    if DataBank.set_words(w_address, rx_body[3:5]):
-                        # send write ok frame
-                        #tx_body = struct.pack('>BHH', rx_bd_fc, w_address, w_value)
-                        tx_body = struct.pack('>BH', rx_bd_fc, w_address ) + rx_body[3:5]
-                    else:
-                        exp_status = const.EXP_DATA_ADDRESS
-                # function Write Multiple Coils (0x0F)
-                elif rx_bd_fc is const.WRITE_MULTIPLE_COILS:
-                    (b_address, b_count, byte_count) = struct.unpack('>HHB', rx_body[1:6])
-                    # check quantity of updated coils
-                    if (0x0001 <= b_count <= 0x07B0) and (byte_count >= (b_count/8)):
-                        # allocate bits list
-                        bits_l = [False] * b_count
-                        # populate bits list with bits from rx frame
-                        for i, item in enumerate(bits_l):
-                            b_bit_pos = int(i/8)+6
-                            b_bit_val = struct.unpack('B', rx_body[b_bit_pos:b_bit_pos+1])[0]
-                            bits_l[i] = mu.test_bit(b_bit_val, i % 8)
-                        # write words to data bank
-                        if DataBank.set_bits(b_address, bits_l):
-                            # send write ok frame
-                            tx_body = struct.pack('>BHH', rx_bd_fc, b_address, b_count)
-                        else:
-                            exp_status = const.EXP_DATA_ADDRESS
-                    else:
-                        exp_status = const.EXP_DATA_VALUE
-                # function Write Multiple Registers (0x10)
-                elif rx_bd_fc is const.WRITE_MULTIPLE_REGISTERS:
-                    (w_address, w_count, byte_count) = struct.unpack('>HHB', rx_body[1:6])
-                    # check quantity of updated words
-                    if (0x0001 <= w_count <= 0x007B) and (byte_count == w_count * 2):
-                        # allocate words list
-                        words_l = [0] * w_count
-                        # populate words list with words from rx frame
-                        for i, item in enumerate(words_l):
-                            w_offset = i * 2 + 6
-                            # words_l[i] = struct.unpack('>H', rx_body[w_offset:w_offset + 2])[0]
-                            # write words to data bank
-                            print(w_address)
-                            print(rx_body[w_offset:w_offset + self.bytes_to_read])
-                            if DataBank.set_words(w_address+i, rx_body[w_offset:w_offset + self.bytes_to_read]):
-                            # send write ok frame
-                                tx_body = struct.pack('>BHH', rx_bd_fc, w_address, w_count)
-                            else:
-                                exp_status = const.EXP_DATA_ADDRESS
-                    else:
-                        exp_status = const.EXP_DATA_VALUE
-                else:
-                    exp_status = const.EXP_ILLEGAL_FUNCTION
-                # check exception
-                if exp_status != const.EXP_NONE:
-                    # format body of frame with exception status
-                    tx_body = struct.pack('BB', rx_bd_fc + 0x80, exp_status)
-                # build frame header
-                tx_head = struct.pack('>HHHB', rx_hd_tr_id, rx_hd_pr_id, len(tx_body) + 1, rx_hd_unit_id)
-                # send frame
-                self.request.send(tx_head + tx_body)
+                server.connections.idle(self)
             self.request.close()
 
-    def __init__(self, host='localhost', port=const.MODBUS_PORT, no_block=False, ipv6=False, register_width=16):
+        @staticmethod
+        def frame_body_size(rx_head):
+            """Check a MBAP header and return the size of the frame body
+            :param rx_head: the 7 bytes MBAP header
+            :type rx_head: bytes
+            :returns: number of bytes to read after the header or None if header is inconsistent
+            :rtype: int or None
+            """
+            (rx_hd_tr_id, rx_hd_pr_id,
+             rx_hd_length, rx_hd_unit_id) = _MBAP.unpack(rx_head)
+            if not ((rx_hd_pr_id == 0) and (2 < rx_hd_length < 256)):
+                return None
+            return rx_hd_length - 1
+
+        @classmethod
+        def process_frame(cls, server, rx_head, rx_body, client=None):
+            """Process a request frame and build the response frame
+            Do not touch the socket, so every server engine share the same
+            function codes semantics.
+            :param server: the server that receive the frame
+            :type server: ModbusServer
+            :param rx_head: the 7 bytes MBAP header
+            :type rx_head: bytes
+            :param rx_body: frame body (function code and data)
+            :type rx_body: bytes
+            :param client: address of the client (optional)
+            :type client: tuple
+            :returns: response frame or None if the connection must be closed
+            :rtype: bytes or None
+            """
+            # decode header
+            (rx_hd_tr_id, rx_hd_pr_id,
+             rx_hd_length, rx_hd_unit_id) = _MBAP.unpack(rx_head)
+            # body decode: function code
+            rx_bd_fc = struct.unpack('B', rx_body[0:1])[0]
+            # close connection if function code is inconsistent
+            if rx_bd_fc > 0x7F:
+                return None
+            metrics = server.metrics
+            if metrics is not None:
+                t_start = _timer()
+            # route the request to the data bank of its unit ID
+            data_bank = server.get_data_bank(rx_hd_unit_id)
+            handler = server.functions.get(rx_bd_fc)
+            if data_bank is None:
+                exp_status = const.EXP_GATEWAY_PATH_UNAVAILABLE
+            elif handler is None:
+                exp_status = const.EXP_ILLEGAL_FUNCTION
+            else:
+                request = ModbusRequest(server, data_bank, rx_hd_tr_id, rx_hd_unit_id,
+                                        rx_bd_fc, memoryview(rx_body)[1:], client)
+                exp_status, tx_data = handler(request)
+            # build the frame: header and function code in one pack, data appended with one copy
+            if exp_status != const.EXP_NONE:
+                tx_frame = _MBAP_FC_EXP.pack(rx_hd_tr_id, rx_hd_pr_id, 3, rx_hd_unit_id,
+                                             rx_bd_fc + 0x80, exp_status)
+            else:
+                tx_frame = _MBAP_FC.pack(rx_hd_tr_id, rx_hd_pr_id, len(tx_data) + 2, rx_hd_unit_id,
+                                         rx_bd_fc) + tx_data
+            if metrics is not None:
+                metrics.record(rx_bd_fc, rx_hd_unit_id, exp_status, len(rx_head) + len(rx_body),
+                               len(tx_frame), _timer() - t_start)
+            return tx_frame
+
+        # Function codes handlers
+        # A handler get a ModbusRequest and return (except status, response data after the function code).
+
+        @staticmethod
+        def read_bits(request):
+            """Read Coils (0x01) or Read Discrete Inputs (0x02)"""
+            if len(request.data) != 4:
+                return const.EXP_DATA_VALUE, None
+            (b_address, b_count) = struct.unpack('>HH', request.data)
+            # check quantity of requested bits
+            if not 0x0001 <= b_count <= 0x07D0:
+                return const.EXP_DATA_VALUE, None
+            # read generation before the data: a concurrent write can't be cached as current
+            cache = request.server.cache
+            if cache is not None:
+                key = (request.unit_id, request.fc, b_address, b_count)
+                generation = request.data_bank.bits_generation
+                tx_data = cache.get(key, request.data_bank, generation)
+                if tx_data is not None:
+                    return const.EXP_NONE, tx_data
+            bits = request.data_bank.get_bits_bytes(b_address, b_count)
+            if bits is None:
+                return const.EXP_DATA_ADDRESS, None
+            tx_data = struct.pack('B', len(bits)) + bits
+            if cache is not None:
+                cache.put(key, request.data_bank, generation, tx_data)
+            return const.EXP_NONE, tx_data
+
+        @staticmethod
+        def read_words(request):
+            """Read Holding Registers (0x03) or Read Input Registers (0x04)"""
+            if len(request.data) != 4:
+                return const.EXP_DATA_VALUE, None
+            (w_address, w_count) = struct.unpack('>HH', request.data)
+            # check quantity of requested words
+            if not 0x0001 <= w_count <= 0x007D:
+                return const.EXP_DATA_VALUE, None
+            # read generation before the data: a concurrent write can't be cached as current
+            cache = request.server.cache
+            if cache is not None:
+                key = (request.unit_id, request.fc, w_address, w_count)
+                generation = request.data_bank.words_generation
+                tx_data = cache.get(key, request.data_bank, generation)
+                if tx_data is not None:
+                    return const.EXP_NONE, tx_data
+            # byte count then registers copied from the data bank, in one preallocated buffer
+            tx_data = bytearray(1 + w_count * 2)
+            tx_data[0] = w_count * 2
+            if not request.data_bank.get_words_into(tx_data, 1, w_address, w_count):
+                return const.EXP_DATA_ADDRESS, None
+            if cache is not None:
+                cache.put(key, request.data_bank, generation, tx_data)
+            return const.EXP_NONE, tx_data
+
+        @staticmethod
+        def write_single_coil(request):
+            """Write Single Coil (0x05)"""
+            if len(request.data) != 4:
+                return const.EXP_DATA_VALUE, None
+            (b_address, b_value) = struct.unpack('>HH', request.data)
+            if not request.data_bank.set_bits(b_address, [b_value == 0xFF00], client=request.client):
+                return const.EXP_DATA_ADDRESS, None
+            # write ok: echo the request
+            return const.EXP_NONE, request.data.tobytes()
+
+        @staticmethod
+        def write_single_register(request):
+            """Write Single Register (0x06)"""
+            if len(request.data) != 4:
+                return const.EXP_DATA_VALUE, None
+            (w_address,) = struct.unpack('>H', request.data[0:2])
+            if not request.data_bank.set_words(w_address, request.data[2:4], client=request.client):
+                return const.EXP_DATA_ADDRESS, None
+            # write ok: echo the request
+            return const.EXP_NONE, request.data.tobytes()
+
+        @staticmethod
+        def write_multiple_coils(request):
+            """Write Multiple Coils (0x0F)"""
+            if not (len(request.data) >= 5 and len(request.data) == 5 + request.data[4]):
+                return const.EXP_DATA_VALUE, None
+            (b_address, b_count, byte_count) = struct.unpack('>HHB', request.data[0:5])
+            # check quantity of updated coils
+            if not ((0x0001 <= b_count <= 0x07B0) and (byte_count == (b_count + 7) // 8)):
+                return const.EXP_DATA_VALUE, None
+            # write packed bits from rx frame to data bank
+            if not request.data_bank.set_bits_bytes(b_address, b_count, request.data[5:],
+                                                  client=request.client):
+                return const.EXP_DATA_ADDRESS, None
+            return const.EXP_NONE, struct.pack('>HH', b_address, b_count)
+
+        @staticmethod
+        def write_multiple_registers(request):
+            """Write Multiple Registers (0x10)"""
+            if not (len(request.data) >= 5 and len(request.data) == 5 + request.data[4]):
+                return const.EXP_DATA_VALUE, None
+            (w_address, w_count, byte_count) = struct.unpack('>HHB', request.data[0:5])
+            # check quantity of updated words
+            if not ((0x0001 <= w_count <= 0x007B) and (byte_count == w_count * 2)):
+                return const.EXP_DATA_VALUE, None
+            # write words from rx frame to data bank
+            if not request.data_bank.set_words(w_address, request.data[5:], client=request.client):
+                return const.EXP_DATA_ADDRESS, None
+            return const.EXP_NONE, struct.pack('>HH', w_address, w_count)
+
+        @staticmethod
+        def mask_write_register(request):
+            """Mask Write Register (0x16)"""
+            if len(request.data) != 6:
+                return const.EXP_DATA_VALUE, None
+            (w_address, and_mask, or_mask) = struct.unpack('>HHH', request.data)
+            if not request.data_bank.mask_word(w_address, and_mask, or_mask, client=request.client):
+                return const.EXP_DATA_ADDRESS, None
+            # write ok: echo the request
+            return const.EXP_NONE, request.data.tobytes()
+
+        @staticmethod
+        def read_write_multiple_registers(request):
+            """Read/Write Multiple Registers (0x17), the write is done before the read"""
+            if not (len(request.data) >= 9 and len(request.data) == 9 + request.data[8]):
+                return const.EXP_DATA_VALUE, None
+            (r_address, r_count, w_address, w_count, byte_count) = struct.unpack('>HHHHB', request.data[0:9])
+            # check quantities of read and written words
+            if not ((0x0001 <= r_count <= 0x007D) and (0x0001 <= w_count <= 0x0079)
+                    and (byte_count == w_count * 2)):
+                return const.EXP_DATA_VALUE, None
+            words = request.data_bank.write_read_words(w_address, request.data[9:], r_address, r_count,
+                                                       client=request.client)
+            if words is None:
+                return const.EXP_DATA_ADDRESS, None
+            return const.EXP_NONE, struct.pack('B', r_count * 2) + words
+
+        # default function code -> handler table of servers
+        functions = {
+            const.READ_COILS: read_bits.__func__,
+            const.READ_DISCRETE_INPUTS: read_bits.__func__,
+            const.READ_HOLDING_REGISTERS: read_words.__func__,
+            const.READ_INPUT_REGISTERS: read_words.__func__,
+            const.WRITE_SINGLE_COIL: write_single_coil.__func__,
+            const.WRITE_SINGLE_REGISTER: write_single_register.__func__,
+            const.WRITE_MULTIPLE_COILS: write_multiple_coils.__func__,
+            const.WRITE_MULTIPLE_REGISTERS: write_multiple_registers.__func__,
+            const.MASK_WRITE_REGISTER: mask_write_register.__func__,
+            const.READ_WRITE_MULTIPLE_REGISTERS: read_write_multiple_registers.__func__,
+        }
+
+    def __init__(self, host='localhost', port=const.MODBUS_PORT, no_block=False, ipv6=False, register_width=16,
+                 engine='thread', cache=False, workers=0, metrics=False, max_connections=None,
+                 idle_timeout=None, read_timeout=None, frame_timeout=None, no_delay=True):
         """Constructor
         Modbus server constructor.
         :param host: hostname or IPv4/IPv6 address server address (optional)
@@ -353,6 +1528,34 @@ class ModbusServer(object):
         :type ipv6: bool
         :param register_width: how many bits the server expects for each word sent default 16 or 32 bit
         :type register_width: integer 
+        :param engine: 'thread' (one thread per client), 'asyncio' (all clients on one event loop)
+                       or 'selectors' (all clients on one non-blocking selectors loop), the last
+                       two need Python 3
+        :type engine: str
+        :param cache: cache read responses until the next write to the data bank (optional)
+        :type cache: bool
+        :param workers: number of forked worker processes that serve the port (SO_REUSEPORT),
+                        0 to serve in this process (optional)
+        :type workers: int
+        :param metrics: count requests, exceptions, bytes and latency per function code
+                        and per unit ID (see ServerMetrics) (optional)
+        :type metrics: bool
+        :param max_connections: max number of clients connections, at the limit the longest idle
+                                connection is closed for a new one, or the new one is rejected (optional)
+        :type max_connections: int
+        :param idle_timeout: close connections idle (no frame) for this number of seconds (optional)
+        :type idle_timeout: float
+        :param read_timeout: close connections that send no byte for this number of seconds
+                             inside a frame (optional)
+        :type read_timeout: float
+        :param frame_timeout: close connections that don't send a whole frame within this number
+                              of seconds after its first byte (optional)
+        :type frame_timeout: float
+        :param no_delay: set TCP_NODELAY on clients sockets, responses are sent without Nagle
+                         delay, compare with python -m pyModbusTCP.bench (optional)
+        :type no_delay: bool
+        :raises ValueError: if engine is unknown or is not 'thread' before Python 3.5 or if workers
+                            are not supported by the system
         """
         # public
         self.host = host
@@ -360,10 +1563,106 @@ class ModbusServer(object):
         self.no_block = no_block
         self.ipv6 = ipv6
         self.register_width = register_width
+        if engine not in ('thread', 'asyncio', 'selectors'):
+            raise ValueError('engine value error')
+        if engine != 'thread' and sys.version_info < (3, 5):
+            raise ValueError('%s engine need Python 3.5+' % engine)
+        self.engine = engine
+        if int(workers) < 0:
+            raise ValueError('workers value error')
+        if workers and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT') and fcntl):
+            raise ValueError('workers need fork, SO_REUSEPORT and fcntl')
+        self.workers = int(workers)
+        # data bank for unit IDs without a registered one (None to reject them)
+        # workers share their registers through a SharedDataBank
+        self.default_data_bank = SharedDataBank() if self.workers else DataBank.default()
+        # read responses cache (see ResponseCache.get_stats()) or None
+        self.cache = ResponseCache() if cache else None
+        # requests metrics (see ServerMetrics.get_stats()) or None
+        if metrics:
+            from metrics import ServerMetrics
+            self.metrics = ServerMetrics()
+        else:
+            self.metrics = None
+        # connections limits and timeouts (see ConnectionLimiter.get_stats())
+        if max_connections is not None and int(max_connections) < 1:
+            raise ValueError('max_connections value error')
+        for timeout in (idle_timeout, read_timeout, frame_timeout):
+            if timeout is not None and not timeout > 0:
+                raise ValueError('timeout value error')
+        self.connections = ConnectionLimiter(max_connections)
+        self.idle_timeout = idle_timeout
+        self.read_timeout = read_timeout
+        self.frame_timeout = frame_timeout
+        self.no_delay = no_delay
+        # function code -> handler, see register_function()
+        self.functions = dict(self.ModbusService.functions)
         # private
         self._running = False
         self._service = None
         self._serve_th = None
+        self._data_banks = {}
+        self._workers_pids = []
+
+    def register_function(self, fc, handler):
+        """Register the handler of a function code
+        The handler is called with a ModbusRequest (request data is a view of
+        the frame body after the function code) and must return a tuple
+        (except status, response data). With const.EXP_NONE as status, the
+        response data (bytes after the function code) is sent back, otherwise
+        an exception response with this status is sent.
+        Replace the current handler of the function code, if any.
+        :param fc: function code (1 to 127)
+        :type fc: int
+        :param handler: the handler or None to unregister the function code
+        :type handler: callable or None
+        :raises ValueError: if fc is out of range or handler is not callable
+        """
+        if not 0x01 <= int(fc) <= 0x7F:
+            raise ValueError('fc value error')
+        if handler is None:
+            self.functions.pop(int(fc), None)
+        elif callable(handler):
+            self.functions[int(fc)] = handler
+        else:
+            raise ValueError('handler value error')
+
+    def add_data_bank(self, unit_id, data_bank=None):
+        """Register a data bank for a unit ID
+        Requests to this unit ID are served from this data bank.
+        :param unit_id: unit ID (0 to 255)
+        :type unit_id: int
+        :param data_bank: the data bank, a new one is built if not set, it must be a
+                          SharedDataBank with workers (optional)
+        :type data_bank: DataBank
+        :returns: the registered data bank
+        :rtype: DataBank
+        :raises ValueError: if unit_id is out of range
+        """
+        if not 0 <= int(unit_id) < 256:
+            raise ValueError('unit_id value error')
+        if data_bank is None:
+            data_bank = SharedDataBank() if self.workers else DataBank()
+        self._data_banks[int(unit_id)] = data_bank
+        return data_bank
+
+    def remove_data_bank(self, unit_id):
+        """Unregister the data bank of a unit ID
+        :param unit_id: unit ID (0 to 255)
+        :type unit_id: int
+        :returns: the removed data bank or None if not registered
+        :rtype: DataBank or None
+        """
+        return self._data_banks.pop(unit_id, None)
+
+    def get_data_bank(self, unit_id):
+        """Return the data bank that serve a unit ID
+        :param unit_id: unit ID (0 to 255)
+        :type unit_id: int
+        :returns: registered data bank, default_data_bank if none or None if the unit ID is not served
+        :rtype: DataBank or None
+        """
+        return self._data_banks.get(unit_id, self.default_data_bank)
 
 
     def start(self):
@@ -372,19 +1671,12 @@ class ModbusServer(object):
         This function will block if no_block is not set to True.
         """
         if not self.is_run:
-            # set class attribute
-            ThreadingTCPServer.address_family = socket.AF_INET6 if self.ipv6 else socket.AF_INET
-            ThreadingTCPServer.daemon_threads = True
-            # init server
-            self._service = ThreadingTCPServer((self.host, self.port), self.ModbusService, bind_and_activate=False)
-            # set socket options
-            self._service.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._service.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            # TODO test no_delay with bench
-            self._service.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            # bind and activate
-            self._service.server_bind()
-            self._service.server_activate()
+            if self.workers:
+                self._start_workers()
+                if not self.no_block:
+                    self._wait_workers()
+                return
+            self._new_service()
             # serve request
             if self.no_block:
                 self._serve_th = Thread(target=self._serve)
@@ -398,8 +1690,11 @@ class ModbusServer(object):
         Do nothing if server is already not running.
         """
         if self.is_run:
-            self._service.shutdown()
-            self._service.server_close()
+            if self.workers:
+                self._stop_workers()
+            else:
+                self._service.shutdown()
+                self._service.server_close()
 
     @property
     def is_run(self):
@@ -407,6 +1702,104 @@ class ModbusServer(object):
         """
         return self._running
 
+    def _new_service(self):
+        # select the engine that serve the clients connections
+        if self.engine == 'asyncio':
+            from async_server import AsyncioTCPServer as TCPServer
+        elif self.engine == 'selectors':
+            from selectors_server import SelectorsTCPServer as TCPServer
+        else:
+            TCPServer = ThreadingTCPServer
+            TCPServer.daemon_threads = True
+        # set class attribute
+        TCPServer.address_family = socket.AF_INET6 if self.ipv6 else socket.AF_INET
+        # init server
+        self._service = TCPServer((self.host, self.port), self.ModbusService, bind_and_activate=False)
+        self._service.modbus_server = self
+        # set socket options
+        self._service.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers:
+            # every worker listen on the port, the kernel spread the connections
+            self._service.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._service.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # accepted sockets inherit it on Linux (see pyModbusTCP.bench for a comparison)
+        self._service.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if self.no_delay else 0)
+        # bind and activate
+        self._service.server_bind()
+        self._service.server_activate()
+        # legacy register changes output: through the queue pipeline, not print() under the write locks
+        if settings.SERVER_PRINT_REGISTER_CHANGES and not mu.log_queue_started():
+            mu.start_log_queue(name='pyModbusTCP.server')
+
+    def _start_workers(self):
+        self._workers_pids = []
+        for _ in range(self.workers):
+            # worker report its bind status on a pipe: nothing if ok, the error otherwise
+            (r_fd, w_fd) = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r_fd)
+                self._worker(w_fd)
+            os.close(w_fd)
+            self._workers_pids.append(pid)
+            with os.fdopen(r_fd, 'rb') as f:
+                error = f.read()
+            if error:
+                self._stop_workers()
+                raise socket.error(error.decode('utf-8', 'replace'))
+        self._running = True
+
+    def _worker(self, status_fd):
+        # forked worker process: never return
+        exit_code = 1
+        try:
+            # parent process handle Ctrl-C and stop the workers with SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            # changes are notified in the parent process only
+            for data_bank in [self.default_data_bank] + list(self._data_banks.values()):
+                if data_bank is not None:
+                    data_bank._subscriptions = []
+            try:
+                self._new_service()
+            except Exception as e:
+                os.write(status_fd, (str(e) or repr(e)).encode('utf-8'))
+                raise
+            finally:
+                os.close(status_fd)
+            # shutdown() wait for serve_forever(), so call it from another thread
+            signal.signal(signal.SIGTERM, lambda signum, frame: Thread(target=self._service.shutdown).start())
+            self._service.serve_forever()
+            self._service.server_close()
+            exit_code = 0
+        except Exception:
+            logger.exception('worker error')
+        finally:
+            os._exit(exit_code)
+
+    def _wait_workers(self):
+        try:
+            for pid in list(self._workers_pids):
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+        finally:
+            self._stop_workers()
+
+    def _stop_workers(self):
+        pids, self._workers_pids = self._workers_pids, []
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._running = False
+
     def _serve(self):
         try:
             self._running = True
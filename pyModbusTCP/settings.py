@@ -8,7 +8,7 @@ DATABASE_BACKUP_PATH = ''
 CLIENT_STARTING_IP= '192.168.1'
 CSV_DUMP_Path= ''
 SCAN_SLEEP_TIME=3  # the time the server sleeps between bit_command scans 
-SERVER_PRINT_REGISTER_CHANGES = False
+SERVER_PRINT_REGISTER_CHANGES = False  # log register changes to stdout (see utils.start_log_queue)
 SERVER_BLOCKING = True
 LOG=True
 LOG_NAME='ModBus_Log_%s.log' % (str(time.localtime()).replace(':','-'))
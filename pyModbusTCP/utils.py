@@ -1,5 +1,6 @@
 import struct, binascii
-import logging, logging.config, time, os
+from itertools import chain
+import logging, logging.config, time, os, sys
 import settings 
 from threading import Lock, Thread
 
@@ -17,6 +18,73 @@ def start_logger(args):
     return 
 
 
+# queue pipeline (logging.handlers.QueueHandler need Python 3.2+)
+try:
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import Queue
+
+    class _RecordQueueHandler(QueueHandler):
+
+        """Put records in the queue as is: message formatting is done by
+        the listener thread, not by the caller"""
+
+        def prepare(self, record):
+            return record
+
+except ImportError:
+    QueueHandler = None
+
+_log_queue = None
+
+
+def start_log_queue(handlers=None, level=logging.DEBUG, name='pyModbusTCP'):
+    """Send the records of a logger through a queue
+    The logger get a queue handler: a record cost a queue put in the thread
+    that emit it. A background QueueListener thread format the records and
+    pass them to handlers. Records args must not be changed after the log
+    call. A previous pipeline is stopped first. The listener thread is not
+    inherited by forked processes (ModbusServer workers).
+    :param handlers: handlers of the listener, a stdout StreamHandler by default (optional)
+    :type handlers: list
+    :param level: level of the logger (optional)
+    :type level: int
+    :param name: logger name, 'pyModbusTCP' for all modules (optional)
+    :type name: str
+    :returns: the started listener
+    :rtype: logging.handlers.QueueListener
+    :raises RuntimeError: if QueueHandler is not available (Python < 3.2)
+    """
+    global _log_queue
+    if QueueHandler is None:
+        raise RuntimeError('logging QueueHandler is not available')
+    stop_log_queue()
+    if handlers is None:
+        handlers = [logging.StreamHandler(sys.stdout)]
+    logger = logging.getLogger(name)
+    q_handler = _RecordQueueHandler(Queue())
+    listener = QueueListener(q_handler.queue, *handlers, respect_handler_level=True)
+    logger.addHandler(q_handler)
+    logger.setLevel(level)
+    listener.start()
+    _log_queue = (logger, q_handler, listener)
+    return listener
+
+
+def stop_log_queue():
+    """Stop the pipeline of start_log_queue(), once every queued record is handled"""
+    global _log_queue
+    if _log_queue is not None:
+        (logger, q_handler, listener) = _log_queue
+        _log_queue = None
+        logger.removeHandler(q_handler)
+        listener.stop()
+
+
+def log_queue_started():
+    """Return True if a start_log_queue() pipeline is running"""
+    return _log_queue is not None
+
+
 ###############
 # bits function
 ###############
@@ -40,6 +108,67 @@ def get_bits_from_int(val_int, val_size=16):
     return bits
 
 
+# int.from_bytes()/int.to_bytes() need Python 3.2+
+_HAS_INT_BYTES = hasattr(int, 'from_bytes')
+
+
+def bytes_le_to_int(data):
+    """Little endian bytes to int (int.from_bytes(data, 'little') on Python 2 too)
+        :param data: bytes
+        :type data: bytes
+        :returns: int value
+        :rtype: int
+    """
+    if _HAS_INT_BYTES:
+        return int.from_bytes(data, 'little')
+    return int(binascii.hexlify(bytes(bytearray(reversed(bytearray(data))))) or b'0', 16)
+
+
+def int_to_bytes_le(val_int, size):
+    """Int to size little endian bytes (val_int.to_bytes(size, 'little') on Python 2 too)
+        :param val_int: int value (fit in size bytes)
+        :type val_int: int
+        :param size: number of bytes
+        :type size: int
+        :returns: bytes
+        :rtype: bytes
+    """
+    if _HAS_INT_BYTES:
+        return val_int.to_bytes(size, 'little')
+    return bytes(bytearray(reversed(bytearray(binascii.unhexlify('%0*x' % (size * 2, val_int))))))
+
+
+# bits of each byte value, least significant first
+_BYTE_BITS = [tuple(bool((byte >> i) & 0x01) for i in range(8)) for byte in range(256)]
+
+
+def bits_to_bytes(bits_l):
+    """Pack a list of bits in bytes with the modbus layout (first bit is the
+        least significant bit of the first byte), last byte is padded with 0.
+        :param bits_l: list of bits values
+        :type bits_l: list
+        :returns: packed bits
+        :rtype: bytes
+    """
+    if not bits_l:
+        return b''
+    val_int = int(''.join(['1' if bit else '0' for bit in reversed(bits_l)]), 2)
+    return int_to_bytes_le(val_int, (len(bits_l) + 7) // 8)
+
+
+def bytes_to_bits(data, number):
+    """Unpack number bits from bytes with the modbus layout (first bit is the
+        least significant bit of the first byte).
+        :param data: packed bits
+        :type data: bytes
+        :param number: number of bits to unpack
+        :type number: int
+        :returns: list of boolean "bits"
+        :rtype: list
+    """
+    return list(chain.from_iterable(_BYTE_BITS[byte] for byte in bytearray(data)))[:number]
+
+
 #########################
 # floating-point function
 #########################
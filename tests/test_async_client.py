@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import sys
+import unittest
+from pyModbusTCP.server import ModbusServer, DataBank
+# async def syntax: Python 3.5+ only
+if sys.version_info >= (3, 5):
+    import asyncio
+    from pyModbusTCP.async_client import AsyncModbusClient
+from pyModbusTCP.constants import MB_EXCEPT_ERR, MB_CONNECT_ERR, MB_TIMEOUT_ERR, EXP_GATEWAY_PATH_UNAVAILABLE
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'AsyncModbusClient need Python 3.5+')
+class TestAsyncModbusClient(unittest.TestCase):
+
+    def setUp(self):
+        self.data_bank = DataBank()
+        self.server = ModbusServer(port=5033, no_block=True)
+        self.server.add_data_bank(1, self.data_bank)
+        self.server.start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.client = AsyncModbusClient(port=5033, timeout=5.0)
+
+    def tearDown(self):
+        self.client.close()
+        # let the closed links and reader tasks end
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        self.server.stop()
+
+    def run_loop(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_except_init(self):
+        self.assertRaises(ValueError, AsyncModbusClient, port=0)
+        self.assertRaises(ValueError, AsyncModbusClient, unit_id=256)
+        self.assertRaises(ValueError, AsyncModbusClient, timeout=0)
+
+    def test_functions(self):
+        client = self.client
+        self.assertTrue(self.run_loop(client.write_multiple_registers(10, [1, 2, 3])))
+        self.assertTrue(client.is_open())
+        self.assertTrue(self.run_loop(client.write_single_register(13, 4)))
+        self.assertEqual(self.run_loop(client.read_holding_registers(10, 4)), [1, 2, 3, 4])
+        self.assertEqual(self.run_loop(client.read_input_registers(10, 2)), [1, 2])
+        self.assertTrue(self.run_loop(client.write_multiple_coils(0, [True, False, True])))
+        self.assertTrue(self.run_loop(client.write_single_coil(3, True)))
+        self.assertEqual(self.run_loop(client.read_coils(0, 4)), [True, False, True, True])
+        self.assertEqual(self.run_loop(client.read_discrete_inputs(1, 2)), [False, True])
+        self.assertTrue(self.run_loop(client.mask_write_register(10, 0xfff0, 0x000a)))
+        self.assertEqual(self.run_loop(client.read_write_multiple_registers(10, 2, 11, [7])), [0x000a, 7])
+        # bad params: no request
+        self.assertIsNone(self.run_loop(client.read_holding_registers(0, 126)))
+        self.assertIsNone(self.run_loop(client.write_single_register(0, 0x10000)))
+
+    def test_typed(self):
+        client = self.client
+        self.assertTrue(self.run_loop(client.write_floats(0, [1.5, -2.0])))
+        self.assertEqual(self.run_loop(client.read_floats(0, 2)), [1.5, -2.0])
+        self.assertTrue(self.run_loop(client.write_longs(10, [0x12345678], big_endian=False)))
+        self.assertEqual(self.run_loop(client.read_holding_registers(10, 2)), [0x5678, 0x1234])
+        self.assertEqual(self.run_loop(client.read_longs(10, 1, big_endian=False)), [0x12345678])
+
+    def test_concurrent(self):
+        # requests of many tasks on one link, answered in any order
+        self.data_bank.set_words(0, list(range(100)))
+
+        poll = asyncio.gather(*[self.client.read_holding_registers(i, 1) for i in range(100)])
+        self.assertEqual(self.run_loop(poll), [[i] for i in range(100)])
+
+    def test_except(self):
+        # unit ID not served
+        self.server.default_data_bank = None
+        client = AsyncModbusClient(port=5033, unit_id=2, timeout=5.0)
+        self.assertIsNone(self.run_loop(client.read_holding_registers(0)))
+        self.assertEqual(client.last_error(), MB_EXCEPT_ERR)
+        self.assertEqual(client.last_except(), EXP_GATEWAY_PATH_UNAVAILABLE)
+        client.close()
+        # no server
+        client = AsyncModbusClient(port=5034, timeout=1.0)
+        self.assertIsNone(self.run_loop(client.read_coils(0)))
+        self.assertEqual(client.last_error(), MB_CONNECT_ERR)
+
+    def test_timeout(self):
+        # a server that never answer
+        listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listen.bind(('localhost', 5035))
+        listen.listen(1)
+        try:
+            client = AsyncModbusClient(port=5035, timeout=0.2)
+            self.assertIsNone(self.run_loop(client.read_holding_registers(0)))
+            self.assertEqual(client.last_error(), MB_TIMEOUT_ERR)
+            client.close()
+        finally:
+            listen.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
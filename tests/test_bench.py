@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+from pyModbusTCP.bench import run_benchmark
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'selectors engine need Python 3.5+')
+class TestBench(unittest.TestCase):
+
+    def test_run(self):
+        report = run_benchmark(engines=['selectors'], functions=[3, 16], sizes=[1, 124], clients=2,
+                               duration=0.2, port=5040)
+        # 124 registers is over the max of a write multiple registers: skipped
+        self.assertEqual([(r['fc'], r['size']) for r in report['results']], [(3, 1), (3, 124), (16, 1)])
+        for result in report['results']:
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['requests'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
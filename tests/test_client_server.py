@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import socket
+import struct
+import sys
+import time
 import unittest
 from random import randint, getrandbits
-from pyModbusTCP.server import ModbusServer
+from threading import Thread
+from pyModbusTCP.server import ModbusServer, DataBank
 from pyModbusTCP.client import ModbusClient
+from pyModbusTCP.constants import EXP_NONE, EXP_DATA_VALUE, EXP_GATEWAY_PATH_UNAVAILABLE
 
 
 class TestModbusClient(unittest.TestCase):
@@ -51,6 +58,19 @@ class TestModbusClient(unittest.TestCase):
         self.assertEqual(c.unit_id(420), None)
 
 
+def recv_all(sock, size):
+    data = b''
+    while len(data) < size:
+        data += sock.recv(size - len(data))
+    return data
+
+
+class TestModbusServer(unittest.TestCase):
+    def test_except_init_engine(self):
+        # should raise an exception for unknown engine
+        self.assertRaises(ValueError, ModbusServer, engine='wrong')
+
+
 # TODO improve this basic test
 class TestClientServer(unittest.TestCase):
 
@@ -64,6 +84,7 @@ class TestClientServer(unittest.TestCase):
 
     def tearDown(self):
         self.client.close()
+        self.server.stop()
 
     def test_read_and_write(self):
         # word space
@@ -101,6 +122,495 @@ class TestClientServer(unittest.TestCase):
         bits_l = [getrandbits(1)] * 0x7b1
         self.assertEqual(self.client.write_multiple_coils(0, bits_l), None)
 
+    def test_mask_write(self):
+        self.assertEqual(self.client.write_single_register(100, 0x0012), True)
+        # example of modbus spec: (0x12 AND 0xf2) OR (0x25 AND NOT 0xf2) = 0x17
+        self.assertEqual(self.client.mask_write_register(100, 0x00f2, 0x0025), True)
+        self.assertEqual(self.client.read_holding_registers(100), [0x0017])
+        self.assertEqual(self.client.mask_write_register(100, 0x10000, 0), None)
+
+    def test_read_write_multiple(self):
+        self.assertEqual(self.client.write_multiple_registers(200, [1, 2, 3]), True)
+        # the write is done before the read
+        self.assertEqual(self.client.read_write_multiple_registers(200, 3, 201, [20, 30]), [1, 20, 30])
+        self.assertEqual(self.client.read_write_multiple_registers(210, 125, 300, [0] * 121), [0] * 125)
+        self.assertEqual(self.client.read_write_multiple_registers(210, 126, 300, [0]), None)
+        self.assertEqual(self.client.read_write_multiple_registers(210, 1, 300, [0] * 122), None)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio and selectors engines need Python 3.5+')
+class TestClientServerAsyncio(unittest.TestCase):
+    engine = 'asyncio'
+    port = 5021
+
+    def setUp(self):
+        # modbus server with a single thread engine
+        self.server = ModbusServer(port=self.port, no_block=True, engine=self.engine)
+        self.server.start()
+        # modbus clients
+        self.client = ModbusClient(port=self.port)
+        self.client.open()
+        self.client_2 = ModbusClient(port=self.port)
+        self.client_2.open()
+
+    def tearDown(self):
+        self.client.close()
+        self.client_2.close()
+        self.server.stop()
+
+    def test_read_and_write(self):
+        # word space: write with a client, read with the other one
+        words_l = [randint(0, 0xffff)] * 0x7b
+        self.assertEqual(self.client.write_multiple_registers(0, words_l), True)
+        self.assertEqual(self.client_2.read_holding_registers(0, len(words_l)), words_l)
+        self.assertEqual(self.client_2.write_single_register(0, 0x1234), True)
+        self.assertEqual(self.client.read_input_registers(0), [0x1234])
+        # bit space
+        bits_l = [getrandbits(1)] * 0x7b0
+        self.assertEqual(self.client.write_multiple_coils(0, bits_l), True)
+        self.assertEqual(self.client_2.read_coils(0, len(bits_l)), bits_l)
+        self.assertEqual(self.client_2.write_single_coil(0, True), True)
+        self.assertEqual(self.client.read_discrete_inputs(0), [True])
+
+    def test_many_clients(self):
+        # a lot of connections served at the same time by the event loop
+        clients = [ModbusClient(port=self.port) for _ in range(100)]
+        try:
+            for c in clients:
+                self.assertEqual(c.open(), True)
+            for i, c in enumerate(clients):
+                self.assertEqual(c.write_single_register(100 + i, i), True)
+            for i, c in enumerate(reversed(clients)):
+                self.assertEqual(c.read_holding_registers(100 + i), [i])
+        finally:
+            for c in clients:
+                c.close()
+
+    def test_pipelined_frames(self):
+        # several requests in one TCP segment: responses come back in order
+        sock = socket.create_connection(('localhost', self.port), timeout=5.0)
+        try:
+            tx_frames = b''
+            for tr_id in range(1, 11):
+                tx_frames += struct.pack('>HHHBBHH', tr_id, 0, 6, 1, 0x06, 200 + tr_id, tr_id)
+            sock.sendall(tx_frames)
+            for tr_id in range(1, 11):
+                rx_frame = recv_all(sock, 12)
+                self.assertEqual(rx_frame, struct.pack('>HHHBBHH', tr_id, 0, 6, 1, 0x06, 200 + tr_id, tr_id))
+        finally:
+            sock.close()
+        self.assertEqual(self.client.read_holding_registers(201, 10), list(range(1, 11)))
+
+    def test_short_body(self):
+        # read request with a truncated body: except "illegal data value", connection stay open
+        sock = socket.create_connection(('localhost', self.port), timeout=5.0)
+        try:
+            sock.sendall(struct.pack('>HHHBBH', 1, 0, 4, 1, 0x03, 0))
+            self.assertEqual(recv_all(sock, 9), struct.pack('>HHHBBB', 1, 0, 3, 1, 0x83, 0x03))
+            sock.sendall(struct.pack('>HHHBBHH', 2, 0, 6, 1, 0x03, 0, 1))
+            self.assertEqual(len(recv_all(sock, 11)), 11)
+        finally:
+            sock.close()
+
+    def test_handler_error(self):
+        # a raising handler close its connection, the server serve the other clients
+        def bad_handler(request):
+            raise RuntimeError('handler error')
+        self.server.register_function(0x41, bad_handler)
+        sock = socket.create_connection(('localhost', self.port), timeout=5.0)
+        logger = logging.getLogger('pyModbusTCP.server')
+        logger.disabled = True
+        try:
+            sock.sendall(struct.pack('>HHHBB', 1, 0, 2, 1, 0x41))
+            self.assertEqual(sock.recv(16), b'')
+        finally:
+            logger.disabled = False
+            sock.close()
+        self.assertTrue(self.server.is_run)
+        self.assertEqual(self.client.write_single_register(0, 42), True)
+        self.assertEqual(self.client_2.read_holding_registers(0), [42])
+
+    def test_stop_with_clients(self):
+        # stop with connected clients: links closed, no error logged by the event loop
+        records = []
+        handler = logging.Handler(logging.ERROR)
+        handler.emit = records.append
+        logger = logging.getLogger('asyncio')
+        logger.addHandler(handler)
+        try:
+            self.assertIsNotNone(self.client.read_holding_registers(0))
+            self.assertIsNotNone(self.client_2.read_coils(0))
+            self.server.stop()
+        finally:
+            logger.removeHandler(handler)
+        self.assertFalse(self.server.is_run)
+        self.assertEqual(records, [])
+        self.assertIsNone(self.client.read_holding_registers(0))
+
+
+class TestClientServerUnits(unittest.TestCase):
+
+    def setUp(self):
+        # modbus server with a data bank for unit ID 2 and 3
+        self.server = ModbusServer(port=5023, no_block=True)
+        self.bank_2 = self.server.add_data_bank(2)
+        self.bank_3 = self.server.add_data_bank(3)
+        self.server.start()
+        self.client = ModbusClient(port=5023)
+        self.client.open()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_routing(self):
+        self.bank_2.set_words(0, [2])
+        self.bank_3.set_words(0, [3])
+        self.client.unit_id(2)
+        self.assertEqual(self.client.read_holding_registers(0), [2])
+        self.assertEqual(self.client.write_single_coil(0, True), True)
+        self.assertEqual(self.bank_2.get_bits(0), [True])
+        self.client.unit_id(3)
+        self.assertEqual(self.client.read_holding_registers(0), [3])
+        self.assertEqual(self.client.read_coils(0), [False])
+        # unit ID without data bank: served by the default one or rejected
+        self.client.unit_id(4)
+        self.assertEqual(self.client.read_holding_registers(0), [DataBank.get_int2(0)])
+        self.server.default_data_bank = None
+        self.assertEqual(self.client.read_holding_registers(0), None)
+        self.assertEqual(self.client.last_except(), 0x0a)
+
+    def test_except_unit_id(self):
+        self.assertRaises(ValueError, self.server.add_data_bank, 256)
+
+
+@unittest.skipIf(sys.version_info < (3,), 'workers need Python 3')
+class TestClientServerWorkers(unittest.TestCase):
+
+    def setUp(self):
+        # 2 worker processes on the same port, with a cache in each one
+        self.server = ModbusServer(port=5026, no_block=True, workers=2, cache=True)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_shared_registers(self):
+        self.assertEqual(self.server.is_run, True)
+        # connections land on any worker: all must see every write
+        self.server.default_data_bank.set_words(0, [0x1234])
+        clients = [ModbusClient(port=5026, auto_open=True) for _ in range(8)]
+        for i, client in enumerate(clients):
+            self.assertEqual(client.read_holding_registers(0), [0x1234 + i])
+            self.assertEqual(client.write_single_register(0, 0x1235 + i), True)
+        for client in clients:
+            self.assertEqual(client.read_holding_registers(0), [0x1234 + len(clients)])
+            client.close()
+        self.assertEqual(self.server.default_data_bank.get_int2(0), 0x1234 + len(clients))
+
+    def test_stop(self):
+        self.server.stop()
+        self.assertEqual(self.server.is_run, False)
+        client = ModbusClient(port=5026, auto_open=True)
+        self.assertEqual(client.read_holding_registers(0), None)
+
+    def test_except_workers(self):
+        self.assertRaises(ValueError, ModbusServer, workers=-1)
+
+
+class TestClientServerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ModbusServer(port=5025, no_block=True, cache=True)
+        self.bank = self.server.add_data_bank(1)
+        self.server.start()
+        self.client = ModbusClient(port=5025)
+        self.client.open()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_cache(self):
+        self.assertEqual(self.client.read_holding_registers(0, 10), [0] * 10)
+        self.assertEqual(self.client.read_holding_registers(0, 10), [0] * 10)
+        self.assertEqual(self.server.cache.get_stats(), {'hits': 1, 'misses': 1, 'size': 1})
+        # a write invalidate the cached response
+        self.assertEqual(self.client.write_single_register(5, 42), True)
+        self.assertEqual(self.client.read_holding_registers(0, 10), [0] * 5 + [42] + [0] * 4)
+        self.bank.set_words(0, [1])
+        self.assertEqual(self.client.read_holding_registers(0, 10), [1] + [0] * 4 + [42] + [0] * 4)
+        # bits
+        self.assertEqual(self.client.read_coils(0, 3), [False] * 3)
+        self.assertEqual(self.client.write_single_coil(1, True), True)
+        self.assertEqual(self.client.read_coils(0, 3), [False, True, False])
+        self.assertEqual(self.server.cache.get_stats()['hits'], 1)
+
+
+class TestClientServerMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ModbusServer(port=5027, no_block=True, metrics=True)
+        self.server.add_data_bank(1)
+        self.server.start()
+        self.client = ModbusClient(port=5027)
+        self.client.open()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.server.metrics.stop_http()
+
+    def test_metrics(self):
+        self.assertEqual(self.client.read_holding_registers(0, 10), [0] * 10)
+        self.assertEqual(self.client.write_single_coil(0, False), True)
+        # unit ID not served
+        self.server.default_data_bank = None
+        self.client.unit_id(2)
+        self.assertEqual(self.client.read_holding_registers(0, 10), None)
+        stats = self.server.metrics.get_stats()
+        self.assertEqual(stats['connections'], 1)
+        fc_3 = stats['functions'][0x03]
+        self.assertEqual(fc_3['requests'], 2)
+        self.assertEqual(fc_3['exceptions'], {EXP_GATEWAY_PATH_UNAVAILABLE: 1})
+        self.assertEqual(fc_3['bytes_in'], 24)
+        self.assertEqual(fc_3['bytes_out'], 29 + 9)
+        self.assertEqual(sum(fc_3['latency_counts']), 2)
+        self.assertEqual(stats['units'][1]['requests'], 2)
+        self.assertEqual(stats['units'][2]['requests'], 1)
+
+    def test_prometheus(self):
+        from urllib.request import urlopen
+        self.assertEqual(self.client.write_single_register(0, 0), True)
+        self.server.metrics.start_http(port=9527)
+        text = urlopen('http://localhost:9527/metrics').read().decode()
+        self.assertIn('modbus_functions_requests_total{fc="6"} 1', text)
+        self.assertIn('modbus_units_latency_seconds_bucket{unit="1",le="+Inf"} 1', text)
+        self.assertIn('modbus_connections 1', text)
+
+
+class TestClientServerLimits(unittest.TestCase):
+
+    engine = 'thread'
+    port = 5028
+
+    def setUp(self):
+        self.server = None
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        if self.server:
+            self.server.stop()
+
+    def start_server(self, **kwargs):
+        self.server = ModbusServer(port=self.port, no_block=True, engine=self.engine, **kwargs)
+        self.server.start()
+
+    def connect(self):
+        sock = socket.create_connection(('localhost', self.port))
+        sock.settimeout(2.0)
+        self.socks.append(sock)
+        return sock
+
+    def wait_stats(self, name, value):
+        # server threads update the stats a bit after the client side see the effect
+        for _ in range(50):
+            if self.server.connections.get_stats()[name] == value:
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.server.connections.get_stats()[name], value)
+
+    def test_evict_idle(self):
+        self.start_server(max_connections=2)
+        idle_sock = self.connect()
+        self.connect()
+        self.wait_stats('connections', 2)
+        # the oldest idle connection make room for the new one
+        client = ModbusClient(port=self.port, auto_open=True)
+        self.assertIsNotNone(client.read_coils(0))
+        client.close()
+        self.assertEqual(idle_sock.recv(7), b'')
+        self.assertEqual(self.server.connections.get_stats()['evicted'], 1)
+
+    def test_reject(self):
+        self.start_server(max_connections=1, idle_timeout=5.0)
+        busy_sock = self.connect()
+        # a frame begin: the connection is busy, not idle
+        busy_sock.send(b'\x00\x01\x00')
+        self.wait_stats('connections', 1)
+        time.sleep(0.1)
+        sock = self.connect()
+        self.assertEqual(sock.recv(7), b'')
+        self.wait_stats('rejected', 1)
+
+    def test_idle_timeout(self):
+        self.start_server(idle_timeout=0.2)
+        sock = self.connect()
+        self.assertEqual(sock.recv(7), b'')
+        self.wait_stats('idle_timeout', 1)
+
+    def test_read_timeout(self):
+        self.start_server(read_timeout=0.2)
+        sock = self.connect()
+        sock.send(b'\x00\x01\x00')
+        self.assertEqual(sock.recv(7), b'')
+        self.wait_stats('read_timeout', 1)
+
+    def test_frame_timeout(self):
+        self.start_server(read_timeout=0.4, frame_timeout=0.5)
+        sock = self.connect()
+        # each byte in time for read_timeout, but the frame is not complete
+        for byte in b'\x00\x01\x00\x00':
+            time.sleep(0.1)
+            sock.send(struct.pack('B', byte))
+        self.assertEqual(sock.recv(7), b'')
+        self.wait_stats('frame_timeout', 1)
+
+    def test_timeouts_frames(self):
+        # frames in time are served
+        self.start_server(idle_timeout=1.0, read_timeout=1.0, frame_timeout=1.0)
+        client = ModbusClient(port=self.port, auto_open=True)
+        for _ in range(3):
+            self.assertIsNotNone(client.read_coils(0))
+        client.close()
+
+    def test_except_limits(self):
+        self.assertRaises(ValueError, ModbusServer, max_connections=0)
+        self.assertRaises(ValueError, ModbusServer, idle_timeout=0)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio engine need Python 3.5+')
+class TestClientServerLimitsAsyncio(TestClientServerLimits):
+
+    engine = 'asyncio'
+    port = 5029
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'selectors engine need Python 3.5+')
+class TestClientServerLimitsSelectors(TestClientServerLimits):
+
+    engine = 'selectors'
+    port = 5030
+
+
+class TestClientServerFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ModbusServer(port=5024, no_block=True)
+        self.server.start()
+        self.sock = socket.create_connection(('localhost', 5024), timeout=5.0)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.stop()
+
+    def request(self, fc, data):
+        self.sock.sendall(struct.pack('>HHHBB', 1, 0, len(data) + 2, 1, fc) + data)
+        rx_head = recv_all(self.sock, 7)
+        return recv_all(self.sock, struct.unpack('>HHHB', rx_head)[2] - 1)
+
+    def test_register_function(self):
+        # vendor function code: return the request data reversed
+        def reverse(request):
+            return EXP_NONE, request.data.tobytes()[::-1]
+        self.assertEqual(self.request(0x41, b'abc'), b'\xc1\x01')
+        self.server.register_function(0x41, reverse)
+        self.assertEqual(self.request(0x41, b'abc'), b'\x41cba')
+        # handler except status
+        self.server.register_function(0x41, lambda request: (EXP_DATA_VALUE, None))
+        self.assertEqual(self.request(0x41, b'abc'), b'\xc1\x03')
+        # unregister
+        self.server.register_function(0x41, None)
+        self.assertEqual(self.request(0x41, b'abc'), b'\xc1\x01')
+
+    def test_except_register_function(self):
+        self.assertRaises(ValueError, self.server.register_function, 0x80, lambda request: None)
+        self.assertRaises(ValueError, self.server.register_function, 0x41, 'not callable')
+
+
+class TestClientServerSelectors(TestClientServerAsyncio):
+    engine = 'selectors'
+    port = 5022
+
+    def test_split_frame(self):
+        # frame received in several segments
+        sock = socket.create_connection(('localhost', self.port), timeout=5.0)
+        try:
+            tx_frame = struct.pack('>HHHBBHH', 1, 0, 6, 1, 0x06, 300, 0x4242)
+            for i in range(len(tx_frame)):
+                sock.sendall(tx_frame[i:i + 1])
+                time.sleep(0.01)
+            self.assertEqual(recv_all(sock, 12), tx_frame)
+        finally:
+            sock.close()
+
+
+
+class TestClientPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.data_bank = DataBank()
+        self.server = ModbusServer(port=5031, no_block=True)
+        self.server.add_data_bank(1, self.data_bank)
+        self.server.start()
+        self.client = ModbusClient(port=5031, auto_open=True)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_read_blocks(self):
+        words = [randint(0, 0xffff) for _ in range(500)]
+        self.data_bank.set_words(0, words)
+        requests = [(0x03, i * 10, 10) for i in range(50)]
+        self.assertEqual(self.client.pipeline(requests, window=8),
+                         [words[i * 10:i * 10 + 10] for i in range(50)])
+        # window of 1: one request at a time
+        self.assertEqual(self.client.pipeline(requests[:3], window=1), [words[0:10], words[10:20], words[20:30]])
+
+    def test_functions(self):
+        bits = [bool(getrandbits(1)) for _ in range(20)]
+        requests = [(0x10, 100, [1, 2, 3]), (0x06, 103, 4), (0x0F, 0, bits), (0x05, 20, True),
+                    (0x03, 100, 4), (0x01, 0, 21), (0x02, 0, 1), (0x04, 100, 1)]
+        self.assertEqual(self.client.pipeline(requests),
+                         [True, True, True, True, [1, 2, 3, 4], bits + [True], [bits[0]], [1]])
+        self.assertEqual(self.client.pipeline([]), [])
+
+    def test_except(self):
+        # a bad request fail the whole call, before any send
+        self.assertIsNone(self.client.pipeline([(0x03, 0, 126)]))
+        self.assertIsNone(self.client.pipeline([(0x03, 0xffff, 2)]))
+        self.assertIsNone(self.client.pipeline([(0x07, 0, 1)]))
+        self.assertIsNone(self.client.pipeline([(0x03, 0, 1)], window=0))
+
+    def test_out_of_order(self):
+        # fake server: read 3 requests, then answer them in reverse order
+        listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listen.bind(('localhost', 5032))
+        listen.listen(1)
+
+        def serve():
+            (sock, _) = listen.accept()
+            frames = [recv_all(sock, 12) for _ in range(3)]
+            for frame in reversed(frames):
+                (tr_id, _, _, unit_id, fc, address, number) = struct.unpack('>HHHBBHH', frame)
+                sock.sendall(struct.pack('>HHHBBB%dH' % number, tr_id, 0, 3 + number * 2, unit_id, fc,
+                                         number * 2, *range(address, address + number)))
+            sock.close()
+        serve_th = Thread(target=serve)
+        serve_th.start()
+        client = ModbusClient(port=5032, auto_open=True, timeout=5.0)
+        try:
+            self.assertEqual(client.pipeline([(0x03, 0, 2), (0x03, 10, 1), (0x04, 20, 3)]),
+                             [[0, 1], [10], [20, 21, 22]])
+        finally:
+            client.close()
+            serve_th.join()
+            listen.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import unittest
+from multiprocessing import Process
+from threading import Event, Thread
+from pyModbusTCP import utils
+from pyModbusTCP.server import DataBank, RangeLock, ResponseCache, SharedDataBank
+
+
+class TestDataBankWords(unittest.TestCase):
+
+    def setUp(self):
+        DataBank.clear_registers()
+
+    def test_clear_registers(self):
+        self.assertEqual(DataBank.set_words(0, [0x1234, 0x5678]), True)
+        self.assertEqual(DataBank.clear_registers(), True)
+        self.assertEqual(DataBank.get_words_bytes(0, 2), b'\x00\x00\x00\x00')
+
+    def test_words(self):
+        # write as bytes, int list or 2 bytes items list
+        self.assertEqual(DataBank.set_words(10, b'\x12\x34\x56\x78'), True)
+        self.assertEqual(DataBank.get_words(10, 2), [b'\x12\x34', b'\x56\x78'])
+        self.assertEqual(DataBank.set_words(10, [0xdead, 0xbeef]), True)
+        self.assertEqual(DataBank.get_words_bytes(10, 2), b'\xde\xad\xbe\xef')
+        self.assertEqual(DataBank.set_words(10, [b'\x00\x01']), True)
+        self.assertEqual(DataBank.get_int2(10), 1)
+        # last register
+        self.assertEqual(DataBank.set_words(0xffff, [0x4242]), True)
+        self.assertEqual(DataBank.get_words_bytes(0xffff, 1), b'\x42\x42')
+        # out of range or odd size write
+        self.assertEqual(DataBank.set_words(0xffff, [0, 0]), False)
+        self.assertEqual(DataBank.set_words(0, b'\x00'), False)
+        self.assertEqual(DataBank.get_words_bytes(0xffff, 2), None)
+        self.assertEqual(DataBank.get_words(-1), None)
+
+    def test_typed(self):
+        self.assertEqual(DataBank.set_int4(20, 0xdeadbeef), True)
+        self.assertEqual(DataBank.get_words_bytes(20, 2), b'\xde\xad\xbe\xef')
+        self.assertEqual(DataBank.get_int4(20), 0xdeadbeef)
+        self.assertEqual(DataBank.set_float4(30, 0.5), True)
+        self.assertEqual(DataBank.get_float4(30), 0.5)
+        self.assertEqual(DataBank.set_words(40, b'\x40\x09\x21\xfb\x54\x44\x2d\x18'), True)
+        self.assertAlmostEqual(DataBank.get_double(40, 43), 3.141592653589793)
+        self.assertEqual(DataBank.set_clear_words(20, 21), True)
+        self.assertEqual(DataBank.get_int4(20), 0)
+
+    def test_words_into(self):
+        self.assertEqual(DataBank.set_words(0xfffe, [0x1234, 0x5678]), True)
+        buffer = bytearray(b'\xff' * 6)
+        self.assertEqual(DataBank.get_words_into(buffer, 1, 0xfffe, 2), True)
+        self.assertEqual(buffer, b'\xff\x12\x34\x56\x78\xff')
+        self.assertEqual(DataBank.get_words_into(buffer, 0, 0xffff, 2), False)
+
+    def test_bulk_typed(self):
+        # 1.0 as float32 is 0x3f800000
+        layouts = {'ABCD': b'\x3f\x80\x00\x00', 'CDAB': b'\x00\x00\x3f\x80',
+                   'BADC': b'\x80\x3f\x00\x00', 'DCBA': b'\x00\x00\x80\x3f'}
+        for word_order, raw in layouts.items():
+            self.assertEqual(DataBank.set_floats(0, [1.0, -2.5], word_order=word_order), True)
+            self.assertEqual(DataBank.get_words_bytes(0, 2), raw)
+            self.assertEqual(DataBank.get_floats(0, 2, word_order=word_order), [1.0, -2.5])
+        # 64 bits values: 4 registers
+        self.assertEqual(DataBank.set_doubles(10, [1.0], word_order='CDAB'), True)
+        self.assertEqual(DataBank.get_words_bytes(10, 4), b'\x00\x00\x00\x00\x00\x00\x3f\xf0')
+        self.assertEqual(DataBank.get_doubles(10, 1, word_order='CDAB'), [1.0])
+        self.assertEqual(DataBank.set_int32s(20, [-1, 0x12345678]), True)
+        self.assertEqual(DataBank.get_int32s(20, 2), [-1, 0x12345678])
+        self.assertEqual(DataBank.get_int32s(20, 1, signed=False), [0xffffffff])
+        self.assertEqual(DataBank.set_int32s(20, [0x12345678], word_order='DCBA'), True)
+        self.assertEqual(DataBank.get_words_bytes(20, 2), b'\x78\x56\x34\x12')
+        # out of range
+        self.assertEqual(DataBank.get_floats(0xffff, 1), None)
+        self.assertEqual(DataBank.set_floats(0xfffe, [1.0, 2.0]), False)
+        self.assertEqual(DataBank.set_int32s(0, [1 << 32]), False)
+        self.assertRaises(ValueError, DataBank.get_floats, 0, 1, 'ABDC')
+
+    def test_string(self):
+        self.assertEqual(DataBank.set_string(0, 'abc'), True)
+        self.assertEqual(DataBank.get_words_bytes(0, 2), b'abc\x00')
+        self.assertEqual(DataBank.get_string(0, 2), 'abc')
+        self.assertEqual(DataBank.set_string(0, 'abcd', swap_bytes=True), True)
+        self.assertEqual(DataBank.get_words_bytes(0, 2), b'badc')
+        self.assertEqual(DataBank.get_string(0, 2, swap_bytes=True), 'abcd')
+
+    def test_atomic_ops(self):
+        self.assertEqual(DataBank.set_words(0, [0xff00]), True)
+        self.assertEqual(DataBank.mask_word(0, 0x0ff0, 0x000f), True)
+        self.assertEqual(DataBank.get_words_bytes(0, 1), b'\x0f\x0f')
+        self.assertEqual(DataBank.mask_word(0x10000, 0, 0), False)
+        self.assertEqual(DataBank.write_read_words(1, b'\x00\x01\x00\x02', 0, 3), b'\x0f\x0f\x00\x01\x00\x02')
+        self.assertEqual(DataBank.write_read_words(0xffff, b'\x00\x01\x00\x02', 0, 1), None)
+
+    def test_ascii(self):
+        self.assertEqual(DataBank.set_ascii(50, 53, 'hello'), True)
+        self.assertEqual(DataBank.get_ascii(50, 53), 'hello ')
+
+
+class TestDataBankBits(unittest.TestCase):
+
+    def setUp(self):
+        DataBank.clear_registers()
+
+    def test_bits(self):
+        self.assertEqual(DataBank.set_bits(3, [True, False, True]), True)
+        self.assertEqual(DataBank.get_bits(2, 5), [False, True, False, True, False])
+        self.assertEqual(DataBank.get_bits_bytes(0, 8), b'\x28')
+        # last bit
+        self.assertEqual(DataBank.set_bits(0xffff, [True]), True)
+        self.assertEqual(DataBank.get_bits(0xffff), [True])
+        # out of range
+        self.assertEqual(DataBank.set_bits(0xffff, [True, True]), False)
+        self.assertEqual(DataBank.get_bits(0xffff, 2), None)
+
+    def test_bits_bytes(self):
+        # aligned
+        self.assertEqual(DataBank.set_bits_bytes(16, 16, b'\xa5\x0f'), True)
+        self.assertEqual(DataBank.get_bits_bytes(16, 16), b'\xa5\x0f')
+        self.assertEqual(DataBank.get_bits_bytes(16, 4), b'\x05')
+        # unaligned: neighbour bits are unchanged
+        self.assertEqual(DataBank.set_bits_bytes(14, 4, b'\xff'), True)
+        self.assertEqual(DataBank.get_bits_bytes(8, 16), b'\xc0\xa7')
+        self.assertEqual(DataBank.get_bits_bytes(13, 6), b'\x3e')
+        # 2000 bits at an unaligned address
+        bits_l = [bool(i % 3) for i in range(2000)]
+        self.assertEqual(DataBank.set_bits(1001, bits_l), True)
+        self.assertEqual(DataBank.get_bits(1001, 2000), bits_l)
+        self.assertEqual(DataBank.get_bits(1000, 1), [False])
+        self.assertEqual(DataBank.get_bits(3001, 1), [False])
+
+
+class TestDataBankInstances(unittest.TestCase):
+
+    def test_instances(self):
+        # each data bank has its own bits and words spaces
+        bank_1 = DataBank()
+        bank_2 = DataBank()
+        self.assertEqual(bank_1.set_words(0, [0x1111]), True)
+        self.assertEqual(bank_1.set_bits(0, [True]), True)
+        self.assertEqual(bank_1.get_words(0), [b'\x11\x11'])
+        self.assertEqual(bank_2.get_words(0), [b'\x00\x00'])
+        self.assertEqual(bank_2.get_bits(0), [False])
+        self.assertEqual(DataBank.default().get_int2(0), DataBank.get_int2(0))
+        self.assertIsNot(bank_1, DataBank.default())
+
+    def test_lazy_allocation(self):
+        # spaces are allocated on first write only
+        bank = DataBank()
+        self.assertIs(bank.words, DataBank().words)
+        self.assertEqual(bank.get_float4(0), 0.0)
+        bank.set_int2(0, 1)
+        self.assertIsNot(bank.words, DataBank().words)
+        self.assertIs(bank.bits, DataBank().bits)
+
+    def test_concurrent_writers(self):
+        # writers of 4 threads on 4 stripes: no lost generation bump, no stale cache hit
+        bank = DataBank()
+        cache = ResponseCache()
+        cache.put('key', bank, bank.words_generation, bank.get_words_bytes(0, 1))
+        start = time.time() + 0.1
+        writers = [Thread(target=_stripe_writer, args=(bank, address, 20000, start))
+                   for address in (0x0000, 0x4000, 0x8000, 0xc000)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(bank.words_generation, 80000)
+        self.assertIsNone(cache.get('key', bank, bank.words_generation))
+
+
+class TestDataBankSubscribe(unittest.TestCase):
+
+    def test_subscribe(self):
+        bank = DataBank()
+        bank.coalesce_delay = 0.1
+        changes = []
+        done = Event()
+
+        def on_change(kind, address, number):
+            changes.append((kind, address, number))
+            done.set()
+        sub = bank.subscribe('words', 100, 10, on_change)
+        # out of range and other space writes are ignored, a burst is coalesced
+        bank.set_words(0, [1])
+        bank.set_bits(100, [True])
+        bank.set_words(98, [1, 2, 3])
+        bank.set_words(105, [4])
+        self.assertEqual(done.wait(2.0), True)
+        time.sleep(0.2)
+        self.assertEqual(changes, [('words', 100, 6)])
+        # no more call after unsubscribe
+        self.assertEqual(bank.unsubscribe(sub), True)
+        self.assertEqual(bank.unsubscribe(sub), False)
+        bank.set_words(100, [1])
+        time.sleep(0.2)
+        self.assertEqual(len(changes), 1)
+
+    def test_dispatcher_thread(self):
+        # the dispatcher thread end after the last unsubscribe(), a new one start on next subscribe()
+        bank = DataBank()
+        bank.coalesce_delay = 0.01
+        done = Event()
+        sub = bank.subscribe('bits', 0, 1, lambda kind, address, number: None)
+        thread = bank._dispatch_th
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(bank.unsubscribe(sub), True)
+        thread.join(2.0)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(bank._dispatch_th)
+        bank.subscribe('bits', 0, 1, lambda kind, address, number: done.set())
+        self.assertIsNot(bank._dispatch_th, thread)
+        bank.set_bits(0, [True])
+        self.assertEqual(done.wait(2.0), True)
+
+    def test_except_subscribe(self):
+        bank = DataBank()
+        self.assertRaises(ValueError, bank.subscribe, 'coils', 0, 1, len)
+        self.assertRaises(ValueError, bank.subscribe, 'bits', 0xffff, 2, len)
+        self.assertRaises(ValueError, bank.subscribe, 'bits', 0, 1, None)
+
+
+def _shared_writer(path):
+    data_bank = SharedDataBank(path)
+    data_bank.set_words(0x100, [0x1234, 0x5678])
+    data_bank.set_bits(10, [True, True])
+    data_bank.close()
+
+
+def _stripe_writer(data_bank, address, count, start):
+    # writes to one lock stripe, other writers use other stripes, all of them begin at start
+    while time.time() < start:
+        time.sleep(0.001)
+    for i in range(count):
+        data_bank.set_words(address, [i & 0xffff])
+
+
+def _shared_stripe_writer(path, address, count, start):
+    data_bank = SharedDataBank(path)
+    _stripe_writer(data_bank, address, count, start)
+    data_bank.close()
+
+
+@unittest.skipIf(sys.version_info < (3,), 'SharedDataBank need Python 3')
+class TestSharedDataBank(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_two_processes(self):
+        data_bank = SharedDataBank(self.path)
+        (bits_gen, words_gen) = (data_bank.bits_generation, data_bank.words_generation)
+        writer = Process(target=_shared_writer, args=(self.path,))
+        writer.start()
+        writer.join()
+        self.assertEqual(data_bank.get_words_bytes(0x100, 2), b'\x12\x34\x56\x78')
+        self.assertEqual(data_bank.get_bits(9, 4), [False, True, True, False])
+        self.assertGreater(data_bank.bits_generation, bits_gen)
+        self.assertGreater(data_bank.words_generation, words_gen)
+        self.assertEqual(data_bank.clear_registers(), True)
+        self.assertEqual(data_bank.get_words_bytes(0x100, 2), b'\x00' * 4)
+        data_bank.close()
+
+    def test_concurrent_writers(self):
+        # writers of two processes on two stripes: no lost generation bump, no stale cache hit
+        data_bank = SharedDataBank(self.path)
+        cache = ResponseCache()
+        cache.put('key', data_bank, data_bank.words_generation, data_bank.get_words_bytes(0, 1))
+        start = time.time() + 0.5
+        writers = [Process(target=_shared_stripe_writer, args=(self.path, address, 20000, start))
+                   for address in (0x0000, 0x8000)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(data_bank.words_generation, 40000)
+        self.assertIsNone(cache.get('key', data_bank, data_bank.words_generation))
+        data_bank.close()
+
+    def test_anonymous(self):
+        data_bank = SharedDataBank()
+        data_bank.set_float4(0, 1.5)
+        self.assertEqual(data_bank.get_float4(0), 1.5)
+        data_bank.close()
+
+    def test_except_format(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a data bank image')
+        self.assertRaises(ValueError, SharedDataBank, self.path)
+
+
+class TestDataBankSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_snapshot_restore(self):
+        data_bank = DataBank()
+        data_bank.set_words(0, [0x1234])
+        data_bank.set_words(0xffff, [0x5678])
+        data_bank.set_bits(0x1001, [True])
+        self.assertEqual(data_bank.snapshot(self.path), True)
+        self.assertEqual(os.path.getsize(self.path), 64 + 0x2000 + 0x20000)
+        # load in a new bank or map it
+        restored = DataBank()
+        self.assertEqual(restored.restore(self.path), True)
+        self.assertEqual(restored.get_words_bytes(0xffff, 1), b'\x56\x78')
+        self.assertEqual(restored.get_bits(0x1000, 3), [False, True, False])
+        # SharedDataBank need Python 3
+        if sys.version_info >= (3,):
+            shared = SharedDataBank(self.path)
+            self.assertEqual(shared.get_int2(0), 0x1234)
+            shared.close()
+
+    def test_periodic(self):
+        data_bank = DataBank()
+        data_bank.set_words(10, [42])
+        data_bank.start_snapshots(self.path, 0.05)
+        time.sleep(0.3)
+        data_bank.stop_snapshots()
+        restored = DataBank()
+        restored.restore(self.path)
+        self.assertEqual(restored.get_int2(10), 42)
+
+    def test_concurrent_snapshots(self):
+        # snapshots of the same path at the same time: each one write its own temporary file
+        data_bank = DataBank()
+        data_bank.set_words(10, [42])
+        errors = []
+
+        def snapshots():
+            try:
+                for _ in range(10):
+                    data_bank.snapshot(self.path)
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=snapshots) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        restored = DataBank()
+        self.assertEqual(restored.restore(self.path), True)
+        self.assertEqual(restored.get_int2(10), 42)
+        # no temporary file left
+        (directory, name) = os.path.split(self.path)
+        self.assertEqual([f for f in os.listdir(directory) if f.startswith(name + '.')], [])
+
+    def test_except_restore(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 100)
+        self.assertRaises(ValueError, DataBank().restore, self.path)
+        self.assertRaises(ValueError, DataBank().start_snapshots, self.path, 0)
+
+
+class TestRangeLock(unittest.TestCase):
+
+    def test_readers_share(self):
+        # a second reader don't wait for the first one
+        lock = RangeLock()
+        with lock.reading(0, 10):
+            with lock.reading(0, 10):
+                pass
+        self.assertEqual(lock.contentions, 0)
+
+    def test_stripes(self):
+        # writes on other stripes don't wait, writes on the same stripe do
+        lock = RangeLock(stripe_size=0x1000)
+        with lock.writing(0, 0x1000):
+            with lock.writing(0x1000, 0x1000):
+                pass
+            self.assertEqual(lock.contentions, 0)
+            th = Thread(target=lambda: lock.reading(0xfff, 2).__enter__().__exit__(None, None, None))
+            th.start()
+            th.join(0.2)
+            self.assertEqual(th.is_alive(), True)
+        th.join()
+        self.assertEqual(lock.contentions, 1)
+
+    def test_data_bank_contentions(self):
+        bank = DataBank()
+        bank.set_words(0, [1])
+        self.assertEqual(bank.get_lock_contentions(), {'bits': 0, 'words': 0})
+
+
+
+class _ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.messages = []
+
+    def emit(self, record):
+        self.records.append(record)
+        self.messages.append(record.getMessage())
+
+
+class TestDataBankLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = _ListHandler()
+        self.logger = logging.getLogger('pyModbusTCP.server')
+
+    def tearDown(self):
+        utils.stop_log_queue()
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_register_changes(self):
+        bank = DataBank()
+        utils.start_log_queue([self.handler], name='pyModbusTCP.server')
+        self.assertTrue(utils.log_queue_started())
+        bank.set_words(10, [1, 2, 0xffff], client=('127.0.0.1', 5000))
+        bank.set_bits(3, [True, False, True])
+        # stop wait for the listener thread to handle queued records
+        utils.stop_log_queue()
+        self.assertFalse(utils.log_queue_started())
+        self.assertEqual(self.handler.messages, ['words 10 to 12 write: 1, 2, 65535',
+                                                 'bits 3 to 5 write: True, False, True'])
+        record = self.handler.records[0]
+        self.assertEqual((record.kind, record.address, record.number, record.client),
+                         ('words', 10, 3, ('127.0.0.1', 5000)))
+
+    def test_out_of_lock(self):
+        # records are emitted after the write lock release: a handler can read the written range
+        bank = DataBank()
+        reads = []
+
+        class ReadingHandler(logging.Handler):
+            def emit(self, record):
+                reader = Thread(target=lambda: reads.append(bank.get_words(record.address, record.number)
+                                                            if record.kind == 'words' else
+                                                            bank.get_bits(record.address, record.number)))
+                reader.start()
+                reader.join(2.0)
+        handler = ReadingHandler()
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.DEBUG)
+        try:
+            bank.set_words(10, [1, 2])
+            bank.mask_word(10, 0x00ff, 0x0100)
+            bank.write_read_words(20, b'\x00\x03', 10, 1)
+            bank.set_bits(3, [True])
+        finally:
+            self.logger.removeHandler(handler)
+        self.assertEqual(reads, [[b'\x00\x01', b'\x00\x02'], [b'\x01\x01'], [b'\x00\x03'], [True]])
+
+    def test_disabled(self):
+        bank = DataBank()
+        utils.start_log_queue([self.handler], level=logging.INFO, name='pyModbusTCP.server')
+        bank.set_words(0, [1])
+        bank.set_bits(0, [True])
+        utils.stop_log_queue()
+        self.assertEqual(self.handler.records, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
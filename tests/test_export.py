@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from pyModbusTCP.server import DataBank
+from pyModbusTCP.historian import Historian
+from pyModbusTCP.export import export_ranges, export_history
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'dump.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_csv(self):
+        with open(self.path) as f:
+            return list(csv.reader(f))
+
+    def test_ranges(self):
+        data_bank = DataBank()
+        data_bank.set_words(0, [0xffff, 0x4049, 0x0fdb, 0x4142])
+        data_bank.set_bits(9, [True, False])
+        ranges = [('raw', 0, 1), ('int16', 0, 1), ('float32', 1, 1), ('int32', 1, 1),
+                  ('ascii', 3, 2), ('bits', 9, 2)]
+        self.assertEqual(export_ranges(data_bank, ranges, self.path), self.path)
+        rows = self.read_csv()
+        self.assertEqual(rows[0], ['type', 'address', 'raw', 'value'])
+        self.assertEqual(rows[1], ['raw', '0', 'ffff', '65535'])
+        self.assertEqual(rows[2], ['int16', '0', 'ffff', '-1'])
+        self.assertEqual(rows[3][:3], ['float32', '1', '40490fdb'])
+        self.assertAlmostEqual(float(rows[3][3]), 3.1415927, places=6)
+        self.assertEqual(rows[4], ['int32', '1', '40490fdb', str(0x40490fdb)])
+        self.assertEqual(rows[5], ['ascii', '3', '41420000', 'AB'])
+        self.assertEqual(rows[6:], [['bits', '9', '1', '1'], ['bits', '10', '0', '0']])
+
+    def test_full_image(self):
+        data_bank = DataBank()
+        data_bank.set_words(0xffff, [42])
+        export_ranges(data_bank, [('raw', 0, 0x10000)], self.path)
+        rows = self.read_csv()
+        self.assertEqual(len(rows), 1 + 0x10000)
+        self.assertEqual(rows[-1], ['raw', '65535', '002a', '42'])
+
+    def test_history(self):
+        historian = Historian(os.path.join(self.tmp_dir, 'history.db'), flush_interval=0.05)
+        data_bank = DataBank()
+        data_bank.historian = historian
+        for i in range(1, 6):
+            data_bank.set_words(7, [i])
+        historian.flush()
+        export_history(historian, self.path, chunk_size=2)
+        historian.close()
+        rows = self.read_csv()
+        self.assertEqual(rows[0], ['timestamp', 'kind', 'address', 'old_value', 'new_value', 'client'])
+        self.assertEqual([row[3:5] for row in rows[1:]], [[str(i - 1), str(i)] for i in range(1, 6)])
+
+    def test_except_range(self):
+        self.assertRaises(ValueError, export_ranges, DataBank(), [('int64', 0, 1)], self.path)
+        self.assertRaises(ValueError, export_ranges, DataBank(), [('float64', 0xfffd, 1)], self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
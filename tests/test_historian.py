@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from pyModbusTCP.server import DataBank
+from pyModbusTCP.historian import Historian
+
+
+class TestHistorian(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.historian = Historian(os.path.join(self.tmp_dir, 'history.db'), flush_interval=0.05)
+        self.data_bank = DataBank()
+        self.data_bank.historian = self.historian
+
+    def tearDown(self):
+        self.historian.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_words(self):
+        self.data_bank.set_words(10, [1, 2])
+        self.data_bank.set_words(11, [3], client=('127.0.0.1', 50000))
+        self.historian.flush()
+        rows = [row[1:] for row in self.historian.history()]
+        self.assertEqual(rows, [('words', 10, 0, 1, None),
+                                ('words', 11, 0, 2, None),
+                                ('words', 11, 2, 3, '127.0.0.1:50000')])
+        self.assertEqual(self.historian.get_stats()['committed'], 2)
+
+    def test_bits(self):
+        self.data_bank.set_bits(6, [True, False, True])
+        self.data_bank.set_bits(7, [True])
+        self.historian.flush()
+        rows = [row[1:5] for row in self.historian.history(kind='bits')]
+        self.assertEqual(rows, [('bits', 6, 0, 1), ('bits', 7, 0, 0), ('bits', 8, 0, 1),
+                                ('bits', 7, 0, 1)])
+
+    def test_history_chunks(self):
+        for i in range(25):
+            self.data_bank.set_words(0, [i])
+        self.historian.flush()
+        new_values = [row[4] for row in self.historian.history(chunk_size=10)]
+        self.assertEqual(new_values, list(range(25)))
+
+    def test_queue_full(self):
+        # the write path never block: changes over the queue size are dropped
+        historian = Historian(os.path.join(self.tmp_dir, 'full.db'), max_queue=1)
+        # no more writer thread to empty the queue
+        historian.close()
+        self.assertEqual(historian.record('words', 0, 1, b'\x00\x00', b'\x00\x01'), True)
+        self.assertEqual(historian.record('words', 0, 1, b'\x00\x01', b'\x00\x02'), False)
+        self.assertEqual(historian.get_stats()['dropped'], 1)
+
+    def test_backup(self):
+        self.data_bank.set_words(0, [1])
+        backup_path = self.historian.backup(os.path.join(self.tmp_dir, 'backup.db'))
+        backup = Historian(backup_path)
+        self.assertEqual(len(list(backup.history())), 1)
+        backup.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from pyModbusTCP.server import ModbusServer, DataBank
+from pyModbusTCP.client import ModbusClient
+from pyModbusTCP.plan import ReadPlan
+
+
+class TestReadPlan(unittest.TestCase):
+
+    def test_merge(self):
+        tags = [('a', 3, 0, 'raw', 1), ('b', 3, 10, 'float32', 1), ('c', 3, 30, 'int16', 2),
+                ('d', 3, 120, 'raw', 10), ('e', 1, 5, 'bits', 3), ('f', 1, 1990, 'bits', 20),
+                ('g', 4, 0, 'raw', 1)]
+        plan = ReadPlan(tags, max_gap=16)
+        self.assertEqual(plan.requests, [(1, 5, 3), (1, 1990, 20), (3, 0, 12), (3, 30, 2), (3, 120, 10),
+                                         (4, 0, 1)])
+        # a large gap tolerance merge up to the max request size
+        plan = ReadPlan(tags, max_gap=2000)
+        self.assertEqual(plan.requests, [(1, 5, 3), (1, 1990, 20), (3, 0, 32), (3, 120, 10), (4, 0, 1)])
+        # no gap tolerance: only contiguous or overlapping tags are merged
+        plan = ReadPlan([('a', 3, 0, 'raw', 2), ('b', 3, 1, 'raw', 1), ('c', 3, 2, 'raw', 1), ('d', 3, 4, 'raw', 1)],
+                        max_gap=0)
+        self.assertEqual(plan.requests, [(3, 0, 3), (3, 4, 1)])
+
+    def test_forbidden(self):
+        tags = [('a', 3, 0, 'raw', 1), ('b', 3, 4, 'raw', 1), ('c', 3, 8, 'raw', 1)]
+        self.assertEqual(ReadPlan(tags).requests, [(3, 0, 9)])
+        plan = ReadPlan(tags, forbidden=[(3, 6, 1), (4, 2, 1)])
+        self.assertEqual(plan.requests, [(3, 0, 5), (3, 8, 1)])
+        self.assertRaises(ValueError, ReadPlan, tags, forbidden=[(3, 4, 1)])
+
+    def test_except(self):
+        self.assertRaises(ValueError, ReadPlan, [('a', 3, 0, 'bits', 1)])
+        self.assertRaises(ValueError, ReadPlan, [('a', 1, 0, 'raw', 1)])
+        self.assertRaises(ValueError, ReadPlan, [('a', 6, 0, 'raw', 1)])
+        self.assertRaises(ValueError, ReadPlan, [('a', 3, 0xffff, 'int32', 1)])
+        self.assertRaises(ValueError, ReadPlan, [('a', 3, 0, 'raw', 126)])
+        self.assertRaises(ValueError, ReadPlan, [('a', 3, 0, 'raw', 1), ('a', 3, 1, 'raw', 1)])
+        self.assertRaises(ValueError, ReadPlan, [], max_gap=-1)
+
+    def test_run(self):
+        server = ModbusServer(port=5038, no_block=True)
+        data_bank = server.add_data_bank(1)
+        server.start()
+        client = ModbusClient(port=5038, auto_open=True)
+        try:
+            data_bank.set_floats(10, [1.5])
+            data_bank.set_int32s(20, [-2, 3], signed=True)
+            data_bank.set_string(40, 'ab')
+            data_bank.set_words(300, [7, 8])
+            data_bank.set_bits(3, [True, False, True])
+            tags = [('float', 3, 10, 'float32', 1), ('longs', 3, 20, 'int32', 2), ('text', 3, 40, 'ascii', 2),
+                    ('far', 3, 301, 'raw', 1), ('bits', 1, 3, 'bits', 3), ('input', 4, 300, 'int16', 1)]
+            plan = ReadPlan(tags)
+            self.assertEqual(plan.requests, [(1, 3, 3), (3, 10, 32), (3, 301, 1), (4, 300, 1)])
+            self.assertEqual(plan.run(client), {'float': [1.5], 'longs': [-2, 3], 'text': 'ab', 'far': [8],
+                                                'bits': [True, False, True], 'input': [7]})
+            # a failed request give None values to its tags only
+            values = plan.decode([None, [0] * 32, None, None])
+            self.assertEqual((values['bits'], values['float'], values['text'], values['far']), (None, [0.0], '', None))
+        finally:
+            client.close()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
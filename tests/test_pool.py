@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+from threading import Thread
+from pyModbusTCP.server import ModbusServer
+from pyModbusTCP.pool import ModbusClientPool
+
+
+class TestModbusClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ModbusServer(port=5036, no_block=True)
+        self.server.add_data_bank(1)
+        self.server.add_data_bank(2)
+        self.server.start()
+        self.pool = ModbusClientPool(max_per_host=2, idle_timeout=60.0, timeout=5.0)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_except_init(self):
+        self.assertRaises(ValueError, ModbusClientPool, max_per_host=0)
+        self.assertRaises(ValueError, ModbusClientPool, idle_timeout=0)
+
+    def test_reuse(self):
+        with self.pool.connection('localhost', 5036) as client:
+            self.assertTrue(client.write_single_register(0, 42))
+        with self.pool.connection('localhost', 5036) as client_2:
+            self.assertIs(client_2, client)
+            self.assertEqual(client_2.read_holding_registers(0), [42])
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['connections'], stats['idle']), (1, 1, 1, 1))
+        self.assertRaises(ValueError, self.pool.checkin, client)
+
+    def test_max_per_host(self):
+        client_1 = self.pool.checkout('localhost', 5036, 1)
+        client_2 = self.pool.checkout('localhost', 5036, 1)
+        self.assertIsNot(client_1, client_2)
+        # host full
+        self.assertIsNone(self.pool.checkout('localhost', 5036, 1, wait=0.1))
+        self.assertEqual(self.pool.get_stats()['wait_timeout'], 1)
+        # a waiting thread get the client of a checkin
+        result = []
+        waiter = Thread(target=lambda: result.append(self.pool.checkout('localhost', 5036, 1, wait=5.0)))
+        waiter.start()
+        time.sleep(0.1)
+        self.pool.checkin(client_1)
+        waiter.join()
+        self.assertIs(result[0], client_1)
+        # an idle client of another unit ID is closed to make room
+        self.pool.checkin(client_2)
+        client_3 = self.pool.checkout('localhost', 5036, 2, wait=0.1)
+        self.assertIsNotNone(client_3)
+        self.assertFalse(client_2.is_open())
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['evicted'], stats['connections']), (1, 2))
+        self.pool.checkin(client_1)
+        self.pool.checkin(client_3)
+
+    def test_wake_other_host(self):
+        # waiters of 2 hosts: a checkin wake the waiter of its host, not only the first waiter
+        pool = ModbusClientPool(max_per_host=1)
+        self.addCleanup(pool.close)
+        client_a = pool.checkout('localhost', 5036)
+        client_b = pool.checkout('127.0.0.1', 5036)
+        result = {}
+        waiter_a = Thread(target=lambda: result.update(a=pool.checkout('localhost', 5036, wait=2.0)))
+        waiter_b = Thread(target=lambda: result.update(b=pool.checkout('127.0.0.1', 5036, wait=2.0)))
+        waiter_a.start()
+        time.sleep(0.1)
+        waiter_b.start()
+        time.sleep(0.1)
+        pool.checkin(client_b)
+        waiter_b.join(1.0)
+        self.assertIs(result.get('b'), client_b)
+        pool.checkin(client_a)
+        waiter_a.join()
+        self.assertIs(result.get('a'), client_a)
+        pool.checkin(client_a)
+        pool.checkin(client_b)
+
+    def test_health_check(self):
+        # this server close idle links
+        server = ModbusServer(port=5039, no_block=True, idle_timeout=0.1)
+        server.start()
+        self.addCleanup(server.stop)
+        client = self.pool.checkout('localhost', 5039)
+        self.pool.checkin(client)
+        time.sleep(0.5)
+        client_2 = self.pool.checkout('localhost', 5039)
+        self.assertIsNot(client_2, client)
+        self.assertIsNotNone(client_2.read_holding_registers(0))
+        self.pool.checkin(client_2)
+        self.assertEqual(self.pool.get_stats()['health_failed'], 1)
+        # closed client (link error) is discarded at checkin
+        self.assertIs(self.pool.checkout('localhost', 5039), client_2)
+        client_2.close()
+        self.pool.checkin(client_2)
+        self.assertEqual(self.pool.get_stats()['connections'], 0)
+
+    def test_idle_timeout(self):
+        pool = ModbusClientPool(idle_timeout=0.1)
+        client = pool.checkout('localhost', 5036)
+        pool.checkin(client)
+        self.assertEqual(pool.evict_idle(), 0)
+        time.sleep(0.2)
+        self.assertEqual(pool.evict_idle(), 1)
+        self.assertFalse(client.is_open())
+        self.assertEqual(pool.get_stats()['connections'], 0)
+
+    def test_connect_error(self):
+        self.assertIsNone(self.pool.checkout('localhost', 5037))
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['connect_error'], stats['connections']), (1, 0))
+        # slot released
+        self.assertIsNone(self.pool.checkout('localhost', 5037))
+        self.assertIsNone(self.pool.checkout('localhost', 5037))
+
+
+if __name__ == '__main__':
+    unittest.main()
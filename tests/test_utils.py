@@ -17,6 +17,29 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(utils.get_bits_from_int(6, 4),
                          [False, True, True, False])
 
+    def test_bits_to_bytes(self):
+        self.assertEqual(utils.bits_to_bytes([]), b'')
+        self.assertEqual(utils.bits_to_bytes([True, False, True]), b'\x05')
+        self.assertEqual(utils.bits_to_bytes([False] * 8 + [True]), b'\x00\x01')
+
+    def test_bytes_le_int(self):
+        self.assertEqual(utils.bytes_le_to_int(b''), 0)
+        self.assertEqual(utils.bytes_le_to_int(b'\x34\x12'), 0x1234)
+        self.assertEqual(utils.int_to_bytes_le(0x1234, 3), b'\x34\x12\x00')
+        # Python 2 code path
+        utils._HAS_INT_BYTES = False
+        try:
+            self.assertEqual(utils.bytes_le_to_int(b''), 0)
+            self.assertEqual(utils.bytes_le_to_int(bytearray(b'\x34\x12')), 0x1234)
+            self.assertEqual(utils.int_to_bytes_le(0x1234, 3), b'\x34\x12\x00')
+            self.assertEqual(utils.bits_to_bytes([False] * 8 + [True]), b'\x00\x01')
+        finally:
+            utils._HAS_INT_BYTES = True
+
+    def test_bytes_to_bits(self):
+        self.assertEqual(utils.bytes_to_bits(b'\x05', 3), [True, False, True])
+        self.assertEqual(utils.bytes_to_bits(b'\x00\x01', 9), [False] * 8 + [True])
+
     def test_decode_ieee(self):
         # test IEEE NaN
         self.assertTrue(math.isnan(utils.decode_ieee(0x7fffffff)))